@@ -0,0 +1,225 @@
+"""
+AI result caching for the playground (stdlib only).
+
+AI functions are billed per call, so repeated AI queries are answered from a
+two-tier cache: a byte-bounded in-process LRU shared by all sessions, in front
+of a Snowflake table that keeps results across app restarts. Concurrent callers
+of the same query share one run. The app supplies the statement runner and the
+row (de)serializers, so this module needs no Snowflake session:
+
+    cache = AIResultCache(64 * 1024 * 1024, "DB.SCHEMA.AI_RESULT_CACHE", run_sql, serialize_rows, deserialize_rows)
+    result, error, source = cache.fetch(key, signature, lambda: run_query(query))
+
+SizedLRUCache is also used by the app for stage files and rendered PDF pages.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+TTL_SECONDS = 24 * 60 * 60
+URL_TTL_SECONDS = 3000  # Results holding presigned/scoped URLs expire before the URLs do
+TABLE_RETRY_SECONDS = 30  # After a cache table error, memory only for this long (doubling up to the max)
+TABLE_RETRY_MAX_SECONDS = 600
+
+
+class SizedLRUCache:
+    """Thread-safe LRU cache that evicts least recently used entries beyond a byte budget"""
+
+    def __init__(self, max_bytes, on_evict=None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.total_bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store a value with its size in bytes; values larger than the budget are skipped"""
+        if size > self.max_bytes:
+            return False
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                old_key, (old_value, old_size) = self._entries.popitem(last=False)
+                self.total_bytes -= old_size
+                self.evictions += 1
+                evicted.append((old_key, old_value))
+        if self.on_evict:
+            for old_key, old_value in evicted:
+                self.on_evict(old_key, old_value)
+        return True
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self.total_bytes -= entry[1]
+        if self.on_evict:
+            self.on_evict(key, entry[0])
+        return entry[0]
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def clear(self):
+        for key in self.keys():
+            self.pop(key)
+
+
+class AIResultCache:
+    """Two-tier AI result cache: in-process LRU in front of the AI_RESULT_CACHE table"""
+
+    def __init__(self, max_bytes, table, run_sql, serialize, deserialize, ttl_seconds=TTL_SECONDS,
+                 url_ttl_seconds=URL_TTL_SECONDS, retry_seconds=TABLE_RETRY_SECONDS,
+                 retry_max_seconds=TABLE_RETRY_MAX_SECONDS):
+        self.memory = SizedLRUCache(max_bytes)
+        self.table = table
+        self.run_sql = run_sql  # run_sql(query, params) -> rows
+        self.serialize = serialize  # rows -> JSON string
+        self.deserialize = deserialize  # JSON string -> rows
+        self.ttl_seconds = ttl_seconds
+        self.url_ttl_seconds = url_ttl_seconds
+        self.retry_seconds = retry_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.table_failures = 0
+        self.table_retry_at = 0.0
+        self.stats = {'memory_hits': 0, 'table_hits': 0, 'misses': 0, 'stores': 0, 'coalesced': 0}
+        self._in_flight = {}  # cache key -> {'done': Event, 'result', 'error'} for queries being run
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _run_table_query(self, query, params):
+        """Run a cache table statement, falling back to memory only while the table is failing"""
+        if time.time() < self.table_retry_at:
+            return None
+        try:
+            rows = self.run_sql(query, params)
+        except Exception:
+            with self._lock:
+                self.table_failures += 1
+                backoff = self.retry_seconds * 2 ** min(self.table_failures - 1, 10)
+                self.table_retry_at = time.time() + min(backoff, self.retry_max_seconds)
+            return None
+        self.table_failures = 0
+        return rows
+
+    def _memory_rows(self, key):
+        entry = self.memory.get(key)
+        if entry and (entry[1] is None or entry[1] > time.time()):
+            return self.deserialize(entry[0])
+        return None
+
+    def lookup(self, key):
+        """Return cached rows for a key, or None on a miss (counted by fetch, once per query actually run)"""
+        rows = self._memory_rows(key)
+        if rows is not None:
+            self._count('memory_hits')
+            return rows
+        rows = self._run_table_query(f"""
+            SELECT result_json, DATE_PART(EPOCH_SECOND, expires_at) as expires_epoch
+            FROM {self.table}
+            WHERE cache_key = ? AND expires_at > CURRENT_TIMESTAMP()
+        """, [key])
+        if rows:
+            payload = rows[0]['RESULT_JSON']
+            self.memory.put(key, (payload, rows[0]['EXPIRES_EPOCH']), len(payload))
+            self._count('table_hits')
+            return self.deserialize(payload)
+        return None
+
+    def store(self, key, signature, rows):
+        """Cache the rows returned by an AI query in both tiers"""
+        try:
+            payload = self.serialize(rows)
+        except Exception:
+            return
+        expires_at = int(time.time()) + (self.url_ttl_seconds if signature['expires'] else self.ttl_seconds)
+        self.memory.put(key, (payload, expires_at), len(payload))
+        self._count('stores')
+        self._run_table_query(f"""
+            MERGE INTO {self.table} t
+            USING (
+                SELECT ? as cache_key, ? as function_names, ? as model_names, ? as options,
+                       ? as input_hash, ? as result_json, TO_TIMESTAMP_LTZ(?) as expires_at
+            ) s
+            ON t.cache_key = s.cache_key
+            WHEN MATCHED THEN UPDATE SET
+                result_json = s.result_json, expires_at = s.expires_at, created_at = CURRENT_TIMESTAMP()
+            WHEN NOT MATCHED THEN INSERT (cache_key, function_names, model_names, options, input_hash, result_json, expires_at)
+                VALUES (s.cache_key, s.function_names, s.model_names, s.options, s.input_hash, s.result_json, s.expires_at)
+        """, [key, ','.join(signature['functions']), ','.join(signature['models']),
+              ','.join(signature['options']), signature['input_hash'], payload, expires_at])
+
+    def fetch(self, key, signature, run):
+        """Return (result, error, source): cached rows, or the outcome of one run() shared by all concurrent callers"""
+        # source is 'ai_cache' for a hit, 'coalesced' for a caller that waited on another
+        # caller's run(), and None for the caller that ran the query itself
+        rows = self.lookup(key)
+        if rows is not None:
+            return rows, None, 'ai_cache'
+        with self._lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                rows = self._memory_rows(key)  # stored by a run that finished since lookup()
+                if rows is not None:
+                    self.stats['memory_hits'] += 1
+                    return rows, None, 'ai_cache'
+                self.stats['misses'] += 1
+                # The error stands if the running script is stopped before run() returns
+                flight = self._in_flight[key] = {'done': threading.Event(), 'result': None,
+                                                 'error': "The shared query was interrupted - please retry"}
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            flight['done'].wait()
+            result = list(flight['result']) if flight['result'] is not None else None
+            return result, flight['error'], 'coalesced'
+        try:
+            flight['result'], flight['error'] = run()
+            if flight['error'] is None:
+                self.store(key, signature, flight['result'])
+        except Exception as e:
+            flight['error'] = str(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight['done'].set()
+        return flight['result'], flight['error'], None
+
+    def clear(self):
+        """Empty both cache tiers"""
+        self.memory.clear()
+        self._run_table_query(f"DELETE FROM {self.table}", [])
+
+    def snapshot(self):
+        """Return hit/miss counters and memory usage"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['entries'] = len(self.memory)
+        stats['bytes'] = self.memory.total_bytes
+        stats['evictions'] = self.memory.evictions
+        stats['table_retry_in'] = max(0, int(self.table_retry_at - time.time()))
+        stats['in_flight'] = len(self._in_flight)
+        return stats
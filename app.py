@@ -6,9 +6,25 @@
 # =============================================================================
 
 import streamlit as st
+from snowflake.snowpark import Row, Session
 from snowflake.snowpark.context import get_active_session
+import base64
+import hashlib
+import io
 import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+import zlib
 import pypdfium2 as pdfium
+from ai_cache import AIResultCache, SizedLRUCache
+from cortex_stream import completion_request, stream_complete
+from usage_report import aggregate_usage
 
 # Configure page - MUST be first Streamlit command
 st.set_page_config(
@@ -18,8 +34,28 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Query mode: "live" runs against Snowflake, "record" also saves every result to the
+# local query store, "replay" answers every query from that store without a session,
+# and "local" runs every query on the in-process DuckDB engine in local_engine.py
+QUERY_MODES = ("live", "record", "replay", "local")
+QUERY_MODE = os.environ.get("PLAYGROUND_QUERY_MODE", "live").strip().lower()
+if QUERY_MODE not in QUERY_MODES:
+    # A typo would otherwise silently run live against Snowflake
+    st.error(f"❌ Unknown PLAYGROUND_QUERY_MODE '{QUERY_MODE}': use one of {', '.join(QUERY_MODES)}")
+    st.stop()
+QUERY_STORE_PATH = os.environ.get("PLAYGROUND_QUERY_STORE", "playground_queries.sqlite")
+# Simulated seconds per AI function call in local mode
+LOCAL_AI_LATENCY_SECONDS = float(os.environ.get("PLAYGROUND_LOCAL_AI_LATENCY", "0"))
+
 # Initialize Snowflake session
-session = get_active_session()
+if QUERY_MODE in ("replay", "local"):
+    session = None
+else:
+    try:
+        session = get_active_session()
+    except Exception:
+        # Outside Streamlit in Snowflake: connect with the local connection configuration
+        session = Session.builder.getOrCreate()
 
 # =============================================================================
 # CONFIGURATION & STYLING
@@ -45,6 +81,96 @@ AI_COMPLETE_MODELS = [
     "openai-gpt-5-mini"
 ]
 
+# AI Result Cache Settings
+# Repeated AI queries are served from an in-process LRU shared by all sessions,
+# backed by a Snowflake table so results survive app restarts
+AI_CACHE_TABLE = "AI_FUNCTIONS_PLAYGROUND.DEMO.AI_RESULT_CACHE"
+AI_CACHE_MAX_BYTES = 64 * 1024 * 1024
+AI_CACHE_TTL_SECONDS = 24 * 60 * 60
+AI_CACHE_URL_TTL_SECONDS = 3000  # Results holding presigned/scoped URLs expire before the URLs do
+AI_CACHE_TABLE_RETRY_SECONDS = 30  # After a cache table error, memory only for this long (doubling up to the max)
+AI_CACHE_TABLE_RETRY_MAX_SECONDS = 600
+
+# Metadata Cache Settings
+# Stage listings, row counts and reference lists are shared by all sessions and
+# refreshed in the background once stale; app writes invalidate them immediately
+METADATA_TTL_SECONDS = 600
+
+# Stage URL Cache Settings
+# Presigned URLs are generated for a whole stage in one query and re-generated in
+# the background once they are within the refresh margin of expiring
+PRESIGNED_URL_TTL_SECONDS = 3600
+SCOPED_URL_TTL_SECONDS = 24 * 3600
+URL_REFRESH_MARGIN_SECONDS = 300
+STAGE_URL_RETRY_SECONDS = 30  # After a failed stage listing, URLs are generated per file for this long
+
+# Stage File Cache Settings
+# Downloaded stage files (PDFs) are kept in memory for every session up to this budget
+STAGE_FILE_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+# PDF Viewer Settings
+# Rendered page images are shared by all sessions; neighbouring pages are rendered
+# ahead of time on a background thread. Pages are rasterized to fit the viewer
+# width (about twice a half-page column, so text stays sharp on high-DPI screens)
+# and sent as compressed images; full resolution is rendered only when asked for
+PDF_PAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+PDF_VIEWER_WIDTH_PX = 1000
+PDF_FULL_RES_SCALE = 3
+PDF_IMAGE_FORMAT = "JPEG"
+PDF_IMAGE_QUALITY = 80
+PDF_PREFETCH_PAGES = 2
+# Open pdfium documents are shared by all sessions under this budget (file size as
+# a proxy for handle memory) and closed after this long without a page view
+PDF_OPEN_DOCUMENTS_MAX_BYTES = 64 * 1024 * 1024
+PDF_DOCUMENT_IDLE_SECONDS = 300
+
+# Stage File Versions
+# Version of a stage file as seen by DIRECTORY() (alias d): content hash, or the
+# upload time when the stage reports neither MD5 nor ETAG
+STAGE_FILE_VERSION_SQL = "COALESCE(d.MD5, d.ETAG, TO_VARCHAR(d.LAST_MODIFIED))"
+
+# Async Query Settings
+# Per-file AI jobs are submitted with collect_nowait() and polled, at most this many at once
+ASYNC_QUERY_CONCURRENCY = 8
+ASYNC_POLL_SECONDS = 0.25
+
+# Streaming Completion Settings
+# Token streaming uses the Cortex REST endpoint (server-sent events) of the current
+# account; set CORTEX_STREAM_URL to point it at a stand-in server such as
+# cortex_stream_stub.py. In Streamlit in Snowflake the token is read from this
+# secret, bound to the app together with its external access integration
+CORTEX_STREAM_URL = os.environ.get("CORTEX_STREAM_URL")
+CORTEX_STREAM_SECRET = "cortex_stream_token"
+
+# Embedding Index Settings
+# Text is embedded once with AI_EMBED and compared with VECTOR_COSINE_SIMILARITY;
+# the VECTOR(FLOAT, 1024) columns in setup_database.sql match these models
+EMBEDDING_MODEL = "snowflake-arctic-embed-l-v2.0"
+IMAGE_EMBEDDING_MODEL = "voyage-multimodal-3"
+# Default candidate window for duplicate ticket detection: each ticket is compared with
+# this many tickets on either side of it in ticket_id order (0 compares every pair).
+# A window keeps the work linear in the table size; the UI lets users widen it
+TICKET_SIMILARITY_WINDOW = 500
+
+# Call Analytics Settings
+# Audio files are transcribed and analyzed in batches of this many files per statement
+CALL_ANALYTICS_BATCH_SIZE = 100
+
+# Query Instrumentation Settings
+# Every query run through the query helpers is recorded as a span in the session;
+# the most recent spans are kept for the sidebar's slowest-query list. Statements
+# carry a JSON QUERY_TAG (app, page, example, model) so ACCOUNT_USAGE can group them
+QUERY_SPAN_HISTORY = 500
+QUERY_TAG_APP = "ai_functions_playground"
+PERF_SLOWEST_QUERIES = 5
+
+# Bulk Enrichment Settings
+# Bulk AI_COMPLETE jobs split their source table into key ranges of this many rows;
+# each range is written to the job's target table and checkpointed in ENRICHMENT_BATCHES.
+# A range claimed by a run that never finished it can be reclaimed after the timeout
+ENRICHMENT_BATCH_SIZE = 500
+ENRICHMENT_CLAIM_TIMEOUT_MINUTES = 60
+
 # Custom CSS for Snowflake branding
 st.markdown(f"""
 <style>
@@ -194,16 +320,90 @@ def show_header():
     """Display the app header"""
     st.markdown('<div class="main-header"><h1>❄️ Snowflake Cortex AI Functions Playground ❄️</h1><p>Powered by Cortex AI - Explore Every Function</p></div>', unsafe_allow_html=True)
 
-def execute_query(query):
-    """Execute a Snowflake query and return results"""
+def execute_query(query, use_cache=True):
+    """Execute a Snowflake query and return results (repeated AI calls are served from cache)"""
+    started = time.time()
+    signature = describe_ai_call(query) if use_cache else None
+    if not signature:
+        return run_query(query, started)
+    versions = source_table_versions(signature['tables'])
+    for stage in signature['stages']:
+        versions[f"@{stage}"] = stage_listing_version(stage)
+    if None in versions.values():
+        return run_query(query, started)  # A stage that can't be listed has no version to key a cached result on
+    cache_key = ai_cache_key(signature, versions)
+    result, error, source = get_ai_result_cache().fetch(cache_key, signature, lambda: run_query(query, started))
+    if source:
+        record_query_span(query, started, result, error, source=source)
+    return result, error
+
+def run_query(query, started):
+    """Run a query with its query tag, recording its span and invalidating metadata it writes to"""
+    query_id = None
     try:
-        result = session.sql(query).collect()
-        return result, None
+        if session is None:
+            result = run_sql(query)
+        else:
+            with session.query_history() as history:
+                result = run_sql(query, statement_params=query_tag_params(query))
+            query_id = next((record.query_id for record in reversed(history.queries) if record.sql_text == query), None)
     except Exception as e:
+        record_query_span(query, started, error=str(e))
         return None, str(e)
+    finally:
+        invalidate_metadata(*written_tables(query))
+    record_query_span(query, started, result, query_id=query_id)
+    return result, None
+
+def run_async_jobs(queries, statement_params, on_done, max_concurrency=ASYNC_QUERY_CONCURRENCY):
+    """Submit {key: query} as async jobs with statement_params(query), at most max_concurrency at a time,
+    calling on_done(key, job, started, result, error) as each one finishes"""
+    pending = list(queries.items())
+    running = {}
+    started = {}
+    
+    def finish(key, result, error):
+        on_done(key, running.pop(key, None), started[key], result, error)
+    
+    while pending or running:
+        while pending and len(running) < max_concurrency:
+            key, query = pending.pop(0)
+            started[key] = time.time()
+            try:
+                running[key] = submit_sql(query, statement_params=statement_params(query))
+            except Exception as e:
+                finish(key, None, str(e))
+        
+        for key, job in list(running.items()):
+            if not job.is_done():
+                continue
+            try:
+                finish(key, job.result(), None)
+            except Exception as e:
+                finish(key, None, str(e))
+        
+        if running:
+            time.sleep(ASYNC_POLL_SECONDS)
+
+def execute_queries_async(queries, max_concurrency=ASYNC_QUERY_CONCURRENCY, on_done=None):
+    """Run {key: query} as async Snowflake jobs, at most max_concurrency at a time, and return {key: (result, error)}"""
+    outcomes = {}
+    
+    def finish(key, job, started, result, error):
+        record_query_span(queries[key], started, result, error, getattr(job, 'query_id', None))
+        outcomes[key] = (result, error)
+        if on_done:
+            on_done(key, result, error)
+    
+    try:
+        run_async_jobs(queries, query_tag_params, finish, max_concurrency)
+    finally:
+        invalidate_metadata(*set().union(*(written_tables(query) for query in queries.values())))
+    return outcomes
 
 def show_example_card(title, description, example_num):
     """Display a styled example card"""
+    set_query_context(example=example_num)
     st.markdown(f"""
     <div class="demo-card">
         <h4>📌 Example {example_num}: {title}</h4>
@@ -234,17 +434,1998 @@ def show_multimodal_support(text=True, images=False, documents=False, audio=Fals
         🎯 {caps_str}
     </span>"""
 
-def display_pdf_page():
-    """Display the current PDF page as an image"""
-    pdf = st.session_state['pdf_doc']
-    page_index = st.session_state['pdf_page']
+def load_pdf(state_key, stage, path, version=None):
+    """Point a viewer at a stage PDF, releasing the document it showed before"""
+    page_cache = get_pdf_page_cache()
+    viewer = f"{st.session_state.setdefault('pdf_viewer_session', os.urandom(8).hex())}:{state_key}"
+    if st.session_state.get(f'{state_key}_url') == path:
+        if not page_cache.touch(st.session_state[f'{state_key}_hash'], viewer):
+            # The registry dropped this viewer while the session sat idle; re-register on the same page
+            st.session_state[f'{state_key}_hash'] = page_cache.open(stage, path, version, viewer)
+        return
+    if f'{state_key}_hash' in st.session_state:
+        page_cache.release(st.session_state[f'{state_key}_hash'], viewer)
+    # Only the document hash is kept per session; the open handle lives in the shared page cache
+    st.session_state[f'{state_key}_hash'] = page_cache.open(stage, path, version, viewer)
+    st.session_state[f'{state_key}_url'] = path
+    st.session_state[f'{state_key}_page'] = 0
+
+def change_pdf_page(state_key, step):
+    """Move a PDF viewer forward or back by step pages"""
+    st.session_state[f'{state_key}_page'] += step
+
+def display_pdf_page(state_key='pdf', width=PDF_VIEWER_WIDTH_PX):
+    """Display the current PDF page as an image with page navigation"""
+    doc_hash = st.session_state[f'{state_key}_hash']
+    page_cache = get_pdf_page_cache()
+    page_count = page_cache.page_count(doc_hash)
+    page_index = max(0, min(st.session_state[f'{state_key}_page'], page_count - 1))
+    st.session_state[f'{state_key}_page'] = page_index
+    
+    if page_count > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            st.button("◀ Prev", key=f"{state_key}_prev", disabled=page_index == 0,
+                      on_click=change_pdf_page, args=(state_key, -1), use_container_width=True)
+        with col2:
+            st.caption(f"Page {page_index + 1} of {page_count}")
+        with col3:
+            st.button("Next ▶", key=f"{state_key}_next", disabled=page_index >= page_count - 1,
+                      on_click=change_pdf_page, args=(state_key, 1), use_container_width=True)
     
-    # Render the page to an image
-    page = pdf[page_index]
-    pil_image = page.render(scale=2).to_pil()
+    full_res = st.toggle("🔎 Full resolution", key=f"{state_key}_full_res",
+                         help="Render this page at full resolution for zooming into fine print")
+    
+    # Render the page to a compressed image (served from the page cache after the first view)
+    image_bytes = page_cache.render(doc_hash, page_index, None if full_res else width)
     
     # Display the image
-    st.image(pil_image, use_container_width=True)
+    st.image(image_bytes, use_container_width=True)
+    
+    # Warm the pages the reader is most likely to open next (at the viewer size only)
+    neighbours = [page_index + offset for offset in range(1, PDF_PREFETCH_PAGES + 1)] + [page_index - 1]
+    page_cache.prefetch(doc_hash, [p for p in neighbours if 0 <= p < page_count], width)
+
+# =============================================================================
+# QUERY INSTRUMENTATION
+# =============================================================================
+# Each query helper call is recorded as a span (wall time, query ID, rows, approximate
+# result bytes) attributed to the page and example that issued it. Spans live in the
+# session; the sidebar shows this rerun, the session totals and the slowest queries.
+
+def set_query_context(page=None, example=None):
+    """Attribute the queries that follow to a page (resetting the example) and/or an example"""
+    context = st.session_state.setdefault('query_context', {'page': None, 'example': None})
+    if page is not None:
+        context.update(page=page, example=None)
+    if example is not None:
+        context['example'] = example
+
+def query_tag_params(query=None, component=None):
+    """Statement parameters that set a JSON QUERY_TAG: the app plus the page, example and model
+    that issued the statement, or the app component for shared background queries"""
+    tag = {'app': QUERY_TAG_APP}
+    if component:
+        tag['component'] = component
+    else:
+        context = st.session_state.get('query_context', {})
+        tag.update(page=context.get('page'), example=context.get('example'))
+    if query:
+        models = AI_MODEL_PATTERN.findall(query)
+        if models:
+            tag['model'] = models[0]
+    return {"QUERY_TAG": json.dumps(tag, separators=(',', ':'))}
+
+def start_query_run():
+    """Begin a new rerun for the per-rerun query totals"""
+    st.session_state['query_run'] = st.session_state.get('query_run', 0) + 1
+
+def result_bytes(rows):
+    """Approximate result size: the length of each value's text form"""
+    return sum(len(str(value)) for row in rows or [] for value in row)
+
+def record_query_span(query, started, result=None, error=None, query_id=None, source='snowflake'):
+    """Record one finished query against the current page and example"""
+    context = st.session_state.get('query_context', {})
+    span = {
+        'run': st.session_state.get('query_run', 0),
+        'page': context.get('page'),
+        'example': context.get('example'),
+        'source': source,
+        'seconds': time.time() - started,
+        'query_id': query_id,
+        'rows': len(result) if result is not None else 0,
+        'bytes': result_bytes(result),
+        'error': error,
+        'query': normalize_sql(query)
+    }
+    spans = st.session_state.setdefault('query_spans', [])
+    spans.append(span)
+    del spans[:-QUERY_SPAN_HISTORY]
+    totals = st.session_state.setdefault('query_totals', {'queries': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0, 'errors': 0})
+    totals['queries'] += 1
+    totals['seconds'] += span['seconds']
+    totals['rows'] += span['rows']
+    totals['bytes'] += span['bytes']
+    totals['errors'] += 1 if error else 0
+
+def show_perf_sidebar():
+    """Display query timings for this rerun and this session, with the slowest queries"""
+    spans = st.session_state.get('query_spans', [])
+    run_spans = [span for span in spans if span['run'] == st.session_state.get('query_run', 0)]
+    totals = st.session_state.get('query_totals', {'queries': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0, 'errors': 0})
+    with st.sidebar.expander("⏱️ Query Performance"):
+        st.markdown("**This Rerun**")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Queries", len(run_spans))
+        with col2:
+            st.metric("Query Time", f"{sum(span['seconds'] for span in run_spans):.2f}s")
+        st.caption(f"{sum(span['rows'] for span in run_spans)} rows · "
+                   f"{sum(span['bytes'] for span in run_spans) / 1024:.1f} KB · "
+                   f"{sum(1 for span in run_spans if span['source'] == 'ai_cache')} AI cache hits · "
+                   f"{sum(1 for span in run_spans if span['source'] == 'coalesced')} shared in-flight · "
+                   f"{sum(1 for span in run_spans if span['source'] == 'metadata')} metadata lookups")
+        
+        if QUERY_MODE == "local":
+            usage = get_local_engine().usage()
+            st.caption(f"🦆 Local mode · {sum(u['calls'] for u in usage.values())} simulated AI calls · "
+                       f"{sum(u['tokens'] for u in usage.values())} tokens · "
+                       f"{sum(u['credits'] for u in usage.values()):.4f} credits")
+        elif QUERY_MODE != "live":
+            store_stats = get_query_store().snapshot()
+            st.caption(f"📼 {QUERY_MODE.title()} mode · {QUERY_STORE_PATH} · {store_stats['results']} results · "
+                       f"{store_stats['files']} files · {store_stats['hits']} replayed · {store_stats['misses']} missing")
+        
+        st.markdown("**This Session**")
+        st.caption(f"{totals['queries']} queries · {totals['seconds']:.2f}s · {totals['rows']} rows · "
+                   f"{totals['bytes'] / (1024 * 1024):.1f} MB · {totals['errors']} errors")
+        
+        slowest = sorted(spans, key=lambda span: span['seconds'], reverse=True)[:PERF_SLOWEST_QUERIES]
+        if slowest:
+            st.markdown("**Slowest Queries**")
+            st.dataframe([{
+                'Seconds': round(span['seconds'], 3),
+                'Page': span['page'],
+                'Example': span['example'],
+                'Rows': span['rows'],
+                'Source': span['source'],
+                'Query ID': span['query_id'],
+                'SQL': span['query'][:120]
+            } for span in slowest], use_container_width=True, hide_index=True)
+        if st.button("Reset Timings", key="reset_query_timings"):
+            for key in ('query_spans', 'query_totals'):
+                st.session_state.pop(key, None)
+            st.rerun()
+
+# =============================================================================
+# QUERY RECORD / REPLAY
+# =============================================================================
+# Every statement and stage download goes through run_sql / submit_sql /
+# read_stage_bytes. In record mode their results are also written to a local
+# sqlite file (rows as zlib-compressed JSON, keyed by normalized SQL and bind
+# parameters); in replay mode they are answered from that file with no session,
+# so runs are fast, deterministic and work offline. In local mode they run on
+# the DuckDB engine from local_engine.py instead.
+
+class QueryStore:
+    """Local sqlite store of recorded statement results and stage files"""
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'recorded': 0}
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, query TEXT, rows BLOB, recorded_at REAL)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (location TEXT PRIMARY KEY, data BLOB, recorded_at REAL)")
+
+    @staticmethod
+    def key(query, params=None):
+        normalized = normalize_sql(query) + "\n" + json.dumps(params or [], default=str)
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def get(self, query, params=None):
+        """Return the recorded rows for a statement, or None if it was never recorded"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT rows FROM results WHERE key = ?", (self.key(query, params),)).fetchone()
+        self._count('hits' if row else 'misses')
+        return deserialize_rows(zlib.decompress(row[0]).decode('utf-8')) if row else None
+
+    def put(self, query, params, rows):
+        payload = zlib.compress(serialize_rows(rows).encode('utf-8'))
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                     (self.key(query, params), normalize_sql(query), payload, time.time()))
+        self._count('recorded')
+
+    def get_file(self, location):
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM files WHERE location = ?", (location,)).fetchone()
+        self._count('hits' if row else 'misses')
+        return zlib.decompress(row[0]) if row else None
+
+    def put_file(self, location, data):
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                                     (location, zlib.compress(data), time.time()))
+        self._count('recorded')
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['results'] = self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            stats['files'] = self._connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return stats
+
+@st.cache_resource
+def get_query_store():
+    """Process-wide query store for record and replay modes"""
+    return QueryStore(QUERY_STORE_PATH)
+
+@st.cache_resource
+def get_local_engine():
+    """Process-wide local DuckDB engine for local mode (needs duckdb and sqlglot)"""
+    from local_engine import LocalEngine
+    return LocalEngine(latency_per_call=LOCAL_AI_LATENCY_SECONDS)
+
+class ReplayedJob:
+    """Completed stand-in for an AsyncJob whose result comes from the query store or local engine"""
+
+    query_id = None
+
+    def __init__(self, query):
+        self.query = query
+
+    def is_done(self):
+        return True
+
+    def result(self):
+        return run_sql(self.query)
+
+class RecordingJob:
+    """AsyncJob wrapper that records the result when it is collected"""
+
+    def __init__(self, job, query):
+        self._job = job
+        self.query = query
+        self.query_id = job.query_id
+
+    def is_done(self):
+        return self._job.is_done()
+
+    def result(self):
+        rows = self._job.result()
+        get_query_store().put(self.query, None, rows)
+        return rows
+
+def run_sql(query, params=None, statement_params=None):
+    """Run a statement and return its rows: live, live and recorded, replayed, or on the local engine"""
+    if QUERY_MODE == "local":
+        return get_local_engine().run(query, params)
+    if QUERY_MODE == "replay":
+        rows = get_query_store().get(query, params)
+        if rows is None:
+            raise LookupError(f"No recorded result for this query in {QUERY_STORE_PATH}")
+        return rows
+    rows = session.sql(query, params=params).collect(statement_params=statement_params)
+    if QUERY_MODE == "record":
+        get_query_store().put(query, params, rows)
+    return rows
+
+def submit_sql(query, statement_params=None):
+    """Start a statement asynchronously and return a job with is_done(), result() and query_id"""
+    if QUERY_MODE in ("replay", "local"):
+        return ReplayedJob(query)
+    job = session.sql(query).collect_nowait(statement_params=statement_params)
+    return RecordingJob(job, query) if QUERY_MODE == "record" else job
+
+def read_stage_bytes(location):
+    """Download a stage file: live, live and recorded, replayed, or from sample_files in local mode"""
+    if QUERY_MODE == "local":
+        return get_local_engine().read_file(location)
+    if QUERY_MODE == "replay":
+        data = get_query_store().get_file(location)
+        if data is None:
+            raise LookupError(f"No recorded copy of {location} in {QUERY_STORE_PATH}")
+        return data
+    data = session.file.get_stream(location, decompress=False).read()
+    if QUERY_MODE == "record":
+        get_query_store().put_file(location, data)
+    return data
+
+# =============================================================================
+# AI RESULT CACHE
+# =============================================================================
+
+# Billed Cortex functions, option literals and statements that must never be cached
+AI_FUNCTION_PATTERN = re.compile(r"\b(AI_[A-Z_]+|SNOWFLAKE\.CORTEX\.[A-Z_]+)\s*\(", re.IGNORECASE)
+AI_MODEL_PATTERN = re.compile(r"\b(?:AI_COMPLETE|AI_EMBED)\s*\(\s*'([^']+)'", re.IGNORECASE)
+AI_OPTION_PATTERN = re.compile(r"'(temperature|max_tokens|top_p|output_mode|mode)'\s*:\s*('[^']*'|[\w.]+)", re.IGNORECASE)
+SQL_STRING_LITERAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\$\$.*?\$\$", re.DOTALL)
+SQL_WRITE_PATTERN = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|DROP|TRUNCATE|ALTER)\b", re.IGNORECASE)
+SQL_URL_PATTERN = re.compile(r"\b(GET_PRESIGNED_URL|BUILD_SCOPED_FILE_URL)\b", re.IGNORECASE)
+SQL_READ_SOURCE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+([\w.$]+)", re.IGNORECASE)
+SQL_STAGE_SOURCE_PATTERN = re.compile(r"\b(?:DIRECTORY|TO_FILE)\s*\(\s*'?@([\w.$]+)", re.IGNORECASE)
+SQL_WRITE_TARGET_PATTERN = re.compile(
+    r"\b(?:INSERT\s+(?:OVERWRITE\s+)?INTO|MERGE\s+INTO|TRUNCATE\s+TABLE|DELETE\s+FROM|UPDATE)\s+([\w.$]+)", re.IGNORECASE)
+
+def normalize_sql(query):
+    """Collapse whitespace and trailing semicolons so equivalent queries hash the same"""
+    return re.sub(r"\s+", " ", query).strip().rstrip(";").strip()
+
+def strip_sql_literals(query):
+    """Blank out string literals so keyword patterns don't match words inside prompts"""
+    return SQL_STRING_LITERAL_PATTERN.sub("''", query)
+
+def describe_ai_call(query):
+    """Return the normalized AI call signature of a read-only AI query, or None if not cacheable"""
+    normalized = normalize_sql(query)
+    statement = strip_sql_literals(normalized)
+    if not re.match(r"(SELECT|WITH)\b", statement, re.IGNORECASE) or SQL_WRITE_PATTERN.search(statement):
+        return None
+    functions = sorted({name.upper() for name in AI_FUNCTION_PATTERN.findall(normalized)})
+    if not functions:
+        return None
+    return {
+        'functions': functions,
+        'models': sorted(set(AI_MODEL_PATTERN.findall(normalized))),
+        'options': sorted({f"{name.lower()}={value}" for name, value in AI_OPTION_PATTERN.findall(normalized)}),
+        'input_hash': hashlib.sha256(normalized.encode('utf-8')).hexdigest(),
+        'tables': sorted({name.split('.')[-1].upper() for name in SQL_READ_SOURCE_PATTERN.findall(statement)}),
+        # Stages are matched with literals intact: DIRECTORY('@stage') and TO_FILE('@stage', ...) quote them
+        'stages': sorted({name.split('.')[-1].upper() for name in SQL_STAGE_SOURCE_PATTERN.findall(normalized)}),
+        'expires': bool(SQL_URL_PATTERN.search(normalized))
+    }
+
+def source_table_versions(tables):
+    """Return {table: LAST_ALTERED epoch ms} for the demo tables a query reads, via the metadata cache"""
+    if not tables:
+        return {}
+    if QUERY_MODE == "local":
+        return get_local_engine().table_versions(tables)  # The local engine has no INFORMATION_SCHEMA
+    # CTE names and table functions are matched too; they are simply absent from INFORMATION_SCHEMA
+    rows, _ = execute_metadata_query(f"""
+        SELECT table_name, DATE_PART(EPOCH_MILLISECOND, last_altered) as last_altered
+        FROM AI_FUNCTIONS_PLAYGROUND.INFORMATION_SCHEMA.TABLES
+        WHERE table_schema = 'DEMO' AND table_name IN ({', '.join(f"'{name}'" for name in tables)})
+    """, depends_on=tables)
+    return {row['TABLE_NAME']: row['LAST_ALTERED'] for row in rows or []}
+
+def stage_listing_version(stage):
+    """Return a hash of a demo stage's file paths and versions (via the metadata cache), or None if it can't be listed"""
+    rows, error = execute_metadata_query(f"""
+        SELECT d.RELATIVE_PATH, {STAGE_FILE_VERSION_SQL} as file_version
+        FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.{stage}) d
+        ORDER BY d.RELATIVE_PATH
+    """, [stage])
+    if error or rows is None:
+        return None
+    return hashlib.sha256(serialize_rows(rows).encode('utf-8')).hexdigest()
+
+def ai_cache_key(signature, table_versions=None):
+    """Hash an AI call signature (function, model, options, input hash) and source table or stage versions into a cache key"""
+    key_parts = {name: signature[name] for name in ('functions', 'models', 'options', 'input_hash')}
+    if table_versions:
+        # A changed source table gives the query a new key, so stale results are never served
+        key_parts['tables'] = {name: str(version) for name, version in sorted(table_versions.items())}
+    return hashlib.sha256(json.dumps(key_parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _encode_value(value):
+    """JSON encoder for result values that json cannot serialize natively"""
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'$decimal': str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    return str(value)
+
+def _decode_value(obj):
+    """JSON object hook that restores values written by _encode_value"""
+    if len(obj) == 1:
+        tag, value = next(iter(obj.items()))
+        if tag == '$datetime':
+            return datetime.fromisoformat(value)
+        if tag == '$date':
+            return date.fromisoformat(value)
+        if tag == '$decimal':
+            return Decimal(value)
+        if tag == '$bytes':
+            return base64.b64decode(value)
+    return obj
+
+def serialize_rows(rows):
+    """Serialize Snowpark rows to a JSON string"""
+    return json.dumps([row.as_dict() for row in rows], default=_encode_value)
+
+def deserialize_rows(payload):
+    """Rebuild Snowpark rows from a JSON string written by serialize_rows"""
+    return [Row(**values) for values in json.loads(payload, object_hook=_decode_value)]
+
+def run_ai_cache_sql(query, params):
+    """Run an AI_RESULT_CACHE table statement tagged as cache traffic"""
+    return run_sql(query, params, statement_params=query_tag_params(component='ai_cache'))
+
+@st.cache_resource
+def get_ai_result_cache():
+    """Process-wide AI result cache shared by all sessions"""
+    return AIResultCache(AI_CACHE_MAX_BYTES, AI_CACHE_TABLE, run_ai_cache_sql, serialize_rows, deserialize_rows,
+                         ttl_seconds=AI_CACHE_TTL_SECONDS, url_ttl_seconds=AI_CACHE_URL_TTL_SECONDS,
+                         retry_seconds=AI_CACHE_TABLE_RETRY_SECONDS, retry_max_seconds=AI_CACHE_TABLE_RETRY_MAX_SECONDS)
+
+def show_cache_sidebar():
+    """Display AI result and metadata cache counters in the sidebar"""
+    cache = get_ai_result_cache()
+    stats = cache.snapshot()
+    hits = stats['memory_hits'] + stats['table_hits']
+    lookups = hits + stats['coalesced'] + stats['misses']  # Every fetch is exactly one of these
+    with st.sidebar.expander("⚡ Caches"):
+        st.markdown("**AI Results**")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Hits", hits)
+        with col2:
+            st.metric("Misses", stats['misses'])
+        st.caption(f"Hit rate: {(hits / lookups if lookups else 0):.0%} · "
+                   f"Memory hits: {stats['memory_hits']} · Table hits: {stats['table_hits']} · "
+                   f"Shared in-flight: {stats['coalesced']} ({stats['in_flight']} running)")
+        st.caption(f"{stats['entries']} entries · {stats['bytes'] / (1024 * 1024):.1f} MB in memory · "
+                   f"{stats['evictions']} evictions")
+        if stats['table_retry_in']:
+            st.caption(f"⚠️ AI_RESULT_CACHE table unavailable - caching in memory only, "
+                       f"retrying in {stats['table_retry_in']}s")
+        if st.button("Clear AI Cache", key="clear_ai_cache"):
+            cache.clear()
+            st.rerun()
+
+        metadata_stats = get_metadata_cache().snapshot()
+        st.markdown("**Stage & Table Metadata**")
+        st.caption(f"{metadata_stats['entries']} cached listings · {metadata_stats['hits']} hits · "
+                   f"{metadata_stats['loads']} loads · {metadata_stats['background_refreshes']} background refreshes")
+        if metadata_stats['refresh_failures']:
+            st.caption(f"⚠️ {metadata_stats['refresh_failures']} failed background refreshes (serving stale listings) · "
+                       f"last error: {metadata_stats['last_error']}")
+        if st.button("Refresh Metadata", key="refresh_metadata"):
+            get_metadata_cache().clear()
+            get_stage_url_cache().clear()
+            st.rerun()
+
+        file_stats = get_stage_file_cache().snapshot()
+        st.markdown("**Stage Files**")
+        st.caption(f"{file_stats['files']} files · {file_stats['bytes'] / (1024 * 1024):.1f} MB · {file_stats['hits']} hits · "
+                   f"{file_stats['downloads']} downloads · {file_stats['evictions']} evictions")
+
+        page_stats = get_pdf_page_cache().snapshot()
+        st.caption(f"{page_stats['pages']} rendered PDF pages · {page_stats['bytes'] / (1024 * 1024):.1f} MB · "
+                   f"{page_stats['hits']} hits · {page_stats['renders']} renders · {page_stats['prefetched']} prefetched · "
+                   f"{page_stats['open_documents']} open documents ({page_stats['open_bytes'] / (1024 * 1024):.1f} MB)")
+
+        url_stats = get_stage_url_cache().snapshot()
+        st.markdown("**Stage File URLs**")
+        st.caption(f"{url_stats['urls']} cached URLs · {url_stats['hits']} hits · {url_stats['stage_loads']} stage loads · "
+                   f"{url_stats['file_loads']} single-file loads · {url_stats['background_refreshes']} background refreshes")
+        if url_stats['stage_load_failures']:
+            st.caption(f"⚠️ {url_stats['stage_load_failures']} failed stage listings (URLs generated per file for "
+                       f"{STAGE_URL_RETRY_SECONDS}s after each) · last error: {url_stats['last_error']}")
+
+# =============================================================================
+# METADATA CACHE
+# =============================================================================
+
+class MetadataCache:
+    """Stale-while-revalidate cache for stage listings, row counts and reference lists"""
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.stats = {'hits': 0, 'loads': 0, 'background_refreshes': 0, 'refresh_failures': 0, 'last_error': None}
+        self._entries = {}  # normalized query -> {'rows', 'fetched_at', 'depends_on'}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, query, depends_on, statement_params=None):
+        """Return cached rows, serving stale rows while a background thread refreshes them"""
+        key = normalize_sql(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            stale = entry is not None and time.time() - entry['fetched_at'] > self.ttl_seconds
+            start_refresh = stale and key not in self._refreshing
+            if start_refresh:
+                self._refreshing.add(key)
+            if entry is not None:
+                self.stats['hits'] += 1
+        if start_refresh:
+            threading.Thread(target=self._refresh, args=(key, query, depends_on, statement_params), daemon=True).start()
+        if entry is not None:
+            return entry['rows'], None
+        try:
+            rows = run_sql(query, statement_params=statement_params)
+        except Exception as e:
+            return None, str(e)
+        self._put(key, rows, depends_on)
+        with self._lock:
+            self.stats['loads'] += 1
+        return rows, None
+
+    def _put(self, key, rows, depends_on):
+        with self._lock:
+            self._entries[key] = {
+                'rows': rows,
+                'fetched_at': time.time(),
+                'depends_on': {name.upper() for name in depends_on}
+            }
+
+    def _refresh(self, key, query, depends_on, statement_params=None):
+        try:
+            self._put(key, run_sql(query, statement_params=statement_params), depends_on)
+            with self._lock:
+                self.stats['background_refreshes'] += 1
+        except Exception as e:
+            # The stale rows keep being served and the next get() tries again
+            with self._lock:
+                self.stats['refresh_failures'] += 1
+                self.stats['last_error'] = str(e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self, *names):
+        """Drop every cached entry that depends on one of the given tables or stages"""
+        names = {name.upper() for name in names}
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry['depends_on'] & names]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+@st.cache_resource
+def get_metadata_cache():
+    """Process-wide metadata cache shared by all sessions"""
+    return MetadataCache(METADATA_TTL_SECONDS)
+
+def execute_metadata_query(query, depends_on):
+    """Execute a metadata query (stage listing, row count, reference list) through the shared cache"""
+    started = time.time()
+    result, error = get_metadata_cache().get(query, depends_on, query_tag_params(query))
+    record_query_span(query, started, result, error, source='metadata')
+    return result, error
+
+def written_tables(query):
+    """Return the unqualified names of tables a statement writes to"""
+    targets = {name.split('.')[-1].upper() for name in SQL_WRITE_TARGET_PATTERN.findall(query)}
+    targets.discard('SET')  # MERGE ... WHEN MATCHED THEN UPDATE SET
+    return targets
+
+def invalidate_metadata(*names):
+    """Drop cached metadata for tables or stages the app has just written to"""
+    if names:
+        get_metadata_cache().invalidate(*names)
+
+# =============================================================================
+# STAGE URL CACHE
+# =============================================================================
+
+class StageUrlCache:
+    """Presigned and scoped stage file URLs kept with their expiry, loaded a whole stage at a time"""
+
+    def __init__(self, refresh_margin, retry_seconds):
+        self.refresh_margin = refresh_margin
+        self.retry_seconds = retry_seconds
+        self.stats = {'hits': 0, 'stage_loads': 0, 'file_loads': 0, 'background_refreshes': 0,
+                      'stage_load_failures': 0, 'last_error': None}
+        self._urls = {}  # (stage, scoped) -> {relative path: (url, expires_at)}
+        self._retry_at = {}  # (stage, scoped) -> time before which a failed stage listing is not retried
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _url_sql(stage, path_sql, scoped):
+        if scoped:
+            return f"BUILD_SCOPED_FILE_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.{stage}, {path_sql})"
+        return f"GET_PRESIGNED_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.{stage}, {path_sql}, {PRESIGNED_URL_TTL_SECONDS})"
+
+    def get(self, stage, path, scoped=False):
+        """Return a URL for a stage file, or None if it cannot be generated"""
+        key = (stage, scoped)
+        now = time.time()
+        with self._lock:
+            entry = self._urls.get(key, {}).get(path)
+            start_refresh = (entry is not None and entry[1] - self.refresh_margin <= now < entry[1]
+                             and key not in self._refreshing)
+            if start_refresh:
+                self._refreshing.add(key)
+            if entry is not None and now < entry[1]:
+                self.stats['hits'] += 1
+                if start_refresh:
+                    threading.Thread(target=self._refresh, args=(key,), daemon=True).start()
+                return entry[0]
+            stage_known = key in self._urls
+            backing_off = now < self._retry_at.get(key, 0)
+        
+        # Expired or never loaded: regenerate the whole stage; files uploaded since are fetched singly
+        if (entry is not None or not stage_known) and not backing_off:
+            self._load_stage(key)
+            with self._lock:
+                entry = self._urls.get(key, {}).get(path)
+            if entry is not None:
+                return entry[0]
+        return self._load_file(key, path)
+
+    def _load_stage(self, key):
+        stage, scoped = key
+        expires_at = time.time() + (SCOPED_URL_TTL_SECONDS if scoped else PRESIGNED_URL_TTL_SECONDS)
+        try:
+            rows = run_sql(f"""
+                SELECT RELATIVE_PATH, TO_VARCHAR({self._url_sql(stage, 'RELATIVE_PATH', scoped)}) as url
+                FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.{stage})
+            """, statement_params=query_tag_params(component='stage_urls'))
+        except Exception as e:
+            # Without the backoff every get() would list the stage again before its single-file query
+            with self._lock:
+                self._retry_at[key] = time.time() + self.retry_seconds
+                self.stats['stage_load_failures'] += 1
+                self.stats['last_error'] = str(e)
+            return
+        with self._lock:
+            self._urls[key] = {row['RELATIVE_PATH']: (row['URL'], expires_at) for row in rows if row['URL']}
+            self._retry_at.pop(key, None)
+            self.stats['stage_loads'] += 1
+
+    def _load_file(self, key, path):
+        stage, scoped = key
+        expires_at = time.time() + (SCOPED_URL_TTL_SECONDS if scoped else PRESIGNED_URL_TTL_SECONDS)
+        try:
+            rows = run_sql(
+                f"SELECT TO_VARCHAR({self._url_sql(stage, '?', scoped)}) as url", [path],
+                statement_params=query_tag_params(component='stage_urls')
+            )
+        except Exception:
+            return None
+        url = rows[0]['URL'] if rows else None
+        with self._lock:
+            self.stats['file_loads'] += 1
+            if url:
+                self._urls.setdefault(key, {})[path] = (url, expires_at)
+        return url
+
+    def _refresh(self, key):
+        try:
+            self._load_stage(key)
+            with self._lock:
+                self.stats['background_refreshes'] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+            self._retry_at.clear()
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['urls'] = sum(len(urls) for urls in self._urls.values())
+        return stats
+
+@st.cache_resource
+def get_stage_url_cache():
+    """Process-wide stage URL cache shared by all sessions"""
+    return StageUrlCache(URL_REFRESH_MARGIN_SECONDS, STAGE_URL_RETRY_SECONDS)
+
+def get_stage_url(stage, path, scoped=False):
+    """Presigned (or scoped) URL for a file in one of the demo stages, served from the URL cache"""
+    return get_stage_url_cache().get(stage, path, scoped)
+
+# =============================================================================
+# STAGE FILE CACHE
+# =============================================================================
+
+class StageFileCache:
+    """LRU byte cache for stage file downloads; each file version is pulled and hashed once"""
+
+    def __init__(self, max_bytes):
+        self._files = SizedLRUCache(max_bytes)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'downloads': 0}
+
+    def _entry(self, stage, path, version):
+        key = (stage, path, version)
+        entry = self._files.get(key)
+        if entry is not None:
+            with self._lock:
+                self.stats['hits'] += 1
+            return entry
+        data = read_stage_bytes(f"@AI_FUNCTIONS_PLAYGROUND.DEMO.{stage}/{path}")
+        entry = (data, hashlib.sha256(data).hexdigest())
+        self._files.put(key, entry, len(data))
+        with self._lock:
+            self.stats['downloads'] += 1
+        return entry
+
+    def read(self, stage, path, version=None):
+        """Return the file's bytes, downloading them only on a miss"""
+        return self._entry(stage, path, version)[0]
+
+    def digest(self, stage, path, version=None):
+        """Return the SHA-256 of the file's bytes"""
+        return self._entry(stage, path, version)[1]
+
+    def clear(self):
+        self._files.clear()
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['files'] = len(self._files)
+        stats['bytes'] = self._files.total_bytes
+        stats['evictions'] = self._files.evictions
+        return stats
+
+@st.cache_resource
+def get_stage_file_cache():
+    """Process-wide stage file cache shared by all sessions"""
+    return StageFileCache(STAGE_FILE_CACHE_MAX_BYTES)
+
+def read_stage_file(stage, path, version=None):
+    """Bytes of a file in one of the demo stages; pass the DIRECTORY() version so re-uploads are fetched again"""
+    return get_stage_file_cache().read(stage, path, version)
+
+# =============================================================================
+# PDF PAGE CACHE
+# =============================================================================
+
+class PdfPageCache:
+    """Encoded PDF page images keyed by (document hash, page, scale), with background neighbour prefetch.
+
+    Sessions hold only a document hash. Open PdfDocument handles live here, shared by
+    all sessions, under a global size budget: a handle is closed when its last viewer
+    switches files, when it sits idle, or when the budget is exceeded, and is reopened
+    from the stage file cache the next time a page has to be rasterized. Viewers renew
+    their registration on every rerun and expire after the idle timeout, so sessions that
+    end without switching files do not pin registry entries.
+    """
+
+    def __init__(self, max_bytes, max_open_bytes, idle_seconds):
+        self._pages = SizedLRUCache(max_bytes)
+        self._pdfium_lock = threading.Lock()  # pdfium is not thread-safe; every pdfium call goes through it
+        self._documents = OrderedDict()  # document hash -> {'source', 'pdf', 'bytes', 'viewers', 'last_used'}
+        # 'viewers' maps a session viewer key to the last time it rendered the document
+        self._max_open_bytes = max_open_bytes
+        self._idle_seconds = idle_seconds
+        self._page_widths = {}  # (document hash, page) -> width in points
+        self._page_counts = {}  # document hash -> number of pages
+        self._prefetching = set()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'renders': 0, 'prefetched': 0, 'opened': 0, 'closed': 0}
+
+    def open(self, stage, path, version=None, viewer=None):
+        """Register a viewer of a stage PDF and return its document hash (the handle opens lazily)"""
+        doc_hash = get_stage_file_cache().digest(stage, path, version)
+        with self._lock:
+            entry = self._documents.setdefault(doc_hash, {'source': (stage, path, version), 'pdf': None,
+                                                          'bytes': 0, 'viewers': {}, 'last_used': time.time()})
+            entry['viewers'][viewer] = time.time()
+        return doc_hash
+
+    def touch(self, doc_hash, viewer=None):
+        """Renew a viewer's registration; False when the document is no longer in the registry"""
+        with self._lock:
+            entry = self._documents.get(doc_hash)
+            if entry is None:
+                return False
+            entry['viewers'][viewer] = time.time()
+            return True
+
+    def release(self, doc_hash, viewer=None):
+        """Drop a viewer of a document, closing its handle once nobody is viewing it"""
+        with self._lock:
+            entry = self._documents.get(doc_hash)
+            if entry is None:
+                return
+            entry['viewers'].pop(viewer, None)
+        self._evict()
+
+    def _with_document(self, doc_hash, fn):
+        """Run fn(pdf) under the pdfium lock, reopening the handle from the stage file cache if it was closed"""
+        with self._lock:
+            entry = self._documents[doc_hash]
+        # Download outside the pdfium lock so a cold read never blocks other viewers
+        data = read_stage_file(*entry['source']) if entry['pdf'] is None else None
+        with self._pdfium_lock:
+            with self._lock:
+                if self._documents.get(doc_hash) is not entry:
+                    raise KeyError(doc_hash)  # Released while we were downloading
+            if entry['pdf'] is None:
+                data = data or read_stage_file(*entry['source'])
+                entry['pdf'] = pdfium.PdfDocument(data)
+                entry['bytes'] = len(data)
+                with self._lock:
+                    self.stats['opened'] += 1
+            with self._lock:
+                entry['last_used'] = time.time()
+                if doc_hash in self._documents:
+                    self._documents.move_to_end(doc_hash)
+            result = fn(entry['pdf'])
+        self._evict(keep=doc_hash)
+        return result
+
+    def _evict(self, keep=None):
+        """Close handles that are unviewed, idle, or beyond the open-document budget (least recently used first)"""
+        now = time.time()
+        with self._pdfium_lock, self._lock:
+            open_bytes = sum(entry['bytes'] for entry in self._documents.values() if entry['pdf'] is not None)
+            for doc_hash, entry in list(self._documents.items()):
+                viewers = entry['viewers']
+                for viewer, last_seen in list(viewers.items()):
+                    if now - last_seen > self._idle_seconds:
+                        del viewers[viewer]  # Session ended (or went quiet) without switching files
+                unviewed = not viewers
+                if doc_hash != keep and entry['pdf'] is not None and (
+                        unviewed or now - entry['last_used'] > self._idle_seconds or open_bytes > self._max_open_bytes):
+                    entry['pdf'].close()
+                    entry['pdf'] = None
+                    open_bytes -= entry['bytes']
+                    self.stats['closed'] += 1
+                if unviewed and entry['pdf'] is None:
+                    del self._documents[doc_hash]
+                    self._page_counts.pop(doc_hash, None)
+                    for page_key in [page_key for page_key in self._page_widths if page_key[0] == doc_hash]:
+                        del self._page_widths[page_key]
+
+    def page_count(self, doc_hash):
+        with self._lock:
+            page_count = self._page_counts.get(doc_hash)
+        if page_count is None:
+            page_count = self._with_document(doc_hash, len)
+            with self._lock:
+                self._page_counts[doc_hash] = page_count
+        return page_count
+
+    def scale_for(self, doc_hash, page_index, width=None):
+        """Render scale that fits the page to width pixels, or full resolution when width is None"""
+        if width is None:
+            return PDF_FULL_RES_SCALE
+        with self._lock:
+            page_width = self._page_widths.get((doc_hash, page_index))
+        if page_width is None:
+            page_width = self._with_document(doc_hash, lambda pdf: pdf[page_index].get_width())
+            with self._lock:
+                self._page_widths[(doc_hash, page_index)] = page_width
+        # Rounded so the same viewer width always maps to the same cache key
+        return round(min(width / page_width, PDF_FULL_RES_SCALE), 2)
+
+    def _render(self, key):
+        doc_hash, page_index, scale = key
+        image = self._with_document(doc_hash, lambda pdf: pdf[page_index].render(scale=scale).to_pil())
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format=PDF_IMAGE_FORMAT, quality=PDF_IMAGE_QUALITY)
+        data = buffer.getvalue()
+        self._pages.put(key, data, len(data))
+        return data
+
+    def render(self, doc_hash, page_index, width=None):
+        """Return the encoded page image sized to width (full resolution if None), rasterizing it only on a miss"""
+        key = (doc_hash, page_index, self.scale_for(doc_hash, page_index, width))
+        data = self._pages.get(key)
+        with self._lock:
+            self.stats['hits' if data is not None else 'renders'] += 1
+        return data if data is not None else self._render(key)
+
+    def prefetch(self, doc_hash, page_indexes, width):
+        """Render missing pages on a background thread (one prefetch per document at a time)"""
+        keys = [(doc_hash, page_index, self.scale_for(doc_hash, page_index, width)) for page_index in page_indexes]
+        missing = [key for key in keys if self._pages.get(key) is None]
+        with self._lock:
+            if not missing or doc_hash in self._prefetching:
+                return
+            self._prefetching.add(doc_hash)
+        threading.Thread(target=self._prefetch, args=(doc_hash, missing), daemon=True).start()
+
+    def _prefetch(self, doc_hash, keys):
+        try:
+            for key in keys:
+                self._render(key)
+                with self._lock:
+                    self.stats['prefetched'] += 1
+        except Exception:
+            pass  # Nobody is viewing the document any more; the page renders on demand instead
+        finally:
+            with self._lock:
+                self._prefetching.discard(doc_hash)
+
+    def clear(self):
+        self._pages.clear()
+        with self._lock:
+            self._page_widths.clear()
+            self._page_counts.clear()
+
+    def snapshot(self):
+        self._evict()  # Idle handles are closed on the next look at the cache
+        with self._lock:
+            stats = dict(self.stats)
+            open_documents = [entry for entry in self._documents.values() if entry['pdf'] is not None]
+        stats['pages'] = len(self._pages)
+        stats['bytes'] = self._pages.total_bytes
+        stats['open_documents'] = len(open_documents)
+        stats['open_bytes'] = sum(entry['bytes'] for entry in open_documents)
+        return stats
+
+@st.cache_resource
+def get_pdf_page_cache():
+    """Process-wide rendered page cache shared by all sessions"""
+    return PdfPageCache(PDF_PAGE_CACHE_MAX_BYTES, PDF_OPEN_DOCUMENTS_MAX_BYTES, PDF_DOCUMENT_IDLE_SECONDS)
+
+# =============================================================================
+# SUPPLIER INVOICE EXTRACTION
+# =============================================================================
+# Every invoice is run through AI_EXTRACT once per file content; display, load
+# and single-invoice views all read from the INVOICE_EXTRACTIONS table
+
+INVOICE_DETAIL_COLUMNS = [
+    'file_name', 'file_url', 'file_hash', 'file_last_modified',
+    'invoice_number', 'invoice_date', 'supplier_name', 'supplier_address', 'supplier_phone',
+    'customer_name', 'customer_address', 'customer_phone',
+    'subtotal', 'tax_amount', 'total_amount', 'payment_terms', 'item_count',
+    'extraction_date', 'raw_json'
+]
+
+INVOICE_RESPONSE_FORMAT = """{
+                    'invoice_number': 'The invoice number (e.g., INV-1001)',
+                    'invoice_date': 'The invoice date in YYYY-MM-DD format',
+                    'supplier_name': 'The supplier/vendor company name',
+                    'supplier_address': 'The complete supplier address',
+                    'supplier_phone': 'The supplier phone number',
+                    'customer_name': 'The customer company name (should be Guac n Roll)',
+                    'customer_address': 'The complete customer address',
+                    'customer_phone': 'The customer phone number',
+                    'subtotal': 'The subtotal amount before tax as a number',
+                    'tax_amount': 'The tax amount as a number',
+                    'total_amount': 'The total invoice amount as a number',
+                    'payment_terms': 'The payment terms (e.g., Net 30 Days)',
+                    'item_count': 'The number of line items in the invoice'
+                }"""
+
+INVOICE_FIELDS_SQL = """extracted_json:response:invoice_number::string as invoice_number,
+        extracted_json:response:invoice_date::date as invoice_date,
+        extracted_json:response:supplier_name::string as supplier_name,
+        extracted_json:response:supplier_address::string as supplier_address,
+        extracted_json:response:supplier_phone::string as supplier_phone,
+        extracted_json:response:customer_name::string as customer_name,
+        extracted_json:response:customer_address::string as customer_address,
+        extracted_json:response:customer_phone::string as customer_phone,
+        REPLACE(extracted_json:response:subtotal, '$', '')::float as subtotal,
+        REPLACE(extracted_json:response:tax_amount, '$', '')::float as tax_amount,
+        REPLACE(extracted_json:response:total_amount, '$', '')::float as total_amount,
+        extracted_json:response:payment_terms::string as payment_terms,
+        extracted_json:response:item_count::integer as item_count"""
+
+def invoice_extraction_query(file_name=None, skip_loaded=False):
+    """SQL that runs AI_EXTRACT only for invoices whose name and content hash were never extracted"""
+    file_filter = f"\n          AND d.RELATIVE_PATH = '{escape_sql_string(file_name)}'" if file_name else ""
+    loaded_join = ""
+    if skip_loaded:
+        # Files already loaded at this version need no extraction at all
+        loaded_join = f"""
+        LEFT JOIN AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS l
+            ON l.file_name = d.RELATIVE_PATH AND l.file_hash = {STAGE_FILE_VERSION_SQL}"""
+        file_filter += "\n          AND l.file_name IS NULL"
+    # MERGE rather than INSERT ... anti-join: concurrent clicks serialize on the target table,
+    # and AI_EXTRACT runs only in the NOT MATCHED branch, so each file version is paid for once
+    return f"""
+    MERGE INTO AI_FUNCTIONS_PLAYGROUND.DEMO.INVOICE_EXTRACTIONS e
+    USING (
+        SELECT DISTINCT d.RELATIVE_PATH as file_name, {STAGE_FILE_VERSION_SQL} as file_hash
+        FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE) d{loaded_join}
+        WHERE d.RELATIVE_PATH LIKE '%supplier_invoice%'{file_filter}
+    ) s
+    ON e.file_name = s.file_name AND e.file_hash = s.file_hash
+    WHEN NOT MATCHED THEN INSERT (file_name, file_hash, extracted_json)
+    VALUES (
+        s.file_name,
+        s.file_hash,
+        AI_EXTRACT(
+            file => TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE', s.file_name),
+            responseFormat => {INVOICE_RESPONSE_FORMAT}
+        )
+    )
+    """
+
+def invoice_details_query(file_name=None):
+    """SQL that reads parsed invoice fields for the current stage files from INVOICE_EXTRACTIONS"""
+    file_filter = f"\n      AND d.RELATIVE_PATH = '{escape_sql_string(file_name)}'" if file_name else ""
+    return f"""
+    SELECT
+        d.RELATIVE_PATH as file_name,
+        BUILD_SCOPED_FILE_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE, d.RELATIVE_PATH) as file_url,
+        e.file_hash,
+        d.LAST_MODIFIED as file_last_modified,
+        {INVOICE_FIELDS_SQL},
+        e.extracted_json as raw_json
+    FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE) d
+    JOIN (
+        -- Primary keys are not enforced: read one extraction per file version
+        SELECT * FROM AI_FUNCTIONS_PLAYGROUND.DEMO.INVOICE_EXTRACTIONS
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY file_name, file_hash ORDER BY extracted_at DESC) = 1
+    ) e
+        ON e.file_name = d.RELATIVE_PATH AND e.file_hash = {STAGE_FILE_VERSION_SQL}
+    WHERE d.RELATIVE_PATH LIKE '%supplier_invoice%'{file_filter}
+    ORDER BY d.RELATIVE_PATH
+    """
+
+def extract_invoices(file_name=None):
+    """Extract any not-yet-seen invoices (or one invoice) and return (parsed rows, newly extracted count, error)"""
+    result, error = execute_query(invoice_extraction_query(file_name))
+    if error:
+        return None, 0, error
+    new_count = result[0][0] if result else 0
+    rows, error = execute_query(invoice_details_query(file_name))
+    return rows, new_count, error
+
+def invoice_changes_query():
+    """SQL that diffs the stage listing against SUPPLIER_INVOICE_DETAILS and counts added/changed/removed files"""
+    return f"""
+    WITH staged AS (
+        SELECT d.RELATIVE_PATH as file_name, {STAGE_FILE_VERSION_SQL} as file_hash
+        FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE) d
+        WHERE d.RELATIVE_PATH LIKE '%supplier_invoice%'
+    ),
+    loaded AS (
+        SELECT DISTINCT file_name, file_hash
+        FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS
+    )
+    SELECT
+        COUNT_IF(l.file_name IS NULL) as added,
+        COUNT_IF(s.file_name IS NOT NULL AND l.file_name IS NOT NULL AND s.file_hash IS DISTINCT FROM l.file_hash) as changed,
+        COUNT_IF(s.file_name IS NULL) as removed,
+        COUNT_IF(s.file_hash = l.file_hash) as unchanged
+    FROM staged s
+    FULL OUTER JOIN loaded l ON l.file_name = s.file_name
+    """
+
+def invoice_merge_query():
+    """SQL that MERGEs added and changed invoices from INVOICE_EXTRACTIONS into SUPPLIER_INVOICE_DETAILS"""
+    source_columns = [c for c in INVOICE_DETAIL_COLUMNS if c != 'file_name']
+    update_set = ",\n        ".join(f"{c} = s.{c}" for c in source_columns)
+    insert_columns = ", ".join(INVOICE_DETAIL_COLUMNS)
+    insert_values = ", ".join(f"s.{c}" for c in INVOICE_DETAIL_COLUMNS)
+    return f"""
+    MERGE INTO AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS t
+    USING (
+        SELECT s.*, CURRENT_DATE as extraction_date
+        FROM ({invoice_details_query()}) s
+        LEFT JOIN AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS l
+            ON l.file_name = s.file_name AND l.file_hash = s.file_hash
+        WHERE l.file_name IS NULL
+        -- One source row per file keeps the MERGE deterministic
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY s.file_name ORDER BY s.file_last_modified DESC) = 1
+    ) s
+    ON t.file_name = s.file_name
+    WHEN MATCHED THEN UPDATE SET
+        {update_set}
+    WHEN NOT MATCHED THEN INSERT ({insert_columns})
+        VALUES ({insert_values})
+    """
+
+def invoice_prune_query():
+    """SQL that removes loaded invoices whose files are no longer in the stage"""
+    return """
+    DELETE FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS
+    WHERE file_name NOT IN (
+        SELECT RELATIVE_PATH
+        FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE)
+        WHERE RELATIVE_PATH LIKE '%supplier_invoice%'
+    )
+    """
+
+# Columns added to SUPPLIER_INVOICE_DETAILS after its first release; older deployments
+# keep their table (setup_database.sql uses CREATE OR REPLACE), so they are added on first use
+INVOICE_DETAIL_MIGRATIONS = [
+    "ALTER TABLE AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS ADD COLUMN IF NOT EXISTS file_hash VARCHAR(100)",
+    "ALTER TABLE AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS ADD COLUMN IF NOT EXISTS file_last_modified TIMESTAMP_LTZ"
+]
+
+@st.cache_resource
+def get_applied_migrations():
+    """Process-wide set of schema migrations already applied"""
+    return set()
+
+def apply_migrations(statements):
+    """Run idempotent schema migrations once per process and return an error, if any"""
+    applied = get_applied_migrations()
+    for statement in statements:
+        if statement in applied:
+            continue
+        _, error = execute_query(statement, use_cache=False)
+        if error:
+            return error
+        applied.add(statement)
+    return None
+
+def load_invoices(full_reload=False):
+    """Bring SUPPLIER_INVOICE_DETAILS in line with the stage and return ({extracted, inserted, updated, removed}, error)"""
+    counts = {'extracted': 0, 'inserted': 0, 'updated': 0, 'removed': 0}
+    error = apply_migrations(INVOICE_DETAIL_MIGRATIONS)
+    if error:
+        return counts, error
+    if full_reload:
+        _, error = execute_query("TRUNCATE TABLE AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS")
+        if error:
+            return counts, error
+    
+    result, error = execute_query(invoice_extraction_query(skip_loaded=True))
+    if error:
+        return counts, error
+    counts['extracted'] = result[0][0] if result else 0
+    
+    result, error = execute_query(invoice_merge_query())
+    if error:
+        return counts, error
+    if result:
+        counts['inserted'], counts['updated'] = result[0][0], result[0][1]
+    
+    result, error = execute_query(invoice_prune_query())
+    if error:
+        return counts, error
+    counts['removed'] = result[0][0] if result else 0
+    return counts, None
+
+# =============================================================================
+# CALL TRANSCRIPTS
+# =============================================================================
+# AI_TRANSCRIBE runs once per audio file content; every transcribe example reads
+# the stored transcript JSON (text, segments, speakers) from TRANSCRIPTS
+
+# Primary keys are not enforced: read one transcript per file version
+CURRENT_TRANSCRIPTS_SQL = """(
+                    SELECT * FROM AI_FUNCTIONS_PLAYGROUND.DEMO.TRANSCRIPTS
+                    QUALIFY ROW_NUMBER() OVER (PARTITION BY file_name, file_hash ORDER BY transcribed_at DESC) = 1
+                )"""
+
+def audio_file_filter(file_names):
+    """SQL predicate limiting DIRECTORY(@AUDIO_STAGE) rows to the given files"""
+    names = ", ".join(f"'{escape_sql_string(name)}'" for name in file_names)
+    return f"d.RELATIVE_PATH IN ({names})"
+
+def transcription_query(file_names):
+    """SQL that runs AI_TRANSCRIBE only for audio files whose name and content hash were never transcribed"""
+    # MERGE rather than INSERT ... anti-join, as for invoices: concurrent sessions serialize
+    # on TRANSCRIPTS and AI_TRANSCRIBE runs only in the NOT MATCHED branch
+    return f"""
+    MERGE INTO AI_FUNCTIONS_PLAYGROUND.DEMO.TRANSCRIPTS t
+    USING (
+        SELECT DISTINCT d.RELATIVE_PATH as file_name, {STAGE_FILE_VERSION_SQL} as file_hash
+        FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.AUDIO_STAGE) d
+        WHERE {audio_file_filter(file_names)}
+    ) s
+    ON t.file_name = s.file_name AND t.file_hash = s.file_hash
+    WHEN NOT MATCHED THEN INSERT (file_name, file_hash, transcript_json)
+    VALUES (
+        s.file_name,
+        s.file_hash,
+        AI_TRANSCRIBE(TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.AUDIO_STAGE', s.file_name))
+    )
+    """
+
+def transcripts_query(file_names):
+    """SQL returning (audio_file, transcript_json) for the current version of each given audio file"""
+    return f"""
+                SELECT 
+                    d.RELATIVE_PATH as audio_file,
+                    t.file_hash,
+                    t.transcript_json
+                FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.AUDIO_STAGE) d
+                JOIN {CURRENT_TRANSCRIPTS_SQL} t
+                    ON t.file_name = d.RELATIVE_PATH AND t.file_hash = {STAGE_FILE_VERSION_SQL}
+                WHERE {audio_file_filter(file_names)}"""
+
+def ensure_transcripts(file_names):
+    """Transcribe any of the given audio files missing from TRANSCRIPTS and return (newly transcribed count, error)"""
+    result, error = execute_query(transcription_query(file_names))
+    if error:
+        return 0, error
+    return (result[0][0] if result else 0), None
+
+def show_transcript_source(new_count, total=1):
+    """Caption telling whether transcripts came from AI_TRANSCRIBE or the TRANSCRIPTS table"""
+    if new_count:
+        st.caption(f"🎙️ {new_count} of {total} transcribed with AI_TRANSCRIBE and saved to TRANSCRIPTS")
+    else:
+        st.caption(f"♻️ {'Transcript' if total == 1 else f'All {total} transcripts'} read from TRANSCRIPTS (no AI_TRANSCRIBE call needed)")
+
+# =============================================================================
+# CALL ANALYTICS
+# =============================================================================
+# Every recording in AUDIO_STAGE is analyzed once per file version and model:
+# sentiment is scored once and a single structured AI_COMPLETE call returns the
+# summary and recommended actions; results are persisted in CALL_ANALYTICS
+
+AUDIO_FILE_PATTERN_SQL = "LOWER(d.RELATIVE_PATH) RLIKE '.*[.](flac|mp3|mp4|ogg|wav|webm|mkv|ogv)'"
+
+CALL_ANALYSIS_RESPONSE_FORMAT = """{
+                            'type': 'json',
+                            'schema': {
+                                'type': 'object',
+                                'properties': {
+                                    'summary': {'type': 'string'},
+                                    'recommended_actions': {'type': 'array', 'items': {'type': 'string'}}
+                                },
+                                'required': ['summary', 'recommended_actions']
+                            }
+                        }"""
+
+def pending_calls_query(model):
+    """SQL listing audio files with no CALL_ANALYTICS row for their current version and the given model"""
+    return f"""
+    SELECT d.RELATIVE_PATH as file_name
+    FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.AUDIO_STAGE) d
+    LEFT JOIN AI_FUNCTIONS_PLAYGROUND.DEMO.CALL_ANALYTICS a
+        ON a.file_name = d.RELATIVE_PATH
+       AND a.file_hash = {STAGE_FILE_VERSION_SQL}
+       AND a.model = '{escape_sql_string(model)}'
+    WHERE {AUDIO_FILE_PATTERN_SQL}
+      AND a.file_name IS NULL
+    ORDER BY d.RELATIVE_PATH
+    """
+
+def call_analytics_query(file_names, model):
+    """SQL that analyzes one batch of transcribed calls and merges the results into CALL_ANALYTICS"""
+    model = escape_sql_string(model)
+    # MERGE so that concurrent runs over the same pending files store each (file version, model) once
+    return f"""
+    MERGE INTO AI_FUNCTIONS_PLAYGROUND.DEMO.CALL_ANALYTICS a
+    USING (
+        WITH transcriptions AS ({transcripts_query(file_names)}
+        ),
+        scored AS (
+            SELECT 
+                audio_file,
+                file_hash,
+                SNOWFLAKE.CORTEX.SENTIMENT(transcript_json:text::STRING) as sentiment_score,
+                TRY_PARSE_JSON(TO_VARCHAR(AI_COMPLETE(
+                    model => '{model}',
+                    prompt => 'Summarize this customer service call in 2-3 sentences and provide exactly 3 specific recommended actions: ' || transcript_json:text::STRING,
+                    model_parameters => {{'temperature': 0.3}},
+                    response_format => {CALL_ANALYSIS_RESPONSE_FORMAT}
+                ))) as analysis
+            FROM transcriptions
+        )
+        SELECT 
+            audio_file as file_name,
+            file_hash,
+            '{model}' as model,
+            analysis:summary::STRING as call_summary,
+            sentiment_score,
+            CASE 
+                WHEN sentiment_score > 0.3 THEN 'Positive 😊'
+                WHEN sentiment_score < -0.3 THEN 'Negative 😟'
+                ELSE 'Neutral 😐'
+            END as sentiment_category,
+            analysis:recommended_actions as recommended_actions
+        FROM scored
+    ) s
+    ON a.file_name = s.file_name AND a.file_hash = s.file_hash AND a.model = s.model
+    WHEN NOT MATCHED THEN INSERT
+        (file_name, file_hash, model, call_summary, sentiment_score, sentiment_category, recommended_actions)
+    VALUES (s.file_name, s.file_hash, s.model, s.call_summary, s.sentiment_score, s.sentiment_category, s.recommended_actions)
+    """
+
+def call_analytics_results_query(model):
+    """SQL reading stored analytics for the current version of every audio file, most negative first"""
+    return f"""
+    SELECT 
+        a.file_name as filename,
+        t.transcript_json:text::STRING as transcribed_text,
+        a.call_summary,
+        a.sentiment_score,
+        a.sentiment_category,
+        a.recommended_actions
+    FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.AUDIO_STAGE) d
+    JOIN (
+        -- Primary keys are not enforced: read one analysis per file version and model
+        SELECT * FROM AI_FUNCTIONS_PLAYGROUND.DEMO.CALL_ANALYTICS
+        WHERE model = '{escape_sql_string(model)}'
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY file_name, file_hash ORDER BY analyzed_at DESC) = 1
+    ) a
+        ON a.file_name = d.RELATIVE_PATH
+       AND a.file_hash = {STAGE_FILE_VERSION_SQL}
+    JOIN {CURRENT_TRANSCRIPTS_SQL} t
+        ON t.file_name = a.file_name AND t.file_hash = a.file_hash
+    ORDER BY a.sentiment_score, a.file_name
+    """
+
+def analyze_calls(model, on_progress=None):
+    """Transcribe and analyze every not-yet-analyzed audio file in batches and return (analyzed count, {batch: error}, error)"""
+    pending, error = execute_query(pending_calls_query(model))
+    if error:
+        return 0, {}, error
+    
+    file_names = [row['FILE_NAME'] for row in pending]
+    batches = {
+        f"{batch[0]} … {batch[-1]}": batch
+        for batch in (file_names[i:i + CALL_ANALYTICS_BATCH_SIZE] for i in range(0, len(file_names), CALL_ANALYTICS_BATCH_SIZE))
+    }
+    steps_done = []
+    
+    def step_done(key, result, error):
+        steps_done.append(key)
+        if on_progress:
+            on_progress(len(steps_done), 2 * len(batches))
+    
+    # Batches run concurrently; each batch's analysis waits for all transcriptions
+    outcomes = execute_queries_async(
+        {key: transcription_query(batch) for key, batch in batches.items()}, on_done=step_done
+    )
+    failures = {key: error for key, (_, error) in outcomes.items() if error}
+    outcomes = execute_queries_async(
+        {key: call_analytics_query(batch, model) for key, batch in batches.items() if key not in failures},
+        on_done=step_done
+    )
+    failures.update({key: error for key, (_, error) in outcomes.items() if error})
+    analyzed = sum(len(batch) for key, batch in batches.items() if key not in failures)
+    return analyzed, failures, None
+
+def call_type_label(file_name, audio_files):
+    """Describe a recording from the curated list, or from its file name"""
+    if file_name in audio_files:
+        return audio_files[file_name]
+    return file_name.rsplit('.', 1)[0].replace('_', ' ').title()
+
+# =============================================================================
+# BULK ENRICHMENT JOBS
+# =============================================================================
+# A job plans key ranges over the source rows that have no output for its model yet
+# and are not in an unfinished range, then runs the ranges as concurrent async
+# statements on a background thread, so a run survives the page being left. Each
+# range is claimed with a status-conditioned UPDATE, so concurrent runs (other
+# sessions or app instances) never enrich it twice, and its output is committed
+# together with its checkpoint. NULL outputs are not stored, so the next run
+# plans those rows again.
+
+ENRICHMENT_BATCHES_TABLE = "AI_FUNCTIONS_PLAYGROUND.DEMO.ENRICHMENT_BATCHES"
+
+ENRICHMENT_JOBS = {
+    'menu_marketing': {
+        'source': "AI_FUNCTIONS_PLAYGROUND.DEMO.MENU_ITEMS",
+        'target': "AI_FUNCTIONS_PLAYGROUND.DEMO.MENU_ITEM_MARKETING",
+        'key': "menu_id",
+        'ai_output': lambda model: f"""AI_COMPLETE(
+                '{model}',
+                'Create a compelling 30-word marketing description for this menu item: ' || s.item_name || 
+                '. Category: ' || s.category || '. Make it appetizing and highlight unique flavors.',
+                {{'temperature': 0.7}}
+            )""",
+        'columns': "menu_id, model, item_name, category, price, original_description, ai_marketing_copy",
+        'outputs': "menu_id, '{model}', item_name, category, price, description_english, ai_output",
+        'valid_output': "ai_output IS NOT NULL"
+    },
+    'ticket_categories': {
+        'source': "AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPORT_TICKETS",
+        'target': "AI_FUNCTIONS_PLAYGROUND.DEMO.TICKET_CATEGORIES",
+        'key': "ticket_id",
+        'ai_output': lambda model: f"""AI_COMPLETE(
+                '{model}',
+                'Analyze this support ticket and respond in JSON (do not generate ```json\n) format with: category (Food Quality/Service/Payment/Location/Other), priority (High/Medium/Low), and suggested_action (one sentence). Ticket: ' || s.issue_description,
+                {{'temperature': 0.3}}
+            )""",
+        'columns': "ticket_id, model, customer_name, issue_description, urgency, category, priority, suggested_action",
+        'outputs': """ticket_id, '{model}', customer_name, issue_description, urgency,
+        TRY_PARSE_JSON(ai_output):category::STRING,
+        TRY_PARSE_JSON(ai_output):priority::STRING,
+        TRY_PARSE_JSON(ai_output):suggested_action::STRING""",
+        'valid_output': "TRY_PARSE_JSON(ai_output):category IS NOT NULL"
+    }
+}
+
+def enrichment_job_id(name, model):
+    return f"{name}:{model}"
+
+def enrichment_job_id_sql(name, model):
+    """The job id as an escaped SQL string literal"""
+    return f"'{escape_sql_string(enrichment_job_id(name, model))}'"
+
+def enrichment_plan_query(name, model, batch_size=ENRICHMENT_BATCH_SIZE):
+    """SQL that checkpoints key ranges of batch_size rows over source rows with no output for the model
+    that no unfinished range covers"""
+    spec = ENRICHMENT_JOBS[name]
+    job_id = enrichment_job_id_sql(name, model)
+    key = spec['key']
+    return f"""
+    INSERT INTO {ENRICHMENT_BATCHES_TABLE} (job_id, batch_start, batch_end, row_count, status)
+    SELECT {job_id}, MIN({key}), MAX({key}), COUNT(*), 'PENDING'
+    FROM (
+        SELECT s.{key}, FLOOR((ROW_NUMBER() OVER (ORDER BY s.{key}) - 1) / {batch_size}) as batch_number
+        FROM {spec['source']} s
+        LEFT JOIN {spec['target']} t ON t.{key} = s.{key} AND t.model = '{escape_sql_string(model)}'
+        WHERE t.{key} IS NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM {ENRICHMENT_BATCHES_TABLE} b
+              WHERE b.job_id = {job_id} AND b.status <> 'DONE' AND s.{key} BETWEEN b.batch_start AND b.batch_end
+          )
+    )
+    GROUP BY batch_number
+    """
+
+def enrichment_pending_query(name, model):
+    """SQL listing the job's key ranges that have not completed"""
+    return f"""
+    SELECT batch_start, batch_end
+    FROM {ENRICHMENT_BATCHES_TABLE}
+    WHERE job_id = {enrichment_job_id_sql(name, model)} AND status <> 'DONE'
+    ORDER BY batch_start
+    """
+
+def enrichment_batch_query(name, model, batch_start, batch_end):
+    """Snowflake Scripting block that claims one key range, enriches it and marks it done in one transaction;
+    returns the rows written, or -1 when another run holds the range"""
+    spec = ENRICHMENT_JOBS[name]
+    job_id = enrichment_job_id_sql(name, model)
+    model = escape_sql_string(model)
+    key = spec['key']
+    # A range re-planned over a finished one can share its batch_start, so every write is status-conditioned
+    return f"""
+    EXECUTE IMMEDIATE $$
+    BEGIN
+        UPDATE {ENRICHMENT_BATCHES_TABLE}
+        SET status = 'RUNNING', claimed_at = CURRENT_TIMESTAMP()
+        WHERE job_id = {job_id} AND batch_start = {batch_start}
+          AND (status IN ('PENDING', 'FAILED')
+               OR (status = 'RUNNING'
+                   AND claimed_at < DATEADD(minute, -{ENRICHMENT_CLAIM_TIMEOUT_MINUTES}, CURRENT_TIMESTAMP())));
+        IF (SQLROWCOUNT = 0) THEN
+            RETURN -1;
+        END IF;
+        BEGIN TRANSACTION;
+        INSERT INTO {spec['target']} ({spec['columns']})
+        SELECT {spec['outputs'].format(model=model)}
+        FROM (
+            SELECT s.*, {spec['ai_output'](model)} as ai_output
+            FROM {spec['source']} s
+            WHERE s.{key} BETWEEN {batch_start} AND {batch_end}
+              AND NOT EXISTS (SELECT 1 FROM {spec['target']} t WHERE t.{key} = s.{key} AND t.model = '{model}')
+        )
+        WHERE {spec['valid_output']};
+        LET rows_written INTEGER := SQLROWCOUNT;
+        UPDATE {ENRICHMENT_BATCHES_TABLE}
+        SET status = 'DONE', rows_written = :rows_written, error = NULL, finished_at = CURRENT_TIMESTAMP()
+        WHERE job_id = {job_id} AND batch_start = {batch_start} AND status = 'RUNNING';
+        COMMIT;
+        RETURN rows_written;
+    EXCEPTION
+        WHEN OTHER THEN
+            ROLLBACK;
+            RAISE;
+    END;
+    $$
+    """
+
+def enrichment_failure_query(name, model, batch_start, error):
+    """SQL that records a failed key range so the next run retries it"""
+    return f"""
+    UPDATE {ENRICHMENT_BATCHES_TABLE}
+    SET status = 'FAILED', error = '{escape_sql_string(error[:4000])}', finished_at = CURRENT_TIMESTAMP()
+    WHERE job_id = {enrichment_job_id_sql(name, model)} AND batch_start = {batch_start} AND status = 'RUNNING'
+    """
+
+def enrichment_results_query(name, model):
+    """SQL reading a job's stored output for one model"""
+    spec = ENRICHMENT_JOBS[name]
+    return f"""
+    SELECT {spec['columns']}
+    FROM {spec['target']}
+    WHERE model = '{escape_sql_string(model)}'
+    ORDER BY {spec['key']}
+    """
+
+class EnrichmentRunner:
+    """Bulk enrichment runs on background threads, shared by all sessions (one run per job and model at a time)"""
+
+    def __init__(self):
+        self._runs = {}  # job id -> {'running', 'done', 'total', 'written', 'skipped', 'failures', 'error'}
+        self._lock = threading.Lock()
+
+    def start(self, name, model, statement_params):
+        """Start a run of the job unless one is already in progress"""
+        job_id = enrichment_job_id(name, model)
+        with self._lock:
+            if self._runs.get(job_id, {}).get('running'):
+                return
+            run = {'running': True, 'done': 0, 'total': None, 'written': 0, 'skipped': 0, 'failures': {}, 'error': None}
+            self._runs[job_id] = run
+        threading.Thread(target=self._run, args=(name, model, run, statement_params), daemon=True).start()
+
+    def status(self, name, model):
+        """A copy of the job's current or last run, or None if it has not run in this process"""
+        with self._lock:
+            run = self._runs.get(enrichment_job_id(name, model))
+            return dict(run, failures=dict(run['failures'])) if run else None
+
+    def _run(self, name, model, run, statement_params):
+        try:
+            run_sql(enrichment_plan_query(name, model), statement_params=statement_params)
+            pending = run_sql(enrichment_pending_query(name, model), statement_params=statement_params)
+            batches = {f"{row['BATCH_START']} … {row['BATCH_END']}": row for row in pending}
+            with self._lock:
+                run['total'] = len(batches)
+
+            def batch_done(key, job, started, result, error):
+                if error:
+                    try:
+                        run_sql(enrichment_failure_query(name, model, batches[key]['BATCH_START'], error),
+                                statement_params=statement_params)
+                    except Exception as e:
+                        # The range stays RUNNING until its claim times out
+                        error = (f"{error} (could not mark the range FAILED: {e}; "
+                                 f"it is retried after {ENRICHMENT_CLAIM_TIMEOUT_MINUTES} minutes)")
+                with self._lock:
+                    run['done'] += 1
+                    if error:
+                        run['failures'][key] = error
+                    elif int(result[0][0] or 0) < 0:
+                        run['skipped'] += 1
+                    else:
+                        run['written'] += int(result[0][0] or 0)
+
+            run_async_jobs(
+                {key: enrichment_batch_query(name, model, row['BATCH_START'], row['BATCH_END'])
+                 for key, row in batches.items()},
+                lambda query: statement_params,
+                batch_done
+            )
+        except Exception as e:
+            with self._lock:
+                run['error'] = str(e)
+        finally:
+            invalidate_metadata(*written_tables(enrichment_batch_query(name, model, 0, 0)))
+            with self._lock:
+                run['running'] = False
+
+@st.cache_resource
+def get_enrichment_runner():
+    """Process-wide runner for bulk enrichment jobs"""
+    return EnrichmentRunner()
+
+def run_enrichment_job(name, model, start=True, on_progress=None):
+    """Start the job on a background thread unless it is already running, and follow it until it finishes;
+    return its final status"""
+    runner = get_enrichment_runner()
+    if start:
+        runner.start(name, model, query_tag_params(enrichment_batch_query(name, model, 0, 0)))
+    while True:
+        status = runner.status(name, model)
+        if on_progress and status['total']:
+            on_progress(status['done'], status['total'])
+        if not status['running']:
+            return status
+        time.sleep(ASYNC_POLL_SECONDS)
+
+def enrichment_running(name, model):
+    """Whether a run of the job is in progress in this process (started by any session)"""
+    status = get_enrichment_runner().status(name, model)
+    return bool(status and status['running'])
+
+# =============================================================================
+# EMBEDDING INDEXES
+# =============================================================================
+# Source rows are embedded once per text version (SHA2 of the text); only new or
+# edited rows reach AI_EMBED and rows deleted from the source are pruned. The
+# refresh runs only when the source changed, so lookups cost a top-k scan alone
+
+EMBEDDING_INDEXES = {
+    'tickets': {
+        'source': "AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPORT_TICKETS s",
+        'table': "SUPPORT_TICKETS",
+        'index': "AI_FUNCTIONS_PLAYGROUND.DEMO.TICKET_EMBEDDINGS",
+        'id': "ticket_id",
+        'hash': "text_hash",
+        'source_id': "s.ticket_id",
+        'source_hash': "SHA2(s.issue_description)",
+        'input': f"'{EMBEDDING_MODEL}', s.issue_description",
+        'filter': "s.issue_description IS NOT NULL"
+    },
+    'reviews': {
+        'source': "AI_FUNCTIONS_PLAYGROUND.DEMO.CUSTOMER_REVIEWS s",
+        'table': "CUSTOMER_REVIEWS",
+        'index': "AI_FUNCTIONS_PLAYGROUND.DEMO.REVIEW_EMBEDDINGS",
+        'id': "review_id",
+        'hash': "text_hash",
+        'source_id': "s.review_id",
+        'source_hash': "SHA2(s.review_text)",
+        'input': f"'{EMBEDDING_MODEL}', s.review_text",
+        'filter': "s.review_text IS NOT NULL"
+    },
+    'images': {
+        'source': "DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE) d",
+        'stage': "IMAGE_STAGE",
+        'index': "AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_EMBEDDINGS",
+        'id': "file_name",
+        'hash': "file_hash",
+        'source_id': "d.RELATIVE_PATH",
+        'source_hash': STAGE_FILE_VERSION_SQL,
+        'input': f"'{IMAGE_EMBEDDING_MODEL}', TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE', d.RELATIVE_PATH)",
+        'filter': "TRUE"
+    }
+}
+
+def embedding_refresh_query(name):
+    """SQL that MERGEs embeddings for new or changed source rows (or stage files) into an embedding index"""
+    spec = EMBEDDING_INDEXES[name]
+    return f"""
+    MERGE INTO {spec['index']} e
+    USING (
+        SELECT 
+            {spec['source_id']} as {spec['id']},
+            {spec['source_hash']} as {spec['hash']},
+            AI_EMBED({spec['input']}) as embedding
+        FROM {spec['source']}
+        LEFT JOIN {spec['index']} e
+            ON e.{spec['id']} = {spec['source_id']} AND e.{spec['hash']} = {spec['source_hash']}
+        WHERE e.{spec['id']} IS NULL
+          AND {spec['filter']}
+    ) s
+    ON e.{spec['id']} = s.{spec['id']}
+    WHEN MATCHED THEN UPDATE SET
+        {spec['hash']} = s.{spec['hash']},
+        embedding = s.embedding,
+        embedded_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT ({spec['id']}, {spec['hash']}, embedding)
+        VALUES (s.{spec['id']}, s.{spec['hash']}, s.embedding)
+    """
+
+def embedding_prune_query(name):
+    """SQL that removes index entries whose source rows (or stage files) were deleted"""
+    spec = EMBEDDING_INDEXES[name]
+    return f"""
+    DELETE FROM {spec['index']}
+    WHERE {spec['id']} NOT IN (SELECT {spec['source_id']} FROM {spec['source']})
+    """
+
+@st.cache_resource
+def get_embedding_source_versions():
+    """Process-wide {index name: source version} as of each index's last refresh"""
+    return {}
+
+def embedding_source_version(name):
+    """Return (source version, index is current): table LAST_ALTERED times, or a hash of the stage listing"""
+    spec = EMBEDDING_INDEXES[name]
+    if 'stage' in spec:
+        # The stage listing comes from the metadata cache, so an unchanged stage costs no query
+        return stage_listing_version(spec['stage']), False
+    source, index = spec['table'], spec['index'].split('.')[-1]
+    versions = source_table_versions([source, index])
+    # Every refresh writes the index after reading the whole source, so an index altered
+    # after its source is already up to date (this also holds across app restarts)
+    current = versions.get(source) is not None and versions.get(index) is not None and versions[index] >= versions[source]
+    return versions.get(source), current
+
+def refresh_embeddings(name):
+    """Bring an embedding index up to date if its source changed and return (newly embedded row count, error)"""
+    source_version, current = embedding_source_version(name)
+    refreshed = get_embedding_source_versions()
+    if current or (source_version is not None and refreshed.get(name) == source_version):
+        return 0, None
+    result, error = execute_query(embedding_refresh_query(name))
+    if error:
+        return 0, error
+    embedded = sum(result[0]) if result else 0  # Inserted + updated (the local engine reports one count)
+    _, error = execute_query(embedding_prune_query(name))
+    if not error:
+        refreshed[name] = source_version
+    return embedded, error
+
+def similar_images_query(file_name, top_k):
+    """SQL returning the top-k catalog images closest to a catalogued image"""
+    return f"""
+                WITH reference AS (
+                    SELECT embedding
+                    FROM AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_EMBEDDINGS
+                    WHERE file_name = '{escape_sql_string(file_name)}'
+                )
+                SELECT 
+                    e.file_name,
+                    VECTOR_COSINE_SIMILARITY(e.embedding, ref.embedding) as similarity_score
+                FROM AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_EMBEDDINGS e
+                CROSS JOIN reference ref
+                WHERE e.file_name != '{escape_sql_string(file_name)}'
+                ORDER BY similarity_score DESC
+                LIMIT {int(top_k)}
+                """
+
+def similar_reviews_query(review_id, top_k):
+    """SQL returning the top-k reviews closest to an indexed review (no embedding is computed)"""
+    return f"""
+                WITH reference AS (
+                    SELECT embedding, text_hash
+                    FROM AI_FUNCTIONS_PLAYGROUND.DEMO.REVIEW_EMBEDDINGS
+                    WHERE review_id = {int(review_id)}
+                )
+                SELECT 
+                    r.review_id,
+                    r.customer_name,
+                    r.food_truck_name,
+                    r.rating,
+                    VECTOR_COSINE_SIMILARITY(e.embedding, ref.embedding) as similarity_score,
+                    r.review_text
+                FROM AI_FUNCTIONS_PLAYGROUND.DEMO.REVIEW_EMBEDDINGS e
+                CROSS JOIN reference ref
+                JOIN AI_FUNCTIONS_PLAYGROUND.DEMO.CUSTOMER_REVIEWS r ON r.review_id = e.review_id
+                WHERE e.text_hash != ref.text_hash
+                ORDER BY similarity_score DESC
+                LIMIT {int(top_k)}
+                """
+
+def similar_ticket_pairs_query(top_k, threshold, window=TICKET_SIMILARITY_WINDOW):
+    """SQL returning ticket pairs where one ticket is among the other's top-k cosine neighbours above a threshold"""
+    # Candidates are ranked by position rather than ticket_id, so gaps in the ids do not
+    # shrink the window; a window of 0 compares every pair of tickets
+    candidates = f"ABS(b.seq - a.seq) <= {int(window)}" if window else "TRUE"
+    return f"""
+            WITH tickets AS (
+                SELECT ticket_id, embedding, ROW_NUMBER() OVER (ORDER BY ticket_id) as seq
+                FROM AI_FUNCTIONS_PLAYGROUND.DEMO.TICKET_EMBEDDINGS
+            ),
+            neighbours AS (
+                SELECT 
+                    a.ticket_id,
+                    b.ticket_id as neighbour_id,
+                    VECTOR_COSINE_SIMILARITY(a.embedding, b.embedding) as similarity
+                FROM tickets a
+                JOIN tickets b
+                    ON b.ticket_id != a.ticket_id AND {candidates}
+                QUALIFY similarity > {float(threshold)}
+                    AND ROW_NUMBER() OVER (PARTITION BY a.ticket_id ORDER BY similarity DESC) <= {int(top_k)}
+            ),
+            ticket_pairs AS (
+                SELECT 
+                    LEAST(ticket_id, neighbour_id) as ticket1_id,
+                    GREATEST(ticket_id, neighbour_id) as ticket2_id,
+                    MAX(similarity) as similarity
+                FROM neighbours
+                GROUP BY 1, 2
+            )
+            SELECT 
+                p.ticket1_id,
+                t1.customer_name as customer1,
+                p.ticket2_id,
+                t2.customer_name as customer2,
+                p.similarity,
+                t1.issue_description as issue1,
+                t2.issue_description as issue2
+            FROM ticket_pairs p
+            JOIN AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPORT_TICKETS t1 ON t1.ticket_id = p.ticket1_id
+            JOIN AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPORT_TICKETS t2 ON t2.ticket_id = p.ticket2_id
+            ORDER BY p.similarity DESC
+            """
+
+# =============================================================================
+# IMAGE TAGS
+# =============================================================================
+# Each distinct image (by content hash) gets one tagging pass: a single-label
+# AI_CLASSIFY for its cuisine and a multi-label one for dish type and visual
+# traits; classify and filter views read the stored tags instead of calling the
+# model again
+
+IMAGE_CUISINE_LABELS = [
+    {'label': 'Asian Cuisine', 'description': 'Japanese, Chinese, Korean, Thai, Vietnamese food'},
+    {'label': 'Mexican Cuisine', 'description': 'Tacos, burritos, quesadillas, nachos'},
+    {'label': 'American Cuisine', 'description': 'Burgers, hot dogs, fries, BBQ'},
+    {'label': 'Middle Eastern Cuisine', 'description': 'Gyros, falafel, shawarma, kebabs'},
+    {'label': 'European Cuisine', 'description': 'French, Italian, German, British food'},
+    {'label': 'Dessert', 'description': 'Sweet treats, cakes, ice cream, pastries'}
+]
+
+IMAGE_DISH_TYPE_LABELS = [
+    {'label': 'Served in a Bowl', 'description': 'The dish is served in a bowl'},
+    {'label': 'Wrapped or Handheld', 'description': 'A wrapped or handheld item such as a burrito, sandwich or taco'},
+    {'label': 'Plated Meal', 'description': 'A meal arranged on a plate or tray'}
+]
+
+IMAGE_TRAIT_LABELS = [
+    {'label': 'Contains Meat', 'description': 'Meat, poultry or seafood is visible'},
+    {'label': 'Contains Vegetables', 'description': 'Vegetables or greens are visible'},
+    {'label': 'Has Sauce', 'description': 'Sauce, dressing or gravy is visible'},
+    {'label': 'Fried Food', 'description': 'Deep-fried or crispy fried items'}
+]
+
+# Predefined AI_FILTER questions that stored tags can answer without the model
+IMAGE_FILTER_TAGS = {
+    "Does this image show a dish served in a bowl?": 'Served in a Bowl',
+    "Does this image contain meat?": 'Contains Meat',
+    "Is this a dessert or sweet item?": 'Dessert',
+    "Does this image show a wrapped or handheld food item?": 'Wrapped or Handheld',
+    "Does this food appear to have vegetables?": 'Contains Vegetables'
+}
+
+def sql_label_array(labels):
+    """Render label names as a SQL ARRAY_CONSTRUCT"""
+    return "ARRAY_CONSTRUCT(" + ", ".join(f"'{escape_sql_string(item['label'])}'" for item in labels) + ")"
+
+def label_objects_sql(labels):
+    """Render labels with descriptions as AI_CLASSIFY category objects"""
+    return ",\n                ".join(
+        f"{{'label': '{escape_sql_string(item['label'])}', 'description': '{escape_sql_string(item['description'])}'}}"
+        for item in labels
+    )
+
+def image_tagging_query():
+    """SQL that tags every IMAGE_STAGE file whose content hash has no IMAGE_TAGS row, in one pass per image"""
+    # The tag columns derive from both AI_CLASSIFY results, so the calls run in the source
+    # (untagged images only) and the MERGE on file_hash keeps concurrent runs from storing twice
+    return f"""
+    MERGE INTO AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_TAGS t
+    USING (
+        WITH untagged AS (
+            SELECT 
+                d.RELATIVE_PATH as file_name,
+                {STAGE_FILE_VERSION_SQL} as file_hash
+            FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE) d
+            LEFT JOIN AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_TAGS tagged
+                ON tagged.file_hash = {STAGE_FILE_VERSION_SQL}
+            WHERE tagged.file_hash IS NULL
+            -- Partition by the expressions: bare names would resolve to the (NULL) IMAGE_TAGS columns
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY {STAGE_FILE_VERSION_SQL} ORDER BY d.RELATIVE_PATH) = 1
+        ),
+        classified AS (
+            SELECT 
+                file_name,
+                file_hash,
+                -- Exactly one cuisine per image (single-label), every dish type and trait that applies (multi-label)
+                AI_CLASSIFY(
+                    TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE', file_name),
+                    [
+                    {label_objects_sql(IMAGE_CUISINE_LABELS)}
+                    ]
+                ):labels[0]::STRING as cuisine,
+                AI_CLASSIFY(
+                    TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE', file_name),
+                    [
+                    {label_objects_sql(IMAGE_DISH_TYPE_LABELS + IMAGE_TRAIT_LABELS)}
+                    ],
+                    {{'output_mode': 'multi'}}
+                ):labels::ARRAY as attribute_labels
+            FROM untagged
+        )
+        SELECT 
+            file_hash,
+            file_name,
+            cuisine,
+            ARRAY_INTERSECTION(attribute_labels, {sql_label_array(IMAGE_DISH_TYPE_LABELS)}) as dish_types,
+            ARRAY_INTERSECTION(attribute_labels, {sql_label_array(IMAGE_TRAIT_LABELS)}) as visual_traits,
+            ARRAY_CAT(ARRAY_CONSTRUCT_COMPACT(cuisine), attribute_labels) as labels
+        FROM classified
+    ) s
+    ON t.file_hash = s.file_hash
+    WHEN NOT MATCHED THEN INSERT (file_hash, file_name, cuisine, dish_types, visual_traits, labels)
+    VALUES (s.file_hash, s.file_name, s.cuisine, s.dish_types, s.visual_traits, s.labels)
+    """
+
+def tagged_images_query(tag=None):
+    """SQL listing stage images with their stored tags, optionally only those carrying one tag"""
+    tag_filter = f"\n    WHERE ARRAY_CONTAINS('{escape_sql_string(tag)}'::VARIANT, t.labels)" if tag else ""
+    return f"""
+    SELECT
+        d.RELATIVE_PATH as file_name,
+        t.cuisine as cuisine_label,
+        ARRAY_TO_STRING(t.dish_types, ', ') as dish_types,
+        ARRAY_TO_STRING(t.visual_traits, ', ') as visual_traits
+    FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE) d
+    JOIN (
+        -- Primary keys are not enforced: read one tag row per image content
+        SELECT * FROM AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_TAGS
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY file_hash ORDER BY tagged_at DESC) = 1
+    ) t
+        ON t.file_hash = {STAGE_FILE_VERSION_SQL}{tag_filter}
+    ORDER BY d.RELATIVE_PATH
+    """
+
+def tag_images():
+    """Tag any untagged stage images and return (newly tagged image count, error)"""
+    result, error = execute_query(image_tagging_query())
+    if error:
+        return 0, error
+    return (result[0][0] if result else 0), None
+
+# =============================================================================
+# DOCUMENT PARSING
+# =============================================================================
+
+def parse_documents_query(parse_mode, file_name=None):
+    """SQL that parses every DOCUMENT_STAGE file (or one file) with AI_PARSE_DOCUMENT into PARSE_DOC_RAW_TEXT"""
+    file_filter = f"\n    WHERE d.RELATIVE_PATH = '{escape_sql_string(file_name)}'" if file_name else ""
+    return f"""
+    INSERT INTO AI_FUNCTIONS_PLAYGROUND.DEMO.PARSE_DOC_RAW_TEXT (file_name, file_url, raw_text)
+    SELECT 
+        d.RELATIVE_PATH as file_name,
+        TO_VARCHAR(GET_PRESIGNED_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.DOCUMENT_STAGE, d.RELATIVE_PATH, 3600)) as file_url,
+        AI_PARSE_DOCUMENT(
+            TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.DOCUMENT_STAGE', d.RELATIVE_PATH),
+            {{'mode': '{parse_mode}'}}
+        ):content::STRING as raw_text
+    FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.DOCUMENT_STAGE) d{file_filter}
+    """
+
+# =============================================================================
+# STREAMING COMPLETION
+# =============================================================================
+# AI_COMPLETE in SQL only returns once the whole completion is generated. The
+# custom prompt playground can instead stream tokens from the Cortex REST API
+# (client in cortex_stream.py). Inside Streamlit in Snowflake that needs outbound
+# access: the external access integration and token secret from setup_database.sql.
+
+def cortex_stream_auth_headers():
+    """Authorization headers for the Cortex REST API, or None when this deployment cannot call it"""
+    try:
+        import _snowflake
+    except ImportError:
+        _snowflake = None
+    if _snowflake is not None:
+        try:
+            token = _snowflake.get_generic_secret_string(CORTEX_STREAM_SECRET)
+        except Exception:
+            return None  # No external access integration or secret bound to the app
+        return {"Authorization": f"Bearer {token}",
+                "X-Snowflake-Authorization-Token-Type": "PROGRAMMATIC_ACCESS_TOKEN"}
+    token = getattr(getattr(getattr(session, "connection", None), "rest", None), "token", None)
+    return {"Authorization": f'Snowflake Token="{token}"'} if token else None
+
+def streaming_available():
+    """Whether the custom prompt playground can stream tokens in this deployment"""
+    return bool(CORTEX_STREAM_URL) or cortex_stream_auth_headers() is not None
+
+def cortex_stream_request(model, prompt, temperature):
+    """Build the streaming Cortex REST request for one prompt"""
+    headers = cortex_stream_auth_headers()
+    if CORTEX_STREAM_URL:
+        url = CORTEX_STREAM_URL
+    elif headers is None:
+        raise RuntimeError("Token streaming needs the external access integration in setup_database.sql "
+                           "or CORTEX_STREAM_URL")
+    else:
+        url = f"https://{session.connection.host}/api/v2/cortex/inference:complete"
+    return completion_request(url, model, prompt, temperature, headers)
+
+# =============================================================================
+# USAGE REPORT
+# =============================================================================
+# The app's statements carry a JSON QUERY_TAG, so ACCOUNT_USAGE can be grouped by
+# page, example and model. The grouping itself (aggregate_usage) lives in
+# usage_report.py, a pure function over plain dicts that is tested on fixture rows.
+
+def usage_history_query(days):
+    """SQL joining the app's tagged QUERY_HISTORY rows with their Cortex function usage"""
+    return f"""
+    SELECT 
+        q.query_id,
+        q.query_tag,
+        q.total_elapsed_time,
+        q.start_time,
+        c.function_name,
+        c.model_name,
+        c.tokens,
+        c.token_credits
+    FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY q
+    LEFT JOIN SNOWFLAKE.ACCOUNT_USAGE.CORTEX_FUNCTIONS_QUERY_USAGE_HISTORY c
+        ON c.query_id = q.query_id
+    WHERE q.start_time >= DATEADD(day, -{int(days)}, CURRENT_TIMESTAMP())
+      AND TRY_PARSE_JSON(q.query_tag):app::STRING = '{QUERY_TAG_APP}'
+    """
 
 # =============================================================================
 # PAGE NAVIGATION
@@ -273,7 +2454,8 @@ pages = {
     "🎙️ AI_TRANSCRIBE": "ai_transcribe",
     "📄 AI_PARSE_DOCUMENT": "ai_parse_document",
     "📝 AI_SUMMARIZE_AGG": "ai_summarize_agg",
-    "📊 AI_AGG": "ai_agg"
+    "📊 AI_AGG": "ai_agg",
+    "📈 Usage Report": "usage_report"
 }
 
 # Page selection
@@ -380,22 +2562,22 @@ def page_home():
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        result, _ = execute_query("SELECT COUNT(*) as cnt FROM AI_FUNCTIONS_PLAYGROUND.DEMO.FOOD_TRUCKS")
+        result, _ = execute_metadata_query("SELECT COUNT(*) as cnt FROM AI_FUNCTIONS_PLAYGROUND.DEMO.FOOD_TRUCKS", ["FOOD_TRUCKS"])
         if result:
             st.metric("Food Trucks", result[0]['CNT'])
     
     with col2:
-        result, _ = execute_query("SELECT COUNT(*) as cnt FROM AI_FUNCTIONS_PLAYGROUND.DEMO.CUSTOMER_REVIEWS")
+        result, _ = execute_metadata_query("SELECT COUNT(*) as cnt FROM AI_FUNCTIONS_PLAYGROUND.DEMO.CUSTOMER_REVIEWS", ["CUSTOMER_REVIEWS"])
         if result:
             st.metric("Customer Reviews", result[0]['CNT'])
     
     with col3:
-        result, _ = execute_query("SELECT COUNT(*) as cnt FROM AI_FUNCTIONS_PLAYGROUND.DEMO.MENU_ITEMS")
+        result, _ = execute_metadata_query("SELECT COUNT(*) as cnt FROM AI_FUNCTIONS_PLAYGROUND.DEMO.MENU_ITEMS", ["MENU_ITEMS"])
         if result:
             st.metric("Menu Items", result[0]['CNT'])
     
     with col4:
-        result, _ = execute_query("SELECT COUNT(*) as cnt FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPORT_TICKETS")
+        result, _ = execute_metadata_query("SELECT COUNT(*) as cnt FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPORT_TICKETS", ["SUPPORT_TICKETS"])
         if result:
             st.metric("Support Tickets", result[0]['CNT'])
 
@@ -479,28 +2661,35 @@ def page_ai_complete():
     with col2:
         model_ex2 = st.selectbox("Model:", AI_COMPLETE_MODELS, key="model_ex2")
     
-    if st.button("Enrich All Menu Items", key="bulk_menu"):
-        with st.spinner("Processing all menu items..."):
-            query = f"""
-            SELECT 
-                item_name,
-                category,
-                price,
-                description_english as original_description,
-                AI_COMPLETE(
-                    '{model_ex2}',
-                    'Create a compelling 30-word marketing description for this menu item: ' || item_name || 
-                    '. Category: ' || category || '. Make it appetizing and highlight unique flavors.',
-                    {{'temperature': 0.7}}
-                ) as ai_marketing_copy
-            FROM AI_FUNCTIONS_PLAYGROUND.DEMO.MENU_ITEMS
-            LIMIT 10
-            """
+    clicked = st.button("Enrich All Menu Items", key="bulk_menu")
+    # A run keeps going in the background when the page is left; coming back follows it again
+    running = enrichment_running('menu_marketing', model_ex2)
+    if clicked or running:
+        progress = st.progress(0.0, text="Planning batches..." if clicked else "Enrichment running in the background...")
+        
+        def show_progress(done, total):
+            progress.progress(done / total, text=f"Completed {done} of {total} batch(es)")
+        
+        status = run_enrichment_job('menu_marketing', model_ex2, start=not running, on_progress=show_progress)
+        written, failures, error = status['written'], status['failures'], status['error']
+        progress.progress(1.0, text=f"🆕 {written} menu item(s) newly enriched")
+        if status['skipped']:
+            st.caption(f"⏭️ {status['skipped']} batch(es) held by another run were skipped")
+        for batch, batch_error in failures.items():
+            st.error(f"❌ Error processing menu items {batch}: {batch_error} (rerun to resume)")
+        
+        query = enrichment_results_query('menu_marketing', model_ex2)
+        result = None
+        if not error:
             result, error = execute_query(query)
-            if result:
-                st.success(f"**Generated marketing copy for {len(result)} menu items:**")
-                st.dataframe(result, use_container_width=True)
+        if result:
+            st.success(f"**Generated marketing copy for {len(result)} menu items (stored in MENU_ITEM_MARKETING):**")
+            st.dataframe(result, use_container_width=True)
+            with st.expander("🔍 View SQL Query"):
+                st.code(enrichment_batch_query('menu_marketing', model_ex2, "<batch_start>", "<batch_end>"), language="sql")
                 st.code(query, language="sql")
+        elif error:
+            st.error(f"Error: {error}")
     
     st.markdown("---")
     
@@ -517,35 +2706,31 @@ def page_ai_complete():
     with col2:
         model_ex3 = st.selectbox("Model:", AI_COMPLETE_MODELS, key="model_ex3")
     
-    if st.button("Categorize Tickets", key="bulk_tickets"):
-        with st.spinner("Processing support tickets..."):
-            query = f"""
-            WITH ai_analysis AS (
-                SELECT 
-                    ticket_id,
-                    customer_name,
-                    issue_description,
-                    urgency,
-                    AI_COMPLETE(
-                        '{model_ex3}',
-                        'Analyze this support ticket and respond in JSON (do not generate ```json\n) format with: category (Food Quality/Service/Payment/Location/Other), priority (High/Medium/Low), and suggested_action (one sentence). Ticket: ' || issue_description,
-                        {{'temperature': 0.3}}
-                    ) as ai_analysis_json
-                FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPORT_TICKETS
-            )
-            SELECT 
-                ticket_id,
-                customer_name,
-                issue_description,
-                urgency,
-                TRY_PARSE_JSON(ai_analysis_json):category::STRING as category,
-                TRY_PARSE_JSON(ai_analysis_json):priority::STRING as priority,
-                TRY_PARSE_JSON(ai_analysis_json):suggested_action::STRING as suggested_action
-            FROM ai_analysis;
-            """
-            result, error = execute_query(query)
+    clicked = st.button("Categorize Tickets", key="bulk_tickets")
+    running = enrichment_running('ticket_categories', model_ex3)
+    if clicked or running:
+        progress = st.progress(0.0, text="Planning batches..." if clicked else "Categorization running in the background...")
+        
+        def show_progress(done, total):
+            progress.progress(done / total, text=f"Completed {done} of {total} batch(es)")
+        
+        status = run_enrichment_job('ticket_categories', model_ex3, start=not running, on_progress=show_progress)
+        written, failures, error = status['written'], status['failures'], status['error']
+        progress.progress(1.0, text=f"🆕 {written} ticket(s) newly categorized")
+        if status['skipped']:
+            st.caption(f"⏭️ {status['skipped']} batch(es) held by another run were skipped")
+        for batch, batch_error in failures.items():
+            st.error(f"❌ Error processing tickets {batch}: {batch_error} (rerun to resume)")
+        
+        with st.spinner("Loading categorized tickets..."):
+            query = enrichment_results_query('ticket_categories', model_ex3)
+            result = None
+            if not error:
+                result, error = execute_query(query)
+            if error:
+                st.error(f"Error: {error}")
             if result:
-                st.success(f"**✅ Analyzed {len(result)} support tickets (full dataset):**")
+                st.success(f"**✅ Analyzed {len(result)} support tickets (full dataset, stored in TICKET_CATEGORIES):**")
                 st.dataframe(result, use_container_width=True)
                 
                 # Show summary statistics
@@ -560,6 +2745,7 @@ def page_ai_complete():
                     low_priority = sum(1 for row in result if row['PRIORITY'] == 'Low')
                     st.metric("Low Priority", low_priority)
                 
+                st.code(enrichment_batch_query('ticket_categories', model_ex3, "<batch_start>", "<batch_end>"), language="sql")
                 st.code(query, language="sql")
     
     st.markdown("---")
@@ -592,23 +2778,43 @@ def page_ai_complete():
         temperature = st.slider("Temperature:", 0.0, 1.0, 0.7, 0.1)
         st.caption("Higher = more creative, Lower = more focused")
     
+    if streaming_available():
+        stream_tokens = st.toggle("⚡ Stream tokens as they are generated", key="stream_custom_prompt",
+                                  help="Uses the Cortex REST API so the answer appears while the model is still writing it")
+    else:
+        stream_tokens = False
+        st.caption("⚡ Token streaming needs the Cortex REST external access integration (see setup_database.sql)")
+    
     if st.button("Run Custom Prompt", key="custom_prompt"):
-        with st.spinner("Processing..."):
-            escaped_prompt = escape_sql_string(custom_prompt)
-            query = f"""
-            SELECT AI_COMPLETE(
-                '{model}',
-                '{escaped_prompt}',
-                {{'temperature': {temperature}}}
-            ) as result
-            """
-            result, error = execute_query(query)
-            if result:
-                st.success("**Result:**")
-                st.markdown(result[0]['RESULT'])
-                st.code(query, language="sql")
-            elif error:
-                st.error(f"Error: {error}")
+        if stream_tokens:
+            st.success("**Result:**")
+            stats = {}
+            try:
+                st.write_stream(stream_complete(cortex_stream_request(model, custom_prompt, temperature), stats))
+            except Exception as e:
+                st.error(f"Error: {e}")
+            if stats.get('elapsed'):
+                generation_seconds = stats['elapsed'] - (stats['ttft'] or 0)
+                tokens_per_second = stats['tokens'] / generation_seconds if generation_seconds > 0 else 0
+                st.caption(f"⏱️ First token after {stats['ttft'] or 0:.2f}s · {stats['tokens']} tokens in "
+                           f"{stats['elapsed']:.2f}s · {tokens_per_second:.1f} tokens/s")
+        else:
+            with st.spinner("Processing..."):
+                escaped_prompt = escape_sql_string(custom_prompt)
+                query = f"""
+                SELECT AI_COMPLETE(
+                    '{model}',
+                    '{escaped_prompt}',
+                    {{'temperature': {temperature}}}
+                ) as result
+                """
+                result, error = execute_query(query)
+                if result:
+                    st.success("**Result:**")
+                    st.markdown(result[0]['RESULT'])
+                    st.code(query, language="sql")
+                elif error:
+                    st.error(f"Error: {error}")
 
 # =============================================================================
 # PAGE: AI_TRANSLATE
@@ -669,7 +2875,7 @@ def page_ai_translate():
         1
     )
     
-    result, _ = execute_query("SELECT item_name, description_english FROM AI_FUNCTIONS_PLAYGROUND.DEMO.MENU_ITEMS")
+    result, _ = execute_metadata_query("SELECT item_name, description_english FROM AI_FUNCTIONS_PLAYGROUND.DEMO.MENU_ITEMS", ["MENU_ITEMS"])
     if result:
         menu_options = {r['ITEM_NAME']: r['DESCRIPTION_ENGLISH'] for r in result}
         
@@ -1122,14 +3328,15 @@ def page_ai_extract():
         4
     )
     
-    # Check if invoices exist in the stage
-    stage_check_query = """
-        SELECT COUNT(*) as cnt 
-        FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE) 
-        WHERE RELATIVE_PATH LIKE '%supplier_invoice%'
+    # List invoices in the stage (one cached listing serves the count and the picker)
+    invoices_query = f"""
+        SELECT d.RELATIVE_PATH, {STAGE_FILE_VERSION_SQL} as file_version
+        FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE) d
+        WHERE d.RELATIVE_PATH LIKE '%supplier_invoice%'
+        ORDER BY d.RELATIVE_PATH
     """
-    stage_result, _ = execute_query(stage_check_query)
-    invoice_count = stage_result[0]['CNT'] if stage_result else 0
+    invoices_result, _ = execute_metadata_query(invoices_query, ["SUPPLIER_DOCUMENTS_STAGE"])
+    invoice_count = len(invoices_result) if invoices_result else 0
     
     if invoice_count == 0:
         st.warning("""
@@ -1142,17 +3349,9 @@ def page_ai_extract():
     else:
         st.success(f"✅ Found {invoice_count} supplier invoice(s) in the stage")
         
-        # Get list of available invoices
-        invoices_query = """
-            SELECT RELATIVE_PATH 
-            FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE) 
-            WHERE RELATIVE_PATH LIKE '%supplier_invoice%'
-            ORDER BY RELATIVE_PATH
-        """
-        invoices_result, _ = execute_query(invoices_query)
-        
         if invoices_result:
             invoice_files = [row['RELATIVE_PATH'] for row in invoices_result]
+            invoice_versions = {row['RELATIVE_PATH']: row['FILE_VERSION'] for row in invoices_result}
             
             selected_invoice = st.selectbox(
                 "Select an invoice to extract:",
@@ -1163,102 +3362,63 @@ def page_ai_extract():
             
             if st.button("🔍 Extract Invoice Data", key="extract_single_invoice"):
                 with st.spinner("Extracting data from invoice PDF..."):
-                    query = f"""
-                    WITH extracted_json AS (
-                        SELECT 
-                            '{selected_invoice}' as file_name,
-                            BUILD_SCOPED_FILE_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE, '{selected_invoice}') as file_url,
-                            AI_EXTRACT(
-                                file => TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE', '{selected_invoice}'),
-                                responseFormat => {{
-                                    'invoice_number': 'The invoice number (e.g., INV-1001)',
-                                    'invoice_date': 'The invoice date in YYYY-MM-DD format',
-                                    'supplier_name': 'The supplier/vendor company name',
-                                    'supplier_address': 'The complete supplier address',
-                                    'supplier_phone': 'The supplier phone number',
-                                    'customer_name': 'The customer company name (should be Guac n Roll)',
-                                    'customer_address': 'The complete customer address',
-                                    'customer_phone': 'The customer phone number',
-                                    'subtotal': 'The subtotal amount before tax as a number',
-                                    'tax_amount': 'The tax amount as a number',
-                                    'total_amount': 'The total invoice amount as a number',
-                                    'payment_terms': 'The payment terms (e.g., Net 30 Days)',
-                                    'item_count': 'The number of line items in the invoice'
-                                }}
-                            ) AS extracted_json
-                    )
-                    SELECT
-                        file_name,
-                        file_url,
-                        extracted_json:response:invoice_number::string as invoice_number,
-                        extracted_json:response:invoice_date::date as invoice_date,
-                        extracted_json:response:supplier_name::string as supplier_name,
-                        extracted_json:response:supplier_address::string as supplier_address,
-                        extracted_json:response:supplier_phone::string as supplier_phone,
-                        extracted_json:response:customer_name::string as customer_name,
-                        extracted_json:response:customer_address::string as customer_address,
-                        extracted_json:response:customer_phone::string as customer_phone,
-                        REPLACE(extracted_json:response:subtotal, '$', '')::float as subtotal,
-                        REPLACE(extracted_json:response:tax_amount, '$', '')::float as tax_amount,
-                        REPLACE(extracted_json:response:total_amount, '$', '')::float as total_amount,
-                        extracted_json:response:payment_terms::string as payment_terms,
-                        extracted_json:response:item_count::integer as item_count,
-                        extracted_json as raw_json
-                    FROM extracted_json
-                    """
-                    
-                    result, error = execute_query(query)
-                    if result and not error:
-                        row = result[0]
-                        
+                    # AI_EXTRACT runs only if this file's content has never been extracted
+                    result, new_count, error = extract_invoices(selected_invoice)
+                    # Kept in session state so the viewer survives page-navigation reruns
+                    st.session_state['extracted_invoice'] = {
+                        'file': selected_invoice,
+                        'row': result[0] if result else None,
+                        'new_count': new_count,
+                        'error': error
+                    }
+            
+            extracted = st.session_state.get('extracted_invoice')
+            if extracted and extracted['file'] == selected_invoice:
+                extraction_query = invoice_extraction_query(selected_invoice)
+                query = invoice_details_query(selected_invoice)
+                row = extracted['row']
+                if row and not extracted['error']:
+                    if extracted['new_count']:
                         st.success("✅ Data extracted and parsed successfully!")
-                        
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            st.markdown("#### 📋 Extracted JSON")
-                            st.json(row['RAW_JSON'])
-                        
-                        with col2:
-                            st.markdown("#### 📄 Invoice PDF")
-                            # Display PDF
-                            try:
-                                # Initialize session state for PDF viewing
-                                if 'pdf_page' not in st.session_state:
-                                    st.session_state['pdf_page'] = 0
-                                
-                                if 'pdf_url' not in st.session_state:
-                                    st.session_state['pdf_url'] = selected_invoice
-                                
-                                if 'pdf_doc' not in st.session_state or st.session_state['pdf_url'] != selected_invoice:
-                                    pdf_stream = session.file.get_stream(f"@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE/{selected_invoice}", decompress=False)
-                                    pdf = pdfium.PdfDocument(pdf_stream)
-                                    st.session_state['pdf_doc'] = pdf
-                                    st.session_state['pdf_url'] = selected_invoice
-                                    st.session_state['pdf_page'] = 0
-                                
-                                # Display current page
-                                display_pdf_page()
-                                
-                                # Download button
-                                pdf_stream_download = session.file.get_stream(f"@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE/{selected_invoice}", decompress=False)
-                                pdf_binary_data = pdf_stream_download.read()
-                                st.download_button(
-                                    label="📥 Download Invoice PDF",
-                                    data=pdf_binary_data,
-                                    file_name=selected_invoice,
-                                    mime="application/pdf",
-                                    use_container_width=True
-                                )
-                                
-                            except Exception as e:
-                                st.error(f"Error retrieving PDF from Snowflake stage: {e}")
-                                st.info("Please ensure the stage path and file name are correct and you have necessary permissions.")
-                        
-                        with st.expander("🔍 View SQL Query"):
-                            st.code(query, language="sql")
-                    elif error:
-                        st.error(f"Error: {error}")
+                    else:
+                        st.success("✅ Data parsed from the stored extraction (no AI_EXTRACT call needed)")
+                    
+                    col1, col2 = st.columns(2)
+                    
+                    with col1:
+                        st.markdown("#### 📋 Extracted JSON")
+                        st.json(row['RAW_JSON'])
+                    
+                    with col2:
+                        st.markdown("#### 📄 Invoice PDF")
+                        # Display PDF
+                        try:
+                            # One cached download serves rendering and the download button
+                            invoice_version = invoice_versions.get(selected_invoice)
+                            pdf_binary_data = read_stage_file("SUPPLIER_DOCUMENTS_STAGE", selected_invoice, invoice_version)
+                            load_pdf('pdf', "SUPPLIER_DOCUMENTS_STAGE", selected_invoice, invoice_version)
+                            
+                            # Display current page
+                            display_pdf_page('pdf')
+                            
+                            # Download button
+                            st.download_button(
+                                label="📥 Download Invoice PDF",
+                                data=pdf_binary_data,
+                                file_name=selected_invoice,
+                                mime="application/pdf",
+                                use_container_width=True
+                            )
+                            
+                        except Exception as e:
+                            st.error(f"Error retrieving PDF from Snowflake stage: {e}")
+                            st.info("Please ensure the stage path and file name are correct and you have necessary permissions.")
+                    
+                    with st.expander("🔍 View SQL Query"):
+                        st.code(extraction_query, language="sql")
+                        st.code(query, language="sql")
+                elif extracted['error']:
+                    st.error(f"Error: {extracted['error']}")
     
     st.markdown("---")
     
@@ -1274,61 +3434,30 @@ def page_ai_extract():
     else:
         st.info(f"📄 **Ready to process {invoice_count} invoice(s)**")
         
+        # What an incremental load would touch, from DIRECTORY() vs. the loaded table
+        changes_result, _ = execute_metadata_query(
+            invoice_changes_query(), ["SUPPLIER_DOCUMENTS_STAGE", "SUPPLIER_INVOICE_DETAILS"]
+        )
+        if changes_result:
+            changes = changes_result[0]
+            st.caption(
+                f"Since the last load: 🆕 {changes['ADDED']} added · ✏️ {changes['CHANGED']} changed · "
+                f"🗑️ {changes['REMOVED']} removed · ✅ {changes['UNCHANGED']} unchanged"
+            )
+        
         col1, col2 = st.columns(2)
         
         with col1:
             if st.button("🔍 Extract All Invoices", key="extract_all_invoices"):
                 with st.spinner(f"Extracting data from {invoice_count} invoice(s)..."):
-                    query = """
-                    WITH extracted_json AS (
-                        SELECT 
-                            RELATIVE_PATH as file_name,
-                            BUILD_SCOPED_FILE_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE, RELATIVE_PATH) as file_url,
-                            AI_EXTRACT(
-                                file => TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE', RELATIVE_PATH),
-                                responseFormat => {
-                                    'invoice_number': 'The invoice number (e.g., INV-1001)',
-                                    'invoice_date': 'The invoice date in YYYY-MM-DD format',
-                                    'supplier_name': 'The supplier/vendor company name',
-                                    'supplier_address': 'The complete supplier address',
-                                    'supplier_phone': 'The supplier phone number',
-                                    'customer_name': 'The customer company name (should be Guac n Roll)',
-                                    'customer_address': 'The complete customer address',
-                                    'customer_phone': 'The customer phone number',
-                                    'subtotal': 'The subtotal amount before tax as a number',
-                                    'tax_amount': 'The tax amount as a number',
-                                    'total_amount': 'The total invoice amount as a number',
-                                    'payment_terms': 'The payment terms (e.g., Net 30 Days)',
-                                    'item_count': 'The number of line items in the invoice'
-                                }
-                            ) AS extracted_json
-                        FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE)
-                        WHERE RELATIVE_PATH LIKE '%supplier_invoice%'
-                    )
-                    SELECT
-                        file_name,
-                        file_url,
-                        extracted_json:response:invoice_number::string as invoice_number,
-                        extracted_json:response:invoice_date::date as invoice_date,
-                        extracted_json:response:supplier_name::string as supplier_name,
-                        extracted_json:response:supplier_address::string as supplier_address,
-                        extracted_json:response:supplier_phone::string as supplier_phone,
-                        extracted_json:response:customer_name::string as customer_name,
-                        extracted_json:response:customer_address::string as customer_address,
-                        extracted_json:response:customer_phone::string as customer_phone,
-                        REPLACE(extracted_json:response:subtotal, '$', '')::float as subtotal,
-                        REPLACE(extracted_json:response:tax_amount, '$', '')::float as tax_amount,
-                        REPLACE(extracted_json:response:total_amount, '$', '')::float as total_amount,
-                        extracted_json:response:payment_terms::string as payment_terms,
-                        extracted_json:response:item_count::integer as item_count,
-                        extracted_json as raw_json
-                    FROM extracted_json
-                    ORDER BY file_name
-                    """
+                    # Only invoices never seen before are sent to AI_EXTRACT
+                    extraction_query = invoice_extraction_query()
+                    query = invoice_details_query()
+                    result, new_count, error = extract_invoices()
                     
-                    result, error = execute_query(query)
                     if result and not error:
                         st.success(f"**✅ Extracted and parsed data from {len(result)} invoice(s)!**")
+                        st.caption(f"🆕 {new_count} newly extracted · ♻️ {len(result) - new_count} reused from INVOICE_EXTRACTIONS")
                         
                         # Display the extracted data
                         display_data = []
@@ -1347,122 +3476,68 @@ def page_ai_extract():
                         st.dataframe(display_data, use_container_width=True)
                         
                         with st.expander("🔍 View SQL Query"):
+                            st.code(extraction_query, language="sql")
                             st.code(query, language="sql")
                     elif error:
                         st.error(f"Error: {error}")
         
         with col2:
+            load_mode = st.radio(
+                "Load mode:",
+                ["Incremental (new & changed files)", "Full reload"],
+                key="invoice_load_mode",
+                horizontal=True
+            )
             if st.button("💾 Extract & Load into Table", key="load_invoices_table"):
+                full_reload = load_mode == "Full reload"
                 with st.spinner("Extracting and loading data into SUPPLIER_INVOICE_DETAILS table..."):
-                    # Truncate table first
-                    truncate_query = "TRUNCATE TABLE AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS"
-                    session.sql(truncate_query).collect()
-                    st.info("🗑️ Table truncated, now extracting and loading...")
+                    # Only files added or changed since the last load reach AI_EXTRACT;
+                    # they are MERGEd in and rows for deleted files are removed
+                    extraction_query = invoice_extraction_query(skip_loaded=True)
+                    merge_query = invoice_merge_query()
+                    prune_query = invoice_prune_query()
+                    counts, error = load_invoices(full_reload)
                     
-                    # Extract and insert
-                    insert_query = """
-                    INSERT INTO AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS (
-                        file_name,
-                        file_url,
-                        invoice_number,
-                        invoice_date,
-                        supplier_name,
-                        supplier_address,
-                        supplier_phone,
-                        customer_name,
-                        customer_address,
-                        customer_phone,
-                        subtotal,
-                        tax_amount,
-                        total_amount,
-                        payment_terms,
-                        item_count,
-                        extraction_date,
-                        raw_json
-                    )
-                    WITH extracted_json AS (
+                    if not error:
+                        st.success("✅ Data loaded successfully into SUPPLIER_INVOICE_DETAILS table!")
+                        if full_reload:
+                            st.info("🗑️ Table truncated before loading")
+                        st.caption(
+                            f"🤖 {counts['extracted']} AI_EXTRACT call(s) · 🆕 {counts['inserted']} inserted · "
+                            f"✏️ {counts['updated']} updated · 🗑️ {counts['removed']} removed"
+                        )
+                        
+                        # Show row count
+                        count_query = "SELECT COUNT(*) as cnt FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS"
+                        count_result, _ = execute_metadata_query(count_query, ["SUPPLIER_INVOICE_DETAILS"])
+                        if count_result:
+                            st.info(f"📊 Total records loaded: {count_result[0]['CNT']}")
+                        
+                        # Show loaded data
+                        display_query = """
                         SELECT 
-                            RELATIVE_PATH as file_name,
-                            BUILD_SCOPED_FILE_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE, RELATIVE_PATH) as file_url,
-                            AI_EXTRACT(
-                                file => TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE', RELATIVE_PATH),
-                                responseFormat => {
-                                    'invoice_number': 'The invoice number (e.g., INV-1001)',
-                                    'invoice_date': 'The invoice date in YYYY-MM-DD format',
-                                    'supplier_name': 'The supplier/vendor company name',
-                                    'supplier_address': 'The complete supplier address',
-                                    'supplier_phone': 'The supplier phone number',
-                                    'customer_name': 'The customer company name (should be Guac n Roll)',
-                                    'customer_address': 'The complete customer address',
-                                    'customer_phone': 'The customer phone number',
-                                    'subtotal': 'The subtotal amount before tax as a number',
-                                    'tax_amount': 'The tax amount as a number',
-                                    'total_amount': 'The total invoice amount as a number',
-                                    'payment_terms': 'The payment terms (e.g., Net 30 Days)',
-                                    'item_count': 'The number of line items in the invoice'
-                                }
-                            ) AS extracted_json
-                        FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_DOCUMENTS_STAGE)
-                        WHERE RELATIVE_PATH LIKE '%supplier_invoice%'
-                    )
-                    SELECT
-                        file_name,
-                        file_url,
-                        extracted_json:response:invoice_number::string,
-                        extracted_json:response:invoice_date::date,
-                        extracted_json:response:supplier_name::string,
-                        extracted_json:response:supplier_address::string,
-                        extracted_json:response:supplier_phone::string,
-                        extracted_json:response:customer_name::string,
-                        extracted_json:response:customer_address::string,
-                        extracted_json:response:customer_phone::string,
-                        REPLACE(extracted_json:response:subtotal, '$', '')::float,
-                        REPLACE(extracted_json:response:tax_amount, '$', '')::float,
-                        REPLACE(extracted_json:response:total_amount, '$', '')::float,
-                        extracted_json:response:payment_terms::string,
-                        extracted_json:response:item_count::integer,
-                        CURRENT_DATE as extraction_date,
-                        extracted_json as raw_json
-                    FROM extracted_json
-                    """
-                    
-                    try:
-                        result, error = execute_query(insert_query)
+                            invoice_number,
+                            invoice_date,
+                            supplier_name,
+                            subtotal,
+                            tax_amount,
+                            total_amount,
+                            payment_terms,
+                            item_count
+                        FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS
+                        ORDER BY invoice_date DESC
+                        """
+                        display_result, _ = execute_query(display_query)
+                        if display_result:
+                            st.markdown("**📊 Loaded Invoice Data:**")
+                            st.dataframe(display_result, use_container_width=True)
                         
-                        if not error:
-                            st.success("✅ Data loaded successfully into SUPPLIER_INVOICE_DETAILS table!")
-                            
-                            # Show row count
-                            count_query = "SELECT COUNT(*) as cnt FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS"
-                            count_result, _ = execute_query(count_query)
-                            if count_result:
-                                st.info(f"📊 Total records loaded: {count_result[0]['CNT']}")
-                            
-                            # Show loaded data
-                            display_query = """
-                            SELECT 
-                                invoice_number,
-                                invoice_date,
-                                supplier_name,
-                                subtotal,
-                                tax_amount,
-                                total_amount,
-                                payment_terms,
-                                item_count
-                            FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS
-                            ORDER BY invoice_date DESC
-                            """
-                            display_result, _ = execute_query(display_query)
-                            if display_result:
-                                st.markdown("**📊 Loaded Invoice Data:**")
-                                st.dataframe(display_result, use_container_width=True)
-                            
-                            with st.expander("🔍 View INSERT SQL Query"):
-                                st.code(insert_query, language="sql")
-                        else:
-                            st.error(f"Error loading data: {error}")
-                    except Exception as e:
-                        st.error(f"Error: {str(e)}")
+                        with st.expander("🔍 View MERGE SQL Query"):
+                            st.code(extraction_query, language="sql")
+                            st.code(merge_query, language="sql")
+                            st.code(prune_query, language="sql")
+                    else:
+                        st.error(f"Error loading data: {error}")
     
     st.markdown("---")
     
@@ -1475,7 +3550,7 @@ def page_ai_extract():
     
     # Check if table has data
     count_query = "SELECT COUNT(*) as cnt FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS"
-    count_result, _ = execute_query(count_query)
+    count_result, _ = execute_metadata_query(count_query, ["SUPPLIER_INVOICE_DETAILS"])
     table_count = count_result[0]['CNT'] if count_result else 0
     
     if table_count == 0:
@@ -1496,7 +3571,7 @@ def page_ai_extract():
         GROUP BY DATE_TRUNC('MONTH', invoice_date)
         ORDER BY invoice_month DESC
         """
-        result2, _ = execute_query(query2)
+        result2, _ = execute_metadata_query(query2, ["SUPPLIER_INVOICE_DETAILS"])
         if result2:
             st.dataframe(result2, use_container_width=True)
             with st.expander("🔍 View SQL"):
@@ -1519,7 +3594,7 @@ def page_ai_extract():
         FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPLIER_INVOICE_DETAILS
         ORDER BY invoice_date DESC
         """
-        result4, _ = execute_query(query4)
+        result4, _ = execute_metadata_query(query4, ["SUPPLIER_INVOICE_DETAILS"])
         if result4:
             st.dataframe(result4, use_container_width=True)
             with st.expander("🔍 View SQL"):
@@ -1663,47 +3738,17 @@ def page_ai_classify():
         3
     )
     
-    st.info("📸 **Batch Processing:** Classify all images in the stage with a single query")
+    st.info("📸 **Batch Processing:** Tag all images in the stage once, then read cuisine, dish type and visual traits from IMAGE_TAGS")
     
     if st.button("Classify All Images", key="classify_all_images_btn"):
         with st.spinner("Analyzing all images in stage..."):
-            query = """
-                 WITH pictures AS (
-                     SELECT
-                         TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE/' || RELATIVE_PATH) AS img,
-                         RELATIVE_PATH as FILE_NAME
-                     FROM DIRECTORY('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE')
-                 )
-                 SELECT
-                     p.FILE_NAME,
-                     TO_VARCHAR(GET_PRESIGNED_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE, p.FILE_NAME, 3600)) as image_url,
-                     AI_CLASSIFY(
-                         p.img,
-                         [
-                             {'label': 'Asian Cuisine', 'description': 'Japanese, Chinese, Korean, Thai, Vietnamese food'},
-                             {'label': 'Mexican Cuisine', 'description': 'Tacos, burritos, quesadillas, nachos'},
-                             {'label': 'American Cuisine', 'description': 'Burgers, hot dogs, fries, BBQ'},
-                             {'label': 'Middle Eastern Cuisine', 'description': 'Gyros, falafel, shawarma, kebabs'},
-                             {'label': 'European Cuisine', 'description': 'French, Italian, German, British food'},
-                             {'label': 'Dessert', 'description': 'Sweet treats, cakes, ice cream, pastries'}
-                         ]
-                     ) as cuisine_classification_json,
-                     REPLACE(REPLACE(REPLACE(
-                         AI_CLASSIFY(
-                             p.img,
-                             [
-                                 {'label': 'Asian Cuisine', 'description': 'Japanese, Chinese, Korean, Thai, Vietnamese food'},
-                                 {'label': 'Mexican Cuisine', 'description': 'Tacos, burritos, quesadillas, nachos'},
-                                 {'label': 'American Cuisine', 'description': 'Burgers, hot dogs, fries, BBQ'},
-                                 {'label': 'Middle Eastern Cuisine', 'description': 'Gyros, falafel, shawarma, kebabs'},
-                                 {'label': 'European Cuisine', 'description': 'French, Italian, German, British food'},
-                                 {'label': 'Dessert', 'description': 'Sweet treats, cakes, ice cream, pastries'}
-                             ]
-                         ):labels::string, '[', ''), ']', ''), '"', '') as cuisine_label
-                 FROM pictures p
-                 ORDER BY p.FILE_NAME;
-             """
-            result, error = execute_query(query)
+            # One AI_CLASSIFY pass per new image; everything else is read from IMAGE_TAGS
+            tagging_query = image_tagging_query()
+            tagged, error = tag_images()
+            query = tagged_images_query()
+            result = None
+            if not error:
+                result, error = execute_query(query)
             
             if result and len(result) > 0:
                 st.success(f"**✅ Successfully classified {len(result)} images:**")
@@ -1714,8 +3759,9 @@ def page_ai_classify():
                     with cols[idx % 5]:
                         # Display image
                         try:
-                            if row['IMAGE_URL']:
-                                st.image(row['IMAGE_URL'], use_container_width=True)
+                            image_url = get_stage_url("IMAGE_STAGE", row['FILE_NAME'])
+                            if image_url:
+                                st.image(image_url, use_container_width=True)
                             else:
                                 st.info("📁 " + row['FILE_NAME'])
                         except:
@@ -1725,7 +3771,7 @@ def page_ai_classify():
                         st.markdown(f"**{row['FILE_NAME']}**")
                         
                         # Get cleaned label
-                        label = row['CUISINE_LABEL'] if 'CUISINE_LABEL' in row.as_dict() and row['CUISINE_LABEL'] else 'Unknown'
+                        label = row['CUISINE_LABEL'] or 'Unknown'
                         
                         # Color-coded badge based on cuisine type
                         if 'Asian Cuisine' in label:
@@ -1754,9 +3800,13 @@ def page_ai_classify():
                             {label}
                         </div>
                         """, unsafe_allow_html=True)
+                        st.caption(" · ".join(tags for tags in [row['DISH_TYPES'], row['VISUAL_TRAITS']] if tags))
+                
+                st.caption(f"🏷️ {tagged} image(s) tagged with AI_CLASSIFY · all others read from IMAGE_TAGS")
                 
                 # Show query in expandable section
                 with st.expander("🔍 View SQL Query"):
+                    st.code(tagging_query, language="sql")
                     st.code(query, language="sql")
                     
             elif error:
@@ -1931,13 +3981,7 @@ def page_ai_filter():
     st.info("📸 **Working with Images:** Uses DIRECTORY() to scan all images in the stage and filter with natural language")
     
     # Pre-defined filter options
-    filter_options = [
-        "Does this image show a dish served in a bowl?",
-        "Does this image contain meat?",
-        "Is this a dessert or sweet item?",
-        "Does this image show a wrapped or handheld food item?",
-        "Does this food appear to have vegetables?"
-    ]
+    filter_options = list(IMAGE_FILTER_TAGS.keys())
     
     # Allow custom or predefined question
     filter_type = st.radio("Filter type:", ["Predefined", "Custom"], horizontal=True, key="filter_type")
@@ -1952,23 +3996,32 @@ def page_ai_filter():
     if st.button("Filter Images", key="filter_images"):
         with st.spinner("Scanning and filtering all images in stage..."):
             escaped_question = escape_sql_string(image_filter_question)
+            filter_tag = IMAGE_FILTER_TAGS.get(image_filter_question)
             
-            # Use DIRECTORY syntax as provided by user
-            query = f"""
-            WITH pictures AS (
+            if filter_tag:
+                # Answered from stored tags; only never-seen images reach the model
+                tagged, error = tag_images()
+                query = tagged_images_query(filter_tag)
+                st.caption(f"🏷️ Answered from IMAGE_TAGS ('{filter_tag}') · {tagged} new image(s) tagged")
+            else:
+                # Use DIRECTORY syntax as provided by user
+                error = None
+                query = f"""
+                WITH pictures AS (
+                    SELECT
+                        TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE/' || RELATIVE_PATH) AS img,
+                        RELATIVE_PATH as file_name
+                    FROM DIRECTORY('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE')
+                )
                 SELECT
-                    TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE/' || RELATIVE_PATH) AS img,
-                    RELATIVE_PATH as file_name
-                FROM DIRECTORY('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE')
-            )
-            SELECT
-                file_name,
-                TO_VARCHAR(GET_PRESIGNED_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE, file_name, 3600)) as image_url
-            FROM pictures
-            WHERE AI_FILTER('{escaped_question}', img)
-            """
+                    file_name
+                FROM pictures
+                WHERE AI_FILTER('{escaped_question}', img)
+                """
             
-            result, error = execute_query(query)
+            result = None
+            if not error:
+                result, error = execute_query(query)
             
             if result and len(result) > 0:
                 st.success(f"**✅ Found {len(result)} matching images:**")
@@ -1979,8 +4032,9 @@ def page_ai_filter():
                     with cols[idx % 4]:
                         st.markdown(f"**{row['FILE_NAME']}**")
                         try:
-                            if row['IMAGE_URL']:
-                                st.image(row['IMAGE_URL'], use_container_width=True)
+                            image_url = get_stage_url("IMAGE_STAGE", row['FILE_NAME'])
+                            if image_url:
+                                st.image(image_url, use_container_width=True)
                             else:
                                 st.info("📁 " + row['FILE_NAME'])
                         except Exception as e:
@@ -2026,36 +4080,33 @@ def page_ai_similarity():
         1
     )
     
-    result, _ = execute_query("SELECT review_id, customer_name, review_text FROM AI_FUNCTIONS_PLAYGROUND.DEMO.CUSTOMER_REVIEWS")
+    result, _ = execute_metadata_query("SELECT review_id, customer_name, review_text FROM AI_FUNCTIONS_PLAYGROUND.DEMO.CUSTOMER_REVIEWS", ["CUSTOMER_REVIEWS"])
     if result:
-        review_options = {f"{r['CUSTOMER_NAME']}: {r['REVIEW_TEXT'][:50]}...": r['REVIEW_TEXT'] 
+        review_options = {f"{r['CUSTOMER_NAME']}: {r['REVIEW_TEXT'][:50]}...": r 
                          for r in result}
-        selected_review = st.selectbox("Select a reference review:", list(review_options.keys()))
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            selected_review = st.selectbox("Select a reference review:", list(review_options.keys()))
+        with col2:
+            review_top_k = st.number_input("Top k:", min_value=1, max_value=50, value=10, key="review_top_k")
         
         if st.button("Find Similar Reviews", key="similar_reviews"):
             with st.spinner("Calculating similarity across all reviews..."):
-                reference_text = escape_sql_string(review_options[selected_review])
-                query = f"""
-                SELECT 
-                    review_id,
-                    customer_name,
-                    food_truck_name,
-                    rating,
-                    AI_SIMILARITY(
-                        '{reference_text}',
-                        review_text
-                    ) as similarity_score,
-                    review_text
-                FROM AI_FUNCTIONS_PLAYGROUND.DEMO.CUSTOMER_REVIEWS
-                WHERE review_text != '{reference_text}'
-                ORDER BY similarity_score DESC
-                """
-                result, error = execute_query(query)
+                # Reviews are re-embedded only after CUSTOMER_REVIEWS changed; the lookup itself only compares stored vectors
+                refresh_query = embedding_refresh_query('reviews')
+                embedded, error = refresh_embeddings('reviews')
+                query = similar_reviews_query(review_options[selected_review]['REVIEW_ID'], review_top_k)
+                result = None
+                if not error:
+                    result, error = execute_query(query)
+                if error:
+                    st.error(f"Error: {error}")
                 if result:
-                    st.success(f"**✅ Found {len(result)} reviews ranked by similarity:**")
+                    st.success(f"**✅ Found the {len(result)} most similar reviews:**")
+                    st.caption(f"🧮 {embedded} review(s) embedded with AI_EMBED · all others reused from REVIEW_EMBEDDINGS")
                     
                     st.markdown("**📝 Reference Review:**")
-                    st.info(review_options[selected_review])
+                    st.info(review_options[selected_review]['REVIEW_TEXT'])
                     
                     st.markdown("**🔍 Similar Reviews:**")
                     
@@ -2072,6 +4123,7 @@ def page_ai_similarity():
                         })
                     
                     st.dataframe(display_df, use_container_width=True)
+                    st.code(refresh_query, language="sql")
                     st.code(query, language="sql")
     
     st.markdown("---")
@@ -2083,35 +4135,32 @@ def page_ai_similarity():
         2
     )
     
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        ticket_top_k = st.number_input("Nearest neighbours per ticket (k):", min_value=1, max_value=20, value=3, key="ticket_top_k")
+    with col2:
+        ticket_threshold = st.slider("Minimum similarity:", min_value=0.5, max_value=0.95, value=0.7, step=0.05, key="ticket_threshold")
+    with col3:
+        ticket_window = st.number_input("Candidate window (0 = all tickets):", min_value=0, max_value=100000,
+                                        value=TICKET_SIMILARITY_WINDOW, step=100, key="ticket_window",
+                                        help="Each ticket is compared with this many tickets on either side of it "
+                                             "in ticket_id order. 0 finds exact nearest neighbours across the whole "
+                                             "table, at a cost that grows with the square of the ticket count.")
+    
     if st.button("Find Similar Tickets", key="similar_tickets"):
-        with st.spinner("Analyzing all ticket pairs..."):
-            query = """
-            WITH ticket_pairs AS (
-                SELECT 
-                    t1.ticket_id as ticket1_id,
-                    t1.customer_name as customer1,
-                    t1.issue_description as issue1,
-                    t2.ticket_id as ticket2_id,
-                    t2.customer_name as customer2,
-                    t2.issue_description as issue2,
-                    AI_SIMILARITY(t1.issue_description, t2.issue_description) as similarity
-                FROM AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPORT_TICKETS t1
-                JOIN AI_FUNCTIONS_PLAYGROUND.DEMO.SUPPORT_TICKETS t2 
-                    ON t1.ticket_id < t2.ticket_id
-            )
-            SELECT 
-                ticket1_id,
-                customer1,
-                ticket2_id,
-                customer2,
-                similarity,
-                issue1,
-                issue2
-            FROM ticket_pairs
-            WHERE similarity > 0.7
-            ORDER BY similarity DESC
-            """
-            result, error = execute_query(query)
+        with st.spinner("Updating ticket embeddings and finding nearest neighbours..."):
+            # Only new or edited tickets are embedded; similarity is vector math over stored embeddings
+            refresh_query = embedding_refresh_query('tickets')
+            embedded, error = refresh_embeddings('tickets')
+            query = similar_ticket_pairs_query(ticket_top_k, ticket_threshold, ticket_window)
+            result = None
+            if not error:
+                result, error = execute_query(query)
+            if error:
+                st.error(f"Error: {error}")
+            else:
+                scope = f"each ticket compared with {ticket_window} tickets on either side" if ticket_window else "every ticket pair compared"
+                st.caption(f"🧮 {embedded} ticket(s) embedded with AI_EMBED · all others reused from TICKET_EMBEDDINGS · {scope}")
             if result:
                 st.success(f"**✅ Found {len(result)} similar ticket pairs:**")
                 for row in result:
@@ -2123,6 +4172,7 @@ def page_ai_similarity():
                         with col2:
                             st.markdown(f"**Ticket #{row['TICKET2_ID']} ({row['CUSTOMER2']})**")
                             st.write(row['ISSUE2'])
+                st.code(refresh_query, language="sql")
                 st.code(query, language="sql")
     
     st.markdown("---")
@@ -2138,7 +4188,7 @@ def page_ai_similarity():
     
     # Get list of available images from stage
     images_query = "SELECT RELATIVE_PATH FROM DIRECTORY('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE') ORDER BY RELATIVE_PATH"
-    images_result, _ = execute_query(images_query)
+    images_result, _ = execute_metadata_query(images_query, ["IMAGE_STAGE"])
     
     if images_result:
         available_images = [row['RELATIVE_PATH'] for row in images_result]
@@ -2151,10 +4201,9 @@ def page_ai_similarity():
             st.write("")  # Spacer
         with col2:
             try:
-                ref_url_query = f"SELECT TO_VARCHAR(GET_PRESIGNED_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE, '{reference_img}', 3600)) as img_url"
-                ref_result, _ = execute_query(ref_url_query)
-                if ref_result and ref_result[0]['IMG_URL']:
-                    st.image(ref_result[0]['IMG_URL'], caption=f"Reference: {reference_img}", use_container_width=True)
+                ref_url = get_stage_url("IMAGE_STAGE", reference_img)
+                if ref_url:
+                    st.image(ref_url, caption=f"Reference: {reference_img}", use_container_width=True)
                 else:
                     st.info(f"📁 {reference_img}")
             except Exception as e:
@@ -2164,26 +4213,13 @@ def page_ai_similarity():
         
         if st.button("Find Similar Images", key="similar_images"):
             with st.spinner("Analyzing images..."):
-                query = f"""
-                WITH all_images AS (
-                    SELECT
-                        RELATIVE_PATH as file_name,
-                        TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE/' || RELATIVE_PATH) AS img
-                    FROM DIRECTORY('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE')
-                    WHERE RELATIVE_PATH != '{reference_img}'
-                )
-                SELECT 
-                    file_name,
-                    TO_VARCHAR(GET_PRESIGNED_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE, file_name, 3600)) as image_url,
-                    AI_SIMILARITY(
-                        TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE/{reference_img}'),
-                        img
-                    ) as similarity_score
-                FROM all_images
-                ORDER BY similarity_score DESC
-                LIMIT 3
-                """
-                result, error = execute_query(query)
+                # Images are re-embedded only after the stage listing changed; the search is a vector lookup over IMAGE_EMBEDDINGS
+                refresh_query = embedding_refresh_query('images')
+                embedded, error = refresh_embeddings('images')
+                query = similar_images_query(reference_img, 3)
+                result = None
+                if not error:
+                    result, error = execute_query(query)
                 
                 if result and len(result) > 0:
                     st.success(f"**🎯 Top 3 most similar images to {reference_img}:**")
@@ -2195,13 +4231,16 @@ def page_ai_similarity():
                         with cols[i]:
                             st.markdown(f"**#{i+1}: Similarity {row['SIMILARITY_SCORE']:.4f}**")
                             try:
-                                if row['IMAGE_URL']:
-                                    st.image(row['IMAGE_URL'], caption=row['FILE_NAME'], use_container_width=True)
+                                image_url = get_stage_url("IMAGE_STAGE", row['FILE_NAME'])
+                                if image_url:
+                                    st.image(image_url, caption=row['FILE_NAME'], use_container_width=True)
                                 else:
                                     st.info(f"📁 {row['FILE_NAME']}")
                             except Exception as e:
                                 st.info(f"📁 {row['FILE_NAME']}")
                     
+                    st.caption(f"🧮 {embedded} image(s) embedded with AI_EMBED · all others reused from IMAGE_EMBEDDINGS")
+                    st.code(refresh_query, language="sql")
                     st.code(query, language="sql")
                 elif error:
                     st.error(f"Error: {error}")
@@ -2497,40 +4536,43 @@ def page_ai_transcribe():
     
     st.info(f"📞 **Selected Call:** {audio_files[selected_audio]}")
     
-    # Audio player - get scoped URL from stage
+    # Audio player - URLs for the whole stage are cached until shortly before they expire
     try:
         # Get presigned URL for audio playback
-        url_query = f"SELECT GET_PRESIGNED_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.AUDIO_STAGE, '{selected_audio}', 3600) as audio_url"
-        url_result, _ = execute_query(url_query)
-        if url_result and url_result[0]['AUDIO_URL']:
-            audio_url = url_result[0]['AUDIO_URL']
+        audio_url = get_stage_url("AUDIO_STAGE", selected_audio)
+        if audio_url:
             st.audio(audio_url, format='audio/wav')
         else:
             st.caption("🎵 Audio player unavailable - using BUILD_SCOPED_FILE_URL as fallback")
             # Fallback to scoped file URL
-            scoped_query = f"SELECT BUILD_SCOPED_FILE_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.AUDIO_STAGE, '{selected_audio}') as audio_url"
-            scoped_result, _ = execute_query(scoped_query)
-            if scoped_result and scoped_result[0]['AUDIO_URL']:
-                st.audio(scoped_result[0]['AUDIO_URL'], format='audio/wav')
+            scoped_url = get_stage_url("AUDIO_STAGE", selected_audio, scoped=True)
+            if scoped_url:
+                st.audio(scoped_url, format='audio/wav')
     except Exception as e:
         st.caption(f"🎵 Audio player unavailable: {str(e)}")
     
     if st.button("Transcribe Audio", key="transcribe_basic"):
         with st.spinner("Transcribing audio..."):
+            # AI_TRANSCRIBE runs only if this recording has never been transcribed
+            new_count, error = ensure_transcripts([selected_audio])
             query = f"""
             SELECT 
-                '{selected_audio}' as audio_file,
-                AI_TRANSCRIBE(
-                    TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.AUDIO_STAGE/{selected_audio}')
-                ) as transcription
+                audio_file,
+                transcript_json as transcription
+            FROM ({transcripts_query([selected_audio])}
+            )
             """
-            result, error = execute_query(query)
+            result = None
+            if not error:
+                result, error = execute_query(query)
             if result:
                 transcription_data = json.loads(result[0]['TRANSCRIPTION'])
                 st.success("**Transcription Complete!**")
+                show_transcript_source(new_count)
                 st.markdown("**Transcribed Text:**")
                 st.info(transcription_data.get('text', 'No text found'))
                 st.caption(f"Language: {transcription_data.get('language', 'unknown').upper()}")
+                st.code(transcription_query([selected_audio]), language="sql")
                 st.code(query, language="sql")
             elif error:
                 st.error(f"Error: {error}")
@@ -2553,13 +4595,9 @@ def page_ai_transcribe():
     
     if st.button("Transcribe & Analyze Sentiment", key="transcribe_sentiment"):
         with st.spinner("Transcribing and analyzing..."):
+            new_count, error = ensure_transcripts([selected_audio2])
             query = f"""
-            WITH transcription AS (
-                SELECT 
-                    '{selected_audio2}' as audio_file,
-                    AI_TRANSCRIBE(
-                        TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.AUDIO_STAGE/{selected_audio2}')
-                    ) as transcript_json
+            WITH transcription AS ({transcripts_query([selected_audio2])}
             )
             SELECT 
                 audio_file,
@@ -2572,9 +4610,12 @@ def page_ai_transcribe():
                 END as sentiment_category
             FROM transcription
             """
-            result, error = execute_query(query)
+            result = None
+            if not error:
+                result, error = execute_query(query)
             if result:
                 st.success("**Analysis Complete!**")
+                show_transcript_source(new_count)
                 st.markdown("**Transcribed Text:**")
                 st.write(result[0]['TRANSCRIBED_TEXT'])
                 
@@ -2610,12 +4651,9 @@ def page_ai_transcribe():
     
     if st.button("Transcribe & Generate Response", key="transcribe_complete"):
         with st.spinner("Transcribing and generating response..."):
+            new_count, error = ensure_transcripts([selected_audio3])
             query = f"""
-            WITH transcription AS (
-                SELECT 
-                    AI_TRANSCRIBE(
-                        TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.AUDIO_STAGE/{selected_audio3}')
-                    ) as transcript_json
+            WITH transcription AS ({transcripts_query([selected_audio3])}
             )
             SELECT 
                 transcript_json:text::STRING as transcribed_text,
@@ -2626,9 +4664,12 @@ def page_ai_transcribe():
                 ) as suggested_response
             FROM transcription
             """
-            result, error = execute_query(query)
+            result = None
+            if not error:
+                result, error = execute_query(query)
             if result:
                 st.success("**Response Generated!**")
+                show_transcript_source(new_count)
                 
                 with st.expander("📝 View Transcription"):
                     st.write(result[0]['TRANSCRIBED_TEXT'])
@@ -2651,68 +4692,57 @@ def page_ai_transcribe():
     
     st.info("🎯 **Complete Analysis Pipeline:** Transcribe → Summarize → Analyze Sentiment → Generate Actions")
     
-    # Select number of calls and model
+    # Every recording in the stage is analyzed; the slider only limits the detail cards
     col1, col2 = st.columns([3, 1])
     with col1:
-        num_calls = st.slider("Number of calls to analyze:", min_value=2, max_value=5, value=3, key="num_calls_dashboard")
+        num_calls = st.slider("Calls to show in detail (most negative first):", min_value=2, max_value=10, value=3, key="num_calls_dashboard")
     with col2:
         model_ex4_transcribe = st.selectbox("Model:", AI_COMPLETE_MODELS, key="model_transcribe_ex4")
     
     if st.button("Analyze Calls", key="analyze_calls_dashboard"):
-        with st.spinner(f"Processing {num_calls} call recordings..."):
-            # Get subset of audio files
-            audio_list = list(audio_files.keys())[:num_calls]
+        with st.spinner("Processing call recordings in AUDIO_STAGE..."):
+            progress = st.progress(0.0, text="Finding calls that need analysis...")
             
-            # Build comprehensive analysis query
-            union_parts = []
-            for audio in audio_list:
-                union_parts.append(f"""
-                SELECT 
-                    '{audio}' as filename,
-                    '{audio_files[audio]}' as call_type,
-                    AI_TRANSCRIBE(TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.AUDIO_STAGE/{audio}')) as transcript_json
-                """)
-            
-            union_query = " UNION ALL ".join(union_parts)
+            def show_progress(done, total):
+                progress.progress(done / total, text=f"Completed {done} of {total} batch step(s)")
             
-            query = f"""
-            WITH transcriptions AS (
-                {union_query}
-            ),
-            analyzed_calls AS (
-                SELECT 
-                    filename,
-                    call_type,
-                    transcript_json:text::STRING as transcribed_text,
-                    AI_COMPLETE(
-                        '{model_ex4_transcribe}',
-                        'Summarize this customer service call in 2-3 sentences: ' || transcript_json:text::STRING,
-                        {{'temperature': 0.3}}
-                    ) as call_summary,
-                    SNOWFLAKE.CORTEX.SENTIMENT(transcript_json:text::STRING) as sentiment_score,
-                    CASE 
-                        WHEN SNOWFLAKE.CORTEX.SENTIMENT(transcript_json:text::STRING) > 0.3 THEN 'Positive 😊'
-                        WHEN SNOWFLAKE.CORTEX.SENTIMENT(transcript_json:text::STRING) < -0.3 THEN 'Negative 😟'
-                        ELSE 'Neutral 😐'
-                    END as sentiment_category,
-                    AI_COMPLETE(
-                        '{model_ex4_transcribe}',
-                        'Based on this customer service call transcription, provide exactly 3 specific recommended actions. Format as a numbered list (1., 2., 3.): ' || transcript_json:text::STRING,
-                        {{'temperature': 0.4}}
-                    ) as recommended_actions
-                FROM transcriptions
-            )
-            SELECT * FROM analyzed_calls
-            """
+            analyzed, failures, error = analyze_calls(model_ex4_transcribe, show_progress)
+            progress.progress(1.0, text=f"🆕 {analyzed} call(s) newly analyzed")
+            for batch, batch_error in failures.items():
+                st.error(f"❌ Error processing batch {batch}: {batch_error}")
             
-            result, error = execute_query(query)
+            query = call_analytics_results_query(model_ex4_transcribe)
+            result = None
+            if not error:
+                result, error = execute_query(query)
             
             if result:
-                st.success(f"**✅ Successfully analyzed {len(result)} calls!**")
+                st.success(f"**✅ {len(result)} call(s) analyzed and stored in CALL_ANALYTICS!**")
+                
+                negative_calls = sum(1 for row in result if row['SENTIMENT_SCORE'] is not None and row['SENTIMENT_SCORE'] < -0.3)
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Calls Analyzed", len(result))
+                with col2:
+                    scores = [row['SENTIMENT_SCORE'] for row in result if row['SENTIMENT_SCORE'] is not None]
+                    st.metric("Average Sentiment", f"{sum(scores) / len(scores):.3f}" if scores else "N/A")
+                with col3:
+                    st.metric("Negative Calls", negative_calls)
+                
+                st.dataframe(
+                    [{
+                        'File': row['FILENAME'],
+                        'Sentiment': row['SENTIMENT_CATEGORY'],
+                        'Score': row['SENTIMENT_SCORE'],
+                        'Summary': row['CALL_SUMMARY']
+                    } for row in result],
+                    use_container_width=True
+                )
                 
-                # Display each call in a card layout
-                for idx, row in enumerate(result, 1):
-                    st.markdown(f"### 📞 Call {idx}: {row['CALL_TYPE']}")
+                # Display the most negative calls in a card layout
+                detail_rows = result[:num_calls]
+                for idx, row in enumerate(detail_rows, 1):
+                    st.markdown(f"### 📞 Call {idx}: {call_type_label(row['FILENAME'], audio_files)}")
                     
                     # Create 3-column layout for key metrics
                     col1, col2, col3 = st.columns([2, 1, 1])
@@ -2740,6 +4770,8 @@ def page_ai_transcribe():
                     """, unsafe_allow_html=True)
                     
                     # Recommended actions in a styled box
+                    actions = json.loads(row['RECOMMENDED_ACTIONS']) if row['RECOMMENDED_ACTIONS'] else []
+                    actions_html = '<br/>'.join(f"{number}. {action}" for number, action in enumerate(actions, 1))
                     st.markdown(f"""
                     <div style='background: linear-gradient(135deg, #F0FDF4 0%, #DCFCE7 100%); 
                                 padding: 15px; 
@@ -2747,19 +4779,22 @@ def page_ai_transcribe():
                                 border-left: 4px solid #22C55E;
                                 margin: 10px 0;'>
                         <strong>✅ Recommended Actions:</strong><br/>
-                        {row['RECOMMENDED_ACTIONS'].replace(chr(10), '<br/>')}
+                        {actions_html}
                     </div>
                     """, unsafe_allow_html=True)
                     
-                    if idx < len(result):
+                    if idx < len(detail_rows):
                         st.markdown("---")
                 
                 # Show the query
                 with st.expander("🔍 View SQL Query"):
+                    st.code(call_analytics_query(["<pending file names>"], model_ex4_transcribe), language="sql")
                     st.code(query, language="sql")
                     
             elif error:
                 st.error(f"Error: {error}")
+            else:
+                st.warning("⚠️ No analyzed calls found. Please upload audio files to AUDIO_STAGE.")
     
     st.markdown("---")
     
@@ -2769,7 +4804,7 @@ def page_ai_transcribe():
     1. **Basic Transcription**: Convert audio to text with language detection
     2. **Sentiment Analysis**: Understand customer emotions from transcribed calls
     3. **AI Response Generation**: Auto-generate customer service responses
-    4. **Batch Processing**: Transcribe and summarize multiple calls at once
+    4. **Batch Processing**: Transcribe and analyze every call in the stage in batches, stored in CALL_ANALYTICS
     
     ### 📋 Supported Formats
     - **Audio**: FLAC, MP3, MP4, OGG, WAV, WEBM
@@ -2803,8 +4838,8 @@ def page_ai_parse_document():
     """, unsafe_allow_html=True)
     
     # Get available PDF documents from stage
-    docs_query = "SELECT RELATIVE_PATH FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.DOCUMENT_STAGE) ORDER BY RELATIVE_PATH"
-    docs_result, docs_error = execute_query(docs_query)
+    docs_query = f"SELECT d.RELATIVE_PATH, {STAGE_FILE_VERSION_SQL} as file_version FROM DIRECTORY(@AI_FUNCTIONS_PLAYGROUND.DEMO.DOCUMENT_STAGE) d ORDER BY d.RELATIVE_PATH"
+    docs_result, docs_error = execute_metadata_query(docs_query, ["DOCUMENT_STAGE"])
     
     if docs_error or not docs_result:
         st.warning("⚠️ No documents found in DOCUMENT_STAGE. Please upload PDF documents to the stage first.")
@@ -2825,6 +4860,17 @@ def page_ai_parse_document():
         for doc in available_docs:
             st.markdown(f"- {doc}")
     
+    # Page-by-page document viewer (rendered pages are cached and neighbours prefetched)
+    pdf_docs = [row for row in docs_result if row['RELATIVE_PATH'].lower().endswith('.pdf')]
+    if pdf_docs and st.toggle("📖 Preview a document", key="show_doc_viewer"):
+        doc_versions = {row['RELATIVE_PATH']: row['FILE_VERSION'] for row in pdf_docs}
+        preview_doc = st.selectbox("Select a document:", list(doc_versions.keys()), key="preview_doc_select")
+        try:
+            load_pdf('doc_viewer', "DOCUMENT_STAGE", preview_doc, doc_versions[preview_doc])
+            display_pdf_page('doc_viewer')
+        except Exception as e:
+            st.error(f"Error retrieving PDF from Snowflake stage: {e}")
+    
     # Example 1: Parse and Store Documents
     show_example_card(
         "Parse Documents and Store Raw Text",
@@ -2845,37 +4891,46 @@ def page_ai_parse_document():
     st.caption(f"**{'⚡ OCR Mode:' if parse_mode == 'OCR' else '📋 LAYOUT Mode:'}** "
                f"{'Faster processing, extracts plain text only (0.5 credits/1K pages)' if parse_mode == 'OCR' else 'Preserves document structure, tables, and formatting - slower processing but more accurate (3.33 credits/1K pages)'}")
     
+    parse_engine = st.radio(
+        "Select execution engine:",
+        ["Set-based", "Concurrent"],
+        format_func=lambda x: f"{x} - {'One INSERT over DIRECTORY(@DOCUMENT_STAGE)' if x == 'Set-based' else f'Async job per file (up to {ASYNC_QUERY_CONCURRENCY} at once, per-file errors)'}",
+        key="parse_engine",
+        horizontal=True
+    )
+    
     if st.button("Parse All Documents", key="parse_all_docs"):
         with st.spinner(f"Parsing {doc_count} document(s) in {parse_mode} mode..."):
             # First, truncate existing table
             truncate_query = "TRUNCATE TABLE AI_FUNCTIONS_PLAYGROUND.DEMO.PARSE_DOC_RAW_TEXT;"
             execute_query(truncate_query)
             
-            total_docs = 0
-            for doc_file in available_docs:
-                st.write(f"Processing **{doc_file}**...")
-                
-                # Parse and store raw text
-                parse_query = f"""
-                INSERT INTO AI_FUNCTIONS_PLAYGROUND.DEMO.PARSE_DOC_RAW_TEXT (file_name, file_url, raw_text)
-                SELECT 
-                    '{doc_file}' as file_name,
-                    TO_VARCHAR(GET_PRESIGNED_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.DOCUMENT_STAGE, '{doc_file}', 3600)) as file_url,
-                    parsed_json:content::STRING as raw_text
-                FROM (
-                    SELECT 
-                        AI_PARSE_DOCUMENT(
-                            TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.DOCUMENT_STAGE/{doc_file}'),
-                            {{'mode': '{parse_mode}'}}
-                        ) as parsed_json
-                )
-                """
+            if parse_engine == "Set-based":
+                # Snowflake parallelises AI_PARSE_DOCUMENT across the whole stage listing
+                parse_query = parse_documents_query(parse_mode)
                 result, error = execute_query(parse_query)
-                
-                if not error:
-                    total_docs += 1
-                    st.success(f"✅ {doc_file} parsed successfully")
+                if error:
+                    st.error(f"❌ Error parsing documents: {error}")
+                    total_docs = 0
                 else:
+                    total_docs = result[0][0] if result else 0
+            else:
+                # One async job per file; the slowest file bounds the wall time
+                parse_query = parse_documents_query(parse_mode, "document.pdf")
+                progress = st.progress(0.0, text=f"Parsed 0 of {doc_count} document(s)")
+                completed = []
+                
+                def show_progress(doc_file, result, error):
+                    completed.append(doc_file)
+                    progress.progress(len(completed) / doc_count, text=f"Parsed {len(completed)} of {doc_count} document(s)")
+                
+                outcomes = execute_queries_async(
+                    {doc_file: parse_documents_query(parse_mode, doc_file) for doc_file in available_docs},
+                    on_done=show_progress
+                )
+                failures = {doc_file: error for doc_file, (_, error) in outcomes.items() if error}
+                total_docs = doc_count - len(failures)
+                for doc_file, error in failures.items():
                     st.error(f"❌ Error parsing {doc_file}: {error}")
             
             if total_docs > 0:
@@ -2900,20 +4955,7 @@ def page_ai_parse_document():
                             st.text_area("Text Preview", row['PREVIEW'] + "...", height=150, key=f"preview_{row['FILE_NAME']}")
                 
                 with st.expander("🔍 View SQL Query"):
-                    st.code(f"""
-INSERT INTO AI_FUNCTIONS_PLAYGROUND.DEMO.PARSE_DOC_RAW_TEXT (file_name, file_url, raw_text)
-SELECT 
-    'document.pdf' as file_name,
-    TO_VARCHAR(GET_PRESIGNED_URL(@AI_FUNCTIONS_PLAYGROUND.DEMO.DOCUMENT_STAGE, 'document.pdf', 3600)) as file_url,
-    parsed_json:content::STRING as raw_text
-FROM (
-    SELECT 
-        AI_PARSE_DOCUMENT(
-            TO_FILE('@AI_FUNCTIONS_PLAYGROUND.DEMO.DOCUMENT_STAGE/document.pdf'),
-            {{'mode': '{parse_mode}'}}
-        ) as parsed_json
-)
-                    """, language="sql")
+                    st.code(parse_query, language="sql")
     
     st.markdown("---")
     
@@ -2938,7 +4980,7 @@ FROM (
         with st.spinner("Chunking documents..."):
             # First check if there are documents to chunk
             check_query = "SELECT COUNT(*) as doc_count FROM AI_FUNCTIONS_PLAYGROUND.DEMO.PARSE_DOC_RAW_TEXT"
-            check_result, _ = execute_query(check_query)
+            check_result, _ = execute_metadata_query(check_query, ["PARSE_DOC_RAW_TEXT"])
             
             if check_result and check_result[0]['DOC_COUNT'] == 0:
                 st.warning("⚠️ No documents found in PARSE_DOC_RAW_TEXT table. Please run Example 1 first!")
@@ -3056,7 +5098,7 @@ FROM AI_FUNCTIONS_PLAYGROUND.DEMO.PARSE_DOC_RAW_TEXT,
         with st.spinner("Creating Cortex Search Service..."):
             # First check if there are chunks to index
             check_query = "SELECT COUNT(*) as chunk_count FROM AI_FUNCTIONS_PLAYGROUND.DEMO.PARSE_DOC_CHUNKED_TEXT"
-            check_result, _ = execute_query(check_query)
+            check_result, _ = execute_metadata_query(check_query, ["PARSE_DOC_CHUNKED_TEXT"])
             
             if check_result and check_result[0]['CHUNK_COUNT'] == 0:
                 st.warning("⚠️ No document chunks found in PARSE_DOC_CHUNKED_TEXT table. Please run Examples 1 and 2 first!")
@@ -3171,7 +5213,7 @@ def page_ai_summarize_agg():
         1
     )
     
-    result, _ = execute_query("SELECT DISTINCT food_truck_name FROM AI_FUNCTIONS_PLAYGROUND.DEMO.CUSTOMER_REVIEWS ORDER BY food_truck_name")
+    result, _ = execute_metadata_query("SELECT DISTINCT food_truck_name FROM AI_FUNCTIONS_PLAYGROUND.DEMO.CUSTOMER_REVIEWS ORDER BY food_truck_name", ["CUSTOMER_REVIEWS"])
     if result:
         truck_options = [r['FOOD_TRUCK_NAME'] for r in result]
         selected_truck = st.selectbox("Select food truck:", truck_options)
@@ -3404,11 +5446,62 @@ def page_ai_agg():
     - Actionable recommendations
     """)
 
+# =============================================================================
+# PAGE: USAGE REPORT
+# =============================================================================
+
+def page_usage_report():
+    show_header()
+    
+    st.title("📈 Usage Report")
+    
+    st.markdown("""
+    Every statement this app runs is tagged with a JSON **QUERY_TAG** (`app`, `page`, `example`, `model`).
+    This report groups `SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY` and Cortex function usage by those tags
+    to show where latency and credits go.
+    
+    *ACCOUNT_USAGE views lag by up to a few hours, and reading them requires access to the SNOWFLAKE database.*
+    """)
+    
+    days = st.slider("Days of history:", 1, 30, 7, key="usage_days")
+    
+    if st.button("Load Report", key="load_usage_report"):
+        with st.spinner("Reading ACCOUNT_USAGE..."):
+            query = usage_history_query(days)
+            result, error = execute_query(query)
+            if error:
+                st.error(f"Error: {error}")
+            elif not result:
+                st.info(f"No tagged queries from this app in the last {days} day(s) yet.")
+            else:
+                by_tag, by_function = aggregate_usage([row.as_dict() for row in result])
+                
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Queries", sum(summary['Queries'] for summary in by_tag))
+                with col2:
+                    st.metric("Cortex Credits", f"{sum(summary['Credits'] for summary in by_function):.4f}")
+                with col3:
+                    st.metric("Cortex Tokens", f"{sum(summary['Tokens'] for summary in by_function):,}")
+                
+                st.markdown("#### 🤖 By AI Function")
+                st.dataframe(by_function, use_container_width=True, hide_index=True)
+                
+                st.markdown("#### 🏷️ By Page, Example and Model")
+                st.dataframe(by_tag, use_container_width=True, hide_index=True)
+                
+                with st.expander("🔍 View SQL Query"):
+                    st.code(query, language="sql")
+
 # =============================================================================
 # MAIN APP ROUTING
 # =============================================================================
 
 def main():
+    # Attribute this rerun's queries to the selected page
+    start_query_run()
+    set_query_context(page=current_page)
+    
     # Route to the appropriate page
     if current_page == "home":
         page_home()
@@ -3436,6 +5529,12 @@ def main():
         page_ai_summarize_agg()
     elif current_page == "ai_agg":
         page_ai_agg()
+    elif current_page == "usage_report":
+        page_usage_report()
+    
+    # Cache counters and query timings (rendered after the page so they include this rerun)
+    show_cache_sidebar()
+    show_perf_sidebar()
     
     # Footer
     st.markdown("---")
@@ -0,0 +1,303 @@
+"""
+Offline page-load benchmark for the playground.
+
+Runs every page of app.py headlessly with Streamlit's AppTest against a fake
+Snowpark session that answers each statement with canned rows after an injected
+latency, so the app's own cost can be measured without a warehouse:
+
+- queries per rerun (round trips to Snowflake)
+- serial wait (sum of injected query latencies) vs. overlapped wait (wall time
+  with at least one query in flight)
+- Python CPU time and wall time per rerun
+
+Each page is measured cold (caches cleared) and warm (a second rerun). Save a
+baseline and compare later runs against it to catch page-load regressions:
+
+    python benchmark.py --latency 0.2 --save benchmark_baseline.json
+    python benchmark.py --latency 0.2 --baseline benchmark_baseline.json --max-regression 20
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+import streamlit as st
+from snowflake.snowpark import Row
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+SAMPLE_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_files")
+
+# Canned results: the first pattern that matches the (upper-cased) statement answers it
+CANNED_RESULTS = [
+    (r"^\s*EXECUTE IMMEDIATE", [Row(ROWS_WRITTEN=0)]),
+    (r"^\s*MERGE", [Row(INSERTED=0, UPDATED=0)]),
+    (r"^\s*(INSERT|DELETE|UPDATE)", [Row(ROWS=0)]),
+    (r"QUERY_HISTORY", []),
+    (r"BATCH_START, BATCH_END", []),
+    (r"^\s*SELECT.*EXTRACTED_JSON", [Row(FILE_NAME="supplier_invoice_1001.pdf", FILE_URL="", INVOICE_NUMBER="1001",
+                                          INVOICE_DATE="2024-01-01", SUPPLIER_NAME="Supplier", SUBTOTAL=100.0,
+                                          TAX_AMOUNT=8.0, TOTAL_AMOUNT=108.0, ITEM_COUNT=3, RAW_JSON="{}")]),
+    (r"^\s*SELECT.*CALL_SUMMARY", [Row(FILENAME="call_001_order_issue.wav", TRANSCRIBED_TEXT="Hello", CALL_SUMMARY="Summary",
+                                        SENTIMENT_SCORE=-0.5, SENTIMENT_CATEGORY="Negative",
+                                        RECOMMENDED_ACTIONS='["Refund", "Follow up", "Apologize"]')]),
+    (r"^\s*(SELECT|WITH).*TRANSCRIPT_JSON", [Row(AUDIO_FILE="call_001_order_issue.wav", TRANSCRIPTION='{"text": "Hello"}',
+                                                  TRANSCRIBED_TEXT="Hello", SENTIMENT_SCORE=0.1, SENTIMENT_CATEGORY="Neutral",
+                                                  SUGGESTED_RESPONSE="Thanks", FILENAME="call_001_order_issue.wav",
+                                                  CALL_TYPE="Order", CALL_SUMMARY="Summary", RECOMMENDED_ACTIONS="1. Follow up")]),
+    (r"REFERENCE AS.*IMAGE_EMBEDDINGS", [Row(FILE_NAME="ramen_bowl.png", IMAGE_URL=None, SIMILARITY_SCORE=0.7)]),
+    (r"REFERENCE AS", [Row(REVIEW_ID=2, CUSTOMER_NAME="Customer", REVIEW_TEXT="Great", FOOD_TRUCK_NAME="Truck",
+                           RATING=5, SIMILARITY_SCORE=0.8)]),
+    (r"^\s*SELECT.*CUISINE_LABEL", [Row(FILE_NAME="ramen_bowl.png", IMAGE_URL=None, CUISINE_LABEL="Asian",
+                                         DISH_TYPES="Served in a Bowl", VISUAL_TRAITS="")]),
+    (r"TICKET1_ID", [Row(TICKET1_ID=1, CUSTOMER1="A", TICKET2_ID=2, CUSTOMER2="B", SIMILARITY=0.9, ISSUE1="x", ISSUE2="y")]),
+    (r"COUNT_IF", [Row(ADDED=0, CHANGED=0, REMOVED=0, UNCHANGED=10)]),
+    (r"^\s*SELECT TO_VARCHAR\((GET_PRESIGNED|BUILD_SCOPED)", [Row(URL="https://example.com/file")]),
+    (r"COUNT\(\*\)", [Row(CNT=10, DOC_COUNT=2, CHUNK_COUNT=20)]),
+    (r"CUSTOMER_REVIEWS.*REVIEW_TEXT", [Row(REVIEW_ID=1, CUSTOMER_NAME="Customer", REVIEW_TEXT="Good food",
+                                             FOOD_TRUCK_NAME="Truck", RATING=4, SIMILARITY_SCORE=0.8)]),
+    (r"RELATIVE_PATH.*DIRECTORY", [Row(RELATIVE_PATH="supplier_invoice_1001.pdf", MD5="md5", ETAG="etag", LAST_MODIFIED=None,
+                                        SIZE=1024, CONTENT_HASH="md5", FILE_URL="", URL="https://example.com/file",
+                                        FILE_VERSION="md5")]),
+    (r"AI_COMPLETE", [Row(DESCRIPTION="Description", RESULT="Result")]),
+]
+
+
+class QueryClock:
+    """Records the in-flight interval of every fake query"""
+
+    def __init__(self):
+        self.intervals = []
+        self._lock = threading.Lock()
+
+    def add(self, start, end):
+        with self._lock:
+            self.intervals.append((start, end))
+
+    def take(self):
+        with self._lock:
+            intervals, self.intervals = self.intervals, []
+        return intervals
+
+
+def overlapped_seconds(intervals):
+    """Wall time covered by at least one interval"""
+    covered = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                covered += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        covered += current_end - current_start
+    return covered
+
+
+class FakeAsyncJob:
+    def __init__(self, df):
+        self.query_id = df.query_id
+        self._df = df
+        self._started = time.time()
+        self._ready_at = self._started + df.session.next_latency()
+        self._recorded = False
+
+    def is_done(self):
+        return time.time() >= self._ready_at
+
+    def result(self):
+        remaining = self._ready_at - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        if not self._recorded:
+            self._recorded = True
+            self._df.session.clock.add(self._started, self._ready_at)
+        return self._df.rows()
+
+
+class FakeDataFrame:
+    def __init__(self, session, query):
+        self.session = session
+        self.query = query
+        self.query_id = f"bench-{next(session.query_ids):08d}"
+        session.record(self)
+
+    def rows(self):
+        normalized = self.query.upper()
+        for pattern, rows in CANNED_RESULTS:
+            if re.search(pattern, normalized, re.DOTALL):
+                return list(rows)
+        return []
+
+    def collect(self, statement_params=None, **kwargs):
+        started = time.time()
+        time.sleep(self.session.next_latency())
+        self.session.clock.add(started, time.time())
+        return self.rows()
+
+    def collect_nowait(self, statement_params=None, **kwargs):
+        return FakeAsyncJob(self)
+
+
+class FakeFileOperation:
+    def get_stream(self, stage_location, decompress=False):
+        name = stage_location.rsplit("/", 1)[-1]
+        for folder, _, files in os.walk(SAMPLE_FILES):
+            if name in files:
+                with open(os.path.join(folder, name), "rb") as f:
+                    return io.BytesIO(f.read())
+        with open(os.path.join(SAMPLE_FILES, "supplier invoice documents", "supplier_invoice_1001.pdf"), "rb") as f:
+            return io.BytesIO(f.read())
+
+
+class FakeQueryHistory:
+    def __init__(self):
+        self.queries = []
+
+
+class FakeSession:
+    """Stand-in for a Snowpark Session: canned rows after latency +/- jitter seconds per statement"""
+
+    def __init__(self, latency, jitter=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.clock = QueryClock()
+        self.file = FakeFileOperation()
+        self.query_count = 0
+        self.query_ids = iter(range(1, sys.maxsize))
+        self._histories = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next_latency(self):
+        with self._lock:
+            return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def record(self, df):
+        with self._lock:
+            self.query_count += 1
+            for history in self._histories:
+                history.queries.append(mock.Mock(query_id=df.query_id, sql_text=df.query))
+
+    def sql(self, query, params=None):
+        return FakeDataFrame(self, query)
+
+    @contextmanager
+    def query_history(self):
+        history = FakeQueryHistory()
+        with self._lock:
+            self._histories.append(history)
+        try:
+            yield history
+        finally:
+            with self._lock:
+                self._histories.remove(history)
+
+
+def measure(session, run):
+    """Run one rerun and return its cost"""
+    session.clock.take()
+    queries_before = session.query_count
+    cpu_started = time.process_time()
+    wall_started = time.time()
+    app = run()
+    wall = time.time() - wall_started
+    cpu = time.process_time() - cpu_started
+    intervals = session.clock.take()
+    return app, {
+        'queries': session.query_count - queries_before,
+        'serial_wait': round(sum(end - start for start, end in intervals), 4),
+        'overlapped_wait': round(overlapped_seconds(intervals), 4),
+        'cpu': round(cpu, 4),
+        'wall': round(wall, 4),
+        'exceptions': [str(exception.value) for exception in app.exception]
+    }
+
+
+def benchmark(latency, jitter, timeout):
+    """Measure a cold and a warm rerun of every page"""
+    session = FakeSession(latency, jitter)
+    results = {}
+    with mock.patch("snowflake.snowpark.context.get_active_session", return_value=session):
+        app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        app.run()
+        pages = app.sidebar.radio[0].options
+        for page in pages:
+            app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+            app.run()
+            # Cold: the page's first rerun with every shared cache empty
+            st.cache_resource.clear()
+            app, cold = measure(session, lambda app=app, page=page: app.sidebar.radio[0].set_value(page).run())
+            app, warm = measure(session, lambda app=app: app.run())
+            results[page] = {'cold': cold, 'warm': warm}
+    return results
+
+
+def print_report(results):
+    header = f"{'Page':<24}{'Run':<6}{'Queries':>8}{'Serial s':>10}{'Overlap s':>11}{'CPU s':>8}{'Wall s':>8}"
+    print(header)
+    print("-" * len(header))
+    for page, runs in results.items():
+        for run_name, cost in runs.items():
+            flag = "  ⚠️ " + "; ".join(cost['exceptions'])[:80] if cost['exceptions'] else ""
+            print(f"{page:<24}{run_name:<6}{cost['queries']:>8}{cost['serial_wait']:>10.2f}"
+                  f"{cost['overlapped_wait']:>11.2f}{cost['cpu']:>8.2f}{cost['wall']:>8.2f}{flag}")
+
+
+def regressions(results, baseline, max_regression):
+    """Describe every page whose query count grew or whose CPU or wait time grew by more than max_regression percent"""
+    found = []
+    for page, runs in results.items():
+        for run_name, cost in runs.items():
+            before = baseline.get(page, {}).get(run_name)
+            if not before:
+                continue
+            if cost['queries'] > before['queries']:
+                found.append(f"{page} ({run_name}): queries {before['queries']} -> {cost['queries']}")
+            for metric in ('overlapped_wait', 'cpu'):
+                allowed = before[metric] * (1 + max_regression / 100) + 0.05
+                if cost[metric] > allowed:
+                    found.append(f"{page} ({run_name}): {metric} {before[metric]:.2f}s -> {cost[metric]:.2f}s")
+            if cost['exceptions'] and not before['exceptions']:
+                found.append(f"{page} ({run_name}): new exception {cost['exceptions'][0]}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline page-load benchmark with a latency-injecting fake Snowpark session")
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds each fake query takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to each query's latency")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds allowed per rerun")
+    parser.add_argument("--save", help="Write the results as a JSON baseline")
+    parser.add_argument("--baseline", help="Compare against a saved JSON baseline and exit 1 on regressions")
+    parser.add_argument("--max-regression", type=float, default=20, help="Allowed CPU/wait growth in percent")
+    args = parser.parse_args()
+
+    results = benchmark(args.latency, args.jitter, args.timeout)
+    print_report(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({'latency': args.latency, 'pages': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['pages']
+        found = regressions(results, baseline, args.max_regression)
+        for regression in found:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
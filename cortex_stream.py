@@ -0,0 +1,70 @@
+"""
+Streaming client for the Cortex REST complete endpoint (stdlib only).
+
+AI_COMPLETE in SQL only returns once the whole completion is generated; the REST
+endpoint /api/v2/cortex/inference:complete sends tokens as server-sent events
+while they are generated. The playground builds the request (account URL and
+credentials) and hands it to stream_complete, which yields the text and records
+time to first token and throughput:
+
+    stats = {}
+    for text in stream_complete(completion_request(url, "claude-3-5-sonnet", "Hi", 0.7), stats):
+        print(text, end="")
+
+cortex_stream_stub.py serves the same event shape locally for tests and demos.
+"""
+
+import json
+import time
+import urllib.request
+
+STREAM_TIMEOUT_SECONDS = 120
+
+
+def completion_request(url, model, prompt, temperature, headers=None):
+    """Build the streaming completion request for one prompt"""
+    body = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "stream": True
+    }
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream", **(headers or {})}
+    return urllib.request.Request(url, data=json.dumps(body).encode("utf-8"), headers=headers, method="POST")
+
+
+def sse_events(lines):
+    """Yield the JSON payload of each server-sent event from an iterable of byte lines"""
+    data = []
+    for raw_line in lines:
+        line = raw_line.decode("utf-8").rstrip("\r\n")
+        if line.startswith("data:"):
+            data.append(line[5:].strip())
+        elif not line and data:
+            payload = "\n".join(data)
+            data = []
+            if payload == "[DONE]":
+                return
+            yield json.loads(payload)
+    if data and data != ["[DONE]"]:
+        yield json.loads("\n".join(data))
+
+
+def stream_complete(request, stats, timeout=STREAM_TIMEOUT_SECONDS):
+    """Yield completion text as it arrives, recording time to first token and token throughput in stats"""
+    started = time.time()
+    stats.update({'ttft': None, 'tokens': 0, 'elapsed': None})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        for event in sse_events(response):
+            for choice in event.get('choices', []):
+                delta = choice.get('delta', {})
+                text = delta.get('content') or delta.get('text')
+                if text:
+                    if stats['ttft'] is None:
+                        stats['ttft'] = time.time() - started
+                    stats['tokens'] += 1
+                    yield text
+            # The final event reports the billed token count; prefer it over counting chunks
+            if event.get('usage', {}).get('completion_tokens'):
+                stats['tokens'] = event['usage']['completion_tokens']
+    stats['elapsed'] = time.time() - started
@@ -0,0 +1,89 @@
+"""
+Local stand-in for the Cortex REST complete endpoint.
+
+Streams a canned completion as server-sent events in the same shape as
+/api/v2/cortex/inference:complete, with configurable delays, so the playground's
+token-streaming path can be exercised without an account:
+
+    python cortex_stream_stub.py --port 8765 --first-token-delay 0.8 --token-delay 0.05
+    CORTEX_STREAM_URL=http://localhost:8765/api/v2/cortex/inference:complete streamlit run app.py
+"""
+
+import argparse
+import json
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_COMPLETION = (
+    "Here are 3 creative food truck names for a sushi business:\n\n"
+    "1. **Roll With It** - a playful nod to sushi rolls and life on the road\n"
+    "2. **Wasabi Wheels** - bold, spicy and always on the move\n"
+    "3. **Nori Nomad** - wrapping fresh fish wherever the street takes it"
+)
+
+
+def tokenize(text):
+    """Split text into word-and-whitespace chunks, roughly one per model token"""
+    return re.findall(r"\s*\S+", text)
+
+
+def make_handler(completion, first_token_delay, token_delay):
+    class CortexStreamHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            model = request.get("model", "stub-model")
+            tokens = tokenize(completion)
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+
+            response_id = str(uuid.uuid4())
+            time.sleep(first_token_delay)
+            for index, token in enumerate(tokens):
+                if index:
+                    time.sleep(token_delay)
+                event = {
+                    "id": response_id,
+                    "model": model,
+                    "choices": [{"delta": {"type": "text", "content": token, "text": token}}]
+                }
+                if index == len(tokens) - 1:
+                    prompt_tokens = sum(len(tokenize(m.get("content", ""))) for m in request.get("messages", []))
+                    event["usage"] = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                                      "total_tokens": prompt_tokens + len(tokens)}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        def log_message(self, format, *args):
+            pass
+
+    return CortexStreamHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in Cortex streaming completion server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-delay", type=float, default=0.8,
+                        help="Seconds before the first token (simulated time to first token)")
+    parser.add_argument("--token-delay", type=float, default=0.05,
+                        help="Seconds between tokens (simulated generation speed)")
+    parser.add_argument("--completion", default=DEFAULT_COMPLETION, help="Text to stream back for every prompt")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port),
+                                 make_handler(args.completion, args.first_token_delay, args.token_delay))
+    print(f"Streaming stand-in listening on http://{args.host}:{args.port}/api/v2/cortex/inference:complete")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
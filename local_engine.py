@@ -0,0 +1,408 @@
+"""
+Local SQL engine backend for the playground (optional: requires duckdb and sqlglot).
+
+Runs the app's Snowflake SQL against an in-process DuckDB database built from
+setup_database.sql's tables and seed data, with deterministic simulated Cortex AI
+functions, so throughput experiments need no Snowflake account:
+
+    pip install duckdb sqlglot
+    PLAYGROUND_QUERY_MODE=local streamlit run app.py
+
+Each statement is parsed as Snowflake SQL with sqlglot, AI_* calls are rewritten to
+simulated Python UDFs, and the result is transpiled to DuckDB. Every simulated call
+is charged tokens (about 4 characters per token) against a configurable latency and
+credit model; usage() reports calls, tokens, credits and simulated seconds per
+function. AI_EMBED returns hashed bag-of-words vectors, so VECTOR_COSINE_SIMILARITY
+(not charged) ranks texts that share words as similar, and table_versions() stands
+in for INFORMATION_SCHEMA.TABLES.LAST_ALTERED. Larger data sets (for example from
+scale_data.py) can be loaded with load_csv(). LATERAL FLATTEN over JSON arrays is emulated (VALUE and INDEX only);
+other Snowflake-only features such as stages and DIRECTORY() are not, and
+statements that use them fail like any other query error.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import duckdb
+import sqlglot
+from snowflake.snowpark import Row
+from sqlglot import exp
+
+DATABASE = "AI_FUNCTIONS_PLAYGROUND"
+SCHEMA = "DEMO"
+SETUP_SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "setup_database.sql")
+SAMPLE_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_files")
+
+# setup_database.sql's GRANT and USE statements are skipped; don't warn that sqlglot parses them as commands
+logging.getLogger("sqlglot").setLevel(logging.ERROR)
+
+# Simulated cost model: credits per 1M tokens (input + output) for each function
+CREDITS_PER_MILLION_TOKENS = {
+    'AI_COMPLETE': 1.65,
+    'AI_SENTIMENT': 1.60,
+    'AI_CLASSIFY': 1.39,
+    'AI_FILTER': 1.39,
+    'AI_SIMILARITY': 0.05,
+    'AI_EXTRACT': 5.00,
+    'AI_EMBED': 0.03,
+    'SENTIMENT': 0.08
+}
+
+# Simulated latency model: seconds per call plus seconds per 1K tokens
+LATENCY_PER_CALL_SECONDS = 0.0
+LATENCY_PER_1K_TOKENS_SECONDS = 0.0
+
+POSITIVE_WORDS = {"good", "great", "amazing", "excellent", "love", "loved", "delicious", "best", "fresh", "friendly",
+                  "perfect", "outstanding", "tasty", "fantastic", "recommend", "awesome", "incredible", "generous"}
+NEGATIVE_WORDS = {"bad", "terrible", "awful", "cold", "rude", "slow", "worst", "never", "dirty", "overpriced", "wrong",
+                  "disappointed", "disappointing", "hair", "sick", "late", "charged", "refund", "missing", "dismissive"}
+STOP_WORDS = {"the", "a", "an", "and", "or", "is", "was", "it", "to", "of", "in", "for", "on", "with", "my", "i", "this",
+              "that", "they", "we", "but", "at", "be", "are", "were", "me", "so", "very"}
+
+# Simulated functions: UDF name, return type
+SIMULATED_FUNCTIONS = {
+    'AI_COMPLETE': 'VARCHAR',
+    'AI_SENTIMENT': 'JSON',
+    'AI_CLASSIFY': 'JSON',
+    'AI_FILTER': 'BOOLEAN',
+    'AI_SIMILARITY': 'DOUBLE',
+    'AI_EXTRACT': 'JSON',
+    'AI_EMBED': 'JSON',
+    'SENTIMENT': 'DOUBLE'
+}
+
+# Vector functions the simulated embeddings are compared with (not AI calls, so not charged)
+VECTOR_FUNCTIONS = {
+    'VECTOR_COSINE_SIMILARITY': 'DOUBLE'
+}
+
+# Snowflake names of functions that sqlglot parses into typed nodes under another name
+SNOWFLAKE_FUNCTION_NAMES = {
+    'COSINE_DISTANCE': 'VECTOR_COSINE_SIMILARITY'
+}
+
+# Length of simulated AI_EMBED vectors, matching the VECTOR(FLOAT, 1024) columns in setup_database.sql
+EMBEDDING_DIMENSIONS = 1024
+
+
+def words(text):
+    return re.findall(r"[a-z']+", str(text or "").lower())
+
+
+def stable_fraction(*parts):
+    """Deterministic number in [0, 1) derived from the inputs"""
+    digest = hashlib.sha256(json.dumps(parts, default=str, sort_keys=True).encode("utf-8")).hexdigest()
+    return int(digest[:12], 16) / float(16 ** 12)
+
+
+def text_of(value):
+    """Prompt text of a simulated function argument (strings, or the text parts of prompt objects)"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return " ".join(text_of(v) for v in value.values())
+    if isinstance(value, list):
+        return " ".join(text_of(v) for v in value)
+    return str(value)
+
+
+def sentiment_score(text):
+    tokens = words(text)
+    positive = sum(1 for token in tokens if token in POSITIVE_WORDS)
+    negative = sum(1 for token in tokens if token in NEGATIVE_WORDS)
+    if positive == negative:
+        return 0.0
+    return round((positive - negative) / (positive + negative), 3)
+
+
+def sentiment_label(score):
+    return "positive" if score > 0.2 else "negative" if score < -0.2 else "neutral" if score == 0 else "mixed"
+
+
+def simulate_complete(model, prompt, options=None):
+    prompt_text = text_of(prompt)
+    keywords = [token for token in words(prompt_text) if token not in STOP_WORDS][:12]
+    response_format = (options or {}).get('response_format') if isinstance(options, dict) else None
+    if response_format:
+        properties = (response_format.get('schema') or response_format).get('properties', {})
+        return json.dumps({name: simulated_value(name, spec, prompt_text) for name, spec in properties.items()})
+    return (f"[Simulated {model}] " + " ".join(keywords[:8]).capitalize() +
+            f". (Deterministic local response #{int(stable_fraction(model, prompt_text) * 10000)})")
+
+
+def simulated_value(name, spec, text):
+    kind = spec.get('type') if isinstance(spec, dict) else None
+    if kind in ('number', 'integer'):
+        return round(stable_fraction(name, text) * 100, 2)
+    if kind == 'array':
+        return [token for token in words(text) if token not in STOP_WORDS][:3]
+    if kind == 'boolean':
+        return stable_fraction(name, text) >= 0.5
+    if isinstance(spec, dict) and spec.get('enum'):
+        options = spec['enum']
+        return options[int(stable_fraction(name, text) * len(options))]
+    return " ".join([token for token in words(text) if token not in STOP_WORDS][:6])
+
+
+def simulate_sentiment(text, categories=None):
+    score = sentiment_score(text)
+    result = [{'name': 'overall', 'sentiment': sentiment_label(score)}]
+    for category in categories or []:
+        category_score = score + (stable_fraction(category, text) - 0.5) * 0.4
+        result.append({'name': category, 'sentiment': sentiment_label(category_score)})
+    return json.dumps({'categories': result})
+
+
+def simulate_classify(text, labels, config=None):
+    names = [label['label'] if isinstance(label, dict) else str(label) for label in labels or []]
+    if not names:
+        return json.dumps({'labels': []})
+    text_words = set(words(text_of(text)))
+    scored = sorted(names, key=lambda name: (-len(set(words(name)) & text_words), stable_fraction(name, text_of(text))))
+    multi = isinstance(config, dict) and config.get('output_mode') == 'multi'
+    return json.dumps({'labels': scored[:2] if multi else scored[:1]})
+
+
+def simulate_filter(predicate, value=None):
+    text = text_of(predicate) + " " + text_of(value)
+    score = sentiment_score(text)
+    return bool(score != 0 and stable_fraction(text) < 0.5 + abs(score) / 2) or stable_fraction(text) < 0.3
+
+
+def simulate_similarity(first, second, config=None):
+    a, b = set(words(text_of(first))) - STOP_WORDS, set(words(text_of(second))) - STOP_WORDS
+    return round(len(a & b) / len(a | b), 4) if a | b else 1.0
+
+
+def simulate_embed(model, content):
+    """Hashed bag-of-words vector: texts that share words point in similar directions"""
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for token in words(text_of(content)):
+        if token in STOP_WORDS:
+            continue
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        vector[int.from_bytes(digest[:4], "big") % EMBEDDING_DIMENSIONS] += 1.0 if digest[4] & 1 else -1.0
+    norm = sum(value * value for value in vector) ** 0.5
+    return json.dumps([round(value / norm, 6) for value in vector] if norm else vector)
+
+
+def vector_cosine_similarity(first, second):
+    if first is None or second is None:
+        return None
+    dot = sum(a * b for a, b in zip(first, second))
+    norms = sum(a * a for a in first) ** 0.5 * sum(b * b for b in second) ** 0.5
+    return round(dot / norms, 6) if norms else 0.0
+
+
+def simulate_extract(text, response_format=None):
+    questions = response_format if isinstance(response_format, dict) else {
+        str(question): question for question in (response_format or [])}
+    source = text_of(text)
+    return json.dumps({'response': {name: simulated_value(name, None, source + str(question))
+                                    for name, question in questions.items()}})
+
+
+SIMULATORS = {
+    'AI_COMPLETE': simulate_complete,
+    'AI_SENTIMENT': simulate_sentiment,
+    'AI_CLASSIFY': simulate_classify,
+    'AI_FILTER': simulate_filter,
+    'AI_SIMILARITY': simulate_similarity,
+    'AI_EXTRACT': simulate_extract,
+    'AI_EMBED': simulate_embed,
+    'SENTIMENT': lambda text: sentiment_score(text_of(text)),
+    'VECTOR_COSINE_SIMILARITY': vector_cosine_similarity
+}
+
+
+def function_call(node):
+    """(upper-case name, argument expressions) of a function call node, or (None, [])"""
+    if isinstance(node, exp.Dot) and node.this.sql().upper() == "SNOWFLAKE.CORTEX":
+        return function_call(node.expression)
+    if isinstance(node, exp.Anonymous):
+        return node.name.upper(), list(node.expressions)
+    if isinstance(node, exp.Func):
+        args = []
+        for key in node.arg_types:
+            value = node.args.get(key)
+            if isinstance(value, list):
+                args.extend(value)
+            elif isinstance(value, exp.Expression):
+                args.append(value)
+        return SNOWFLAKE_FUNCTION_NAMES.get(node.sql_name(), node.sql_name()), args
+    return None, []
+
+
+class LocalEngine:
+    """DuckDB database loaded from setup_database.sql with simulated AI_* functions"""
+
+    def __init__(self, setup_sql_path=SETUP_SQL_PATH, latency_per_call=LATENCY_PER_CALL_SECONDS,
+                 latency_per_1k_tokens=LATENCY_PER_1K_TOKENS_SECONDS, credits_per_million_tokens=None):
+        self.latency_per_call = latency_per_call
+        self.latency_per_1k_tokens = latency_per_1k_tokens
+        self.credits_per_million_tokens = dict(CREDITS_PER_MILLION_TOKENS, **(credits_per_million_tokens or {}))
+        self._usage = {name: {'calls': 0, 'tokens': 0, 'credits': 0.0, 'seconds': 0.0} for name in SIMULATED_FUNCTIONS}
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._table_versions = {}  # table name -> write sequence number of its last change
+        self._connection = duckdb.connect()
+        self._connection.execute(f"ATTACH ':memory:' AS {DATABASE}")
+        self._connection.execute(f"CREATE SCHEMA {DATABASE}.{SCHEMA}")
+        self._connection.execute(f"USE {DATABASE}.{SCHEMA}")
+        for name, return_type in {**SIMULATED_FUNCTIONS, **VECTOR_FUNCTIONS}.items():
+            self._register(name, return_type)
+        self.load_errors = self._load_setup(setup_sql_path)
+
+    def _register(self, name, return_type):
+        simulator = SIMULATORS[name]
+
+        def udf(*args):
+            values = [json.loads(arg) if arg is not None else None for arg in args]
+            while values and values[-1] is None:
+                values.pop()
+            if name in SIMULATED_FUNCTIONS:
+                self._charge(name, sum(len(text_of(value)) for value in values))
+            return simulator(*values)
+
+        # DuckDB UDFs have a fixed arity, so each function is registered once per argument count
+        fixed_arity = {
+            1: lambda a: udf(a),
+            2: lambda a, b: udf(a, b),
+            3: lambda a, b, c: udf(a, b, c),
+            4: lambda a, b, c, d: udf(a, b, c, d)
+        }
+        for arity, function in fixed_arity.items():
+            self._connection.create_function(f"sim_{name.lower()}_{arity}", function, ['VARCHAR'] * arity, return_type,
+                                             null_handling='special', side_effects=name in SIMULATED_FUNCTIONS)
+
+    def _charge(self, name, characters):
+        tokens = max(1, characters // 4)
+        seconds = self.latency_per_call + self.latency_per_1k_tokens * tokens / 1000
+        if seconds:
+            time.sleep(seconds)
+        with self._lock:
+            usage = self._usage[name]
+            usage['calls'] += 1
+            usage['tokens'] += tokens
+            usage['credits'] += tokens * self.credits_per_million_tokens.get(name, 0) / 1_000_000
+            usage['seconds'] += seconds
+
+    def _load_setup(self, path):
+        """Create setup_database.sql's tables and views and insert its seed data; return the statements that failed"""
+        with open(path) as f:
+            statements = sqlglot.parse(f.read(), read="snowflake", error_level=sqlglot.ErrorLevel.IGNORE)
+        errors = []
+        for statement in statements:
+            is_table = isinstance(statement, exp.Create) and statement.args.get('kind') in ('TABLE', 'VIEW')
+            if not (is_table or isinstance(statement, exp.Insert)):
+                continue
+            try:
+                if is_table:
+                    self._create_sequences(statement)
+                self._connection.execute(self.transpile(statement))
+                self._record_write(statement)
+            except Exception as e:
+                errors.append(f"{statement.sql(dialect='snowflake')[:80]}: {e}")
+        return errors
+
+    def _create_sequences(self, create):
+        """Replace AUTOINCREMENT columns with a sequence default"""
+        table = create.this.this.name if isinstance(create.this, exp.Schema) else create.this.name
+        for column in create.find_all(exp.ColumnDef):
+            constraints = column.args.get('constraints') or []
+            if any(isinstance(c.args.get('kind'), exp.AutoIncrementColumnConstraint) for c in constraints):
+                sequence = f"seq_{table}_{column.name}".lower()
+                self._connection.execute(f"CREATE SEQUENCE IF NOT EXISTS {sequence}")
+                column.set('constraints', [c for c in constraints
+                                           if not isinstance(c.args.get('kind'), exp.AutoIncrementColumnConstraint)] +
+                           [exp.ColumnConstraint(kind=exp.DefaultColumnConstraint(
+                               this=exp.Anonymous(this="nextval", expressions=[exp.Literal.string(sequence)])))])
+
+    def transpile(self, statement):
+        """Rewrite a parsed Snowflake statement for DuckDB: simulated AI functions and unsupported types"""
+        # transform() does not descend into replaced nodes, so replacements rewrite their own children
+        def rewrite(node):
+            name, args = function_call(node)
+            if name in SIMULATED_FUNCTIONS or name in VECTOR_FUNCTIONS:
+                args = [exp.Cast(this=exp.Anonymous(this="to_json", expressions=[arg.transform(rewrite)]), to=exp.DataType.build("VARCHAR"))
+                        for arg in args]
+                return exp.Anonymous(this=f"sim_{name.lower()}_{len(args)}", expressions=args)
+            if (isinstance(node, exp.Cast) and isinstance(node.this, exp.JSONExtract)
+                    and node.to.this in exp.DataType.TEXT_TYPES):
+                # Snowflake's value:path::STRING yields the unquoted string
+                return exp.Cast(this=exp.JSONExtractScalar(this=node.this.this.transform(rewrite), expression=node.this.expression),
+                                to=node.to)
+            if isinstance(node, exp.Lateral) and isinstance(node.this, exp.Explode):
+                # LATERAL FLATTEN(input => ...) f: unnest the JSON array, exposing f.value and f.index
+                source = node.this.this
+                source = source.expression if isinstance(source, exp.Kwarg) else source
+                flatten = sqlglot.parse_one("SELECT UNNEST(CAST(input AS JSON[])) AS value, "
+                                            "GENERATE_SUBSCRIPTS(CAST(input AS JSON[]), 1) - 1 AS index", read="duckdb")
+                for column in list(flatten.find_all(exp.Column)):
+                    column.replace(source.transform(rewrite))
+                return exp.Lateral(this=exp.Subquery(this=flatten), alias=exp.TableAlias(this=node.args['alias'].this))
+            if isinstance(node, exp.Kwarg):  # prompt => 'text' named arguments
+                return node.expression.transform(rewrite)
+            if isinstance(node, exp.DataType) and node.this in (exp.DataType.Type.VECTOR, exp.DataType.Type.ARRAY,
+                                                                 exp.DataType.Type.VARIANT, exp.DataType.Type.OBJECT):
+                return exp.DataType.build("JSON")
+            return node
+        return statement.transform(rewrite).sql(dialect="duckdb")
+
+    def _cursor(self):
+        """A cursor for one statement; cursors don't inherit the connection's USE, so each sets it"""
+        with self._lock:
+            cursor = self._connection.cursor()
+        cursor.execute(f"USE {DATABASE}.{SCHEMA}")
+        return cursor
+
+    def run(self, query, params=None):
+        """Run a Snowflake statement locally and return Snowpark Rows with upper-cased column names"""
+        statement = sqlglot.parse_one(query, read="snowflake")
+        cursor = self._cursor()
+        cursor.execute(self.transpile(statement), params or [])
+        self._record_write(statement)
+        if cursor.description is None:
+            return []
+        names = [column[0].upper() for column in cursor.description]
+        return [Row(**dict(zip(names, values))) for values in cursor.fetchall()]
+
+    def load_csv(self, table, path):
+        """Append a CSV file (with a header row) to a table, e.g. output of scale_data.py"""
+        cursor = self._cursor()
+        cursor.execute(f"INSERT INTO {table} BY NAME SELECT * FROM read_csv_auto(?, header=true)", [path])
+        self._record_write(exp.Insert(this=exp.to_table(table)))
+
+    def _record_write(self, statement):
+        if isinstance(statement, (exp.Create, exp.Insert, exp.Update, exp.Delete, exp.Merge)):
+            table = statement.find(exp.Table)
+            if table is not None:
+                with self._lock:
+                    self._writes += 1
+                    self._table_versions[table.name.upper()] = self._writes
+
+    def table_versions(self, tables):
+        """{table: write sequence number of its last change} for the tables that exist (a LAST_ALTERED stand-in)"""
+        with self._lock:
+            return {name: self._table_versions[name] for name in tables if name in self._table_versions}
+
+    def read_file(self, location):
+        """Serve a stage file from sample_files by file name"""
+        name = location.rsplit("/", 1)[-1]
+        for folder, _, files in os.walk(SAMPLE_FILES):
+            if name in files:
+                with open(os.path.join(folder, name), "rb") as f:
+                    return f.read()
+        raise FileNotFoundError(f"{name} is not in sample_files")
+
+    def usage(self):
+        """Simulated calls, tokens, credits and seconds per AI function"""
+        with self._lock:
+            return {name: dict(usage) for name, usage in self._usage.items()}
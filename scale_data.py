@@ -0,0 +1,281 @@
+"""
+Synthetic Tasty Bytes data at production-like volume for load and scale testing.
+
+Generates FOOD_TRUCKS, MENU_ITEMS, CUSTOMER_REVIEWS, SUPPORT_TICKETS and
+SUPPORT_TICKETS_PII rows at a scale factor of 1x to 100,000x the seed data in
+setup_database.sql. Every generated row is derived from a seed row, so the
+cuisine, city, category, rating, language, status and urgency mixes match the
+seeds; review and ticket text recombines sentences from seed rows in the same
+language, and PII tickets get fresh names, SSNs, phone numbers and emails.
+
+Rows are streamed to gzip-compressed CSV files with a header row (split every
+--rows-per-file rows), so memory use is flat at any scale:
+
+    python scale_data.py --scale 1000 --out scaled_data
+
+Load them into the local engine with LocalEngine.load_csv(table, path), or into
+Snowflake with PUT and COPY INTO (the generated columns leave out the
+AUTOINCREMENT ids):
+
+    PUT file://scaled_data/*.csv.gz @SCALED_DATA;
+    COPY INTO CUSTOMER_REVIEWS FROM @SCALED_DATA PATTERN = '.*CUSTOMER_REVIEWS_.*'
+        FILE_FORMAT = (TYPE = CSV PARSE_HEADER = TRUE FIELD_OPTIONALLY_ENCLOSED_BY = '"')
+        MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE;
+"""
+
+import argparse
+import csv
+import datetime
+import gzip
+import itertools
+import os
+import random
+import re
+import time
+
+SETUP_SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "setup_database.sql")
+TABLES = ["FOOD_TRUCKS", "MENU_ITEMS", "CUSTOMER_REVIEWS", "SUPPORT_TICKETS", "SUPPORT_TICKETS_PII"]
+MIN_SCALE = 1
+MAX_SCALE = 100_000
+ROWS_PER_FILE = 1_000_000
+DATE_JITTER_DAYS = 365
+PRICE_JITTER = 0.15
+
+SENTENCE_END = re.compile(r"(?<=[.!?。！？])\s*")
+
+
+def seed_rows(path=SETUP_SQL_PATH):
+    """Parse the INSERT ... VALUES seed data for each table: {table: (columns, rows)}"""
+    with open(path, encoding="utf-8") as f:
+        sql = f.read()
+    seeds = {}
+    for match in re.finditer(r"INSERT INTO (\w+) \(([^)]*)\) VALUES", sql):
+        table = match.group(1)
+        if table not in TABLES:
+            continue
+        columns = [column.strip() for column in match.group(2).split(",")]
+        seeds[table] = (columns, parse_values(sql, match.end()))
+    return seeds
+
+
+def parse_values(sql, position):
+    """Read ('text', 12.5, NULL), (...) tuples starting at position, up to the closing semicolon"""
+    rows, row, token, quoted, in_string = [], None, "", False, False
+    while position < len(sql):
+        char = sql[position]
+        if in_string:
+            if char == "'" and sql[position + 1:position + 2] == "'":
+                token += "'"
+                position += 1
+            elif char == "'":
+                in_string = False
+            else:
+                token += char
+        elif char == "'":
+            in_string, quoted, token = True, True, ""
+        elif char == "(" and row is None:
+            row, token, quoted = [], "", False
+        elif char in ",)" and row is not None:
+            value = token if quoted else token.strip()
+            row.append(None if value == "NULL" and not quoted else value)
+            token, quoted = "", False
+            if char == ")":
+                rows.append(row)
+                row = None
+        elif char == ";" and row is None:
+            break
+        elif row is not None:
+            token += char
+        position += 1
+    return rows
+
+
+def sentences(text):
+    return [sentence for sentence in SENTENCE_END.split(text) if sentence]
+
+
+def jitter_date(rng, value, days=DATE_JITTER_DAYS):
+    date = datetime.date.fromisoformat(value) + datetime.timedelta(days=rng.randint(-days, days))
+    return date.isoformat()
+
+
+def copy_name(name, copy):
+    """Name of a truck's copy: the seed name itself for copy 0, then 'Name 2', 'Name 3', ..."""
+    return name if copy == 0 else f"{name} {copy + 1}"
+
+
+class TastyBytesScaler:
+    """Streams statistically similar rows for each table at a scale factor of the seed data"""
+
+    def __init__(self, scale, seed=42, setup_sql_path=SETUP_SQL_PATH):
+        if not MIN_SCALE <= scale <= MAX_SCALE:
+            raise ValueError(f"Scale factor must be between {MIN_SCALE} and {MAX_SCALE:,}")
+        self.scale = scale
+        self.seed = seed
+        self.seeds = seed_rows(setup_sql_path)
+        self.columns = {table: columns for table, (columns, _) in self.seeds.items()}
+
+        reviews = self.records("CUSTOMER_REVIEWS")
+        tickets = self.records("SUPPORT_TICKETS")
+        names = [review['customer_name'] for review in reviews] + [ticket['customer_name'] for ticket in tickets]
+        self.first_names = sorted({name.split()[0] for name in names})
+        self.last_names = sorted({name.split()[-1] for name in names})
+        # Sentence pools for recombined text: reviews by (language, rating), tickets by urgency
+        self.review_sentences = {}
+        for review in reviews:
+            key = (review['language'], review['rating'])
+            self.review_sentences.setdefault(key, []).extend(sentences(review['review_text']))
+        self.ticket_sentences = {}
+        for ticket in tickets:
+            self.ticket_sentences.setdefault(ticket['urgency'], []).extend(sentences(ticket['issue_description']))
+
+    def records(self, table):
+        columns, rows = self.seeds[table]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def row_count(self, table):
+        return len(self.seeds[table][1]) * self.scale
+
+    def random(self, table):
+        return random.Random(f"{self.seed}:{table}")
+
+    def customer_name(self, rng):
+        return f"{rng.choice(self.first_names)} {rng.choice(self.last_names)}"
+
+    def recombined(self, rng, text, pool):
+        """Seed text with one sentence swapped for a sentence from a similar seed row"""
+        parts = sentences(text)
+        candidates = [sentence for sentence in pool if sentence not in parts]
+        if len(parts) > 1 and candidates:
+            parts[rng.randrange(len(parts))] = rng.choice(candidates)
+        return " ".join(parts)
+
+    def truck_copy(self, rng, name):
+        """A random copy of a seed truck, so references always point at a generated FOOD_TRUCKS row"""
+        return copy_name(name, rng.randrange(self.scale))
+
+    def food_trucks(self):
+        rng = self.random("FOOD_TRUCKS")
+        trucks = self.records("FOOD_TRUCKS")
+        cities = [truck['city'] for truck in trucks]
+        for copy in range(self.scale):
+            for truck in trucks:
+                yield dict(truck,
+                           truck_name=copy_name(truck['truck_name'], copy),
+                           city=truck['city'] if copy == 0 else rng.choice(cities),
+                           operating_since=jitter_date(rng, truck['operating_since']))
+
+    def menu_items(self):
+        rng = self.random("MENU_ITEMS")
+        items = self.records("MENU_ITEMS")
+        for copy in range(self.scale):
+            for item in items:
+                price = float(item['price']) * (1 + rng.uniform(-PRICE_JITTER, PRICE_JITTER))
+                yield dict(item,
+                           food_truck_name=copy_name(item['food_truck_name'], copy),
+                           price=f"{price:.2f}")
+
+    def customer_reviews(self):
+        rng = self.random("CUSTOMER_REVIEWS")
+        reviews = self.records("CUSTOMER_REVIEWS")
+        for _ in range(self.scale):
+            for review in reviews:
+                pool = self.review_sentences[(review['language'], review['rating'])]
+                yield dict(review,
+                           customer_name=self.customer_name(rng),
+                           food_truck_name=self.truck_copy(rng, review['food_truck_name']),
+                           review_text=self.recombined(rng, review['review_text'], pool),
+                           review_date=jitter_date(rng, review['review_date']))
+
+    def support_tickets(self):
+        rng = self.random("SUPPORT_TICKETS")
+        tickets = self.records("SUPPORT_TICKETS")
+        for _ in range(self.scale):
+            for ticket in tickets:
+                yield dict(ticket,
+                           customer_name=self.customer_name(rng),
+                           food_truck_name=self.truck_copy(rng, ticket['food_truck_name']),
+                           issue_description=self.recombined(rng, ticket['issue_description'],
+                                                             self.ticket_sentences[ticket['urgency']]),
+                           created_date=jitter_date(rng, ticket['created_date']))
+
+    def support_tickets_pii(self):
+        rng = self.random("SUPPORT_TICKETS_PII")
+        tickets = self.records("SUPPORT_TICKETS_PII")
+        for _ in range(self.scale):
+            for ticket in tickets:
+                name = self.customer_name(rng)
+                yield dict(ticket,
+                           customer_name=name,
+                           food_truck_name=self.truck_copy(rng, ticket['food_truck_name']),
+                           issue_description=self.fresh_pii(rng, ticket['issue_description'],
+                                                            ticket['customer_name'], name),
+                           created_date=jitter_date(rng, ticket['created_date']))
+
+    def fresh_pii(self, rng, text, seed_name, name):
+        """Replace the seed customer's name, SSNs, phone numbers and emails with generated ones"""
+        first, last = name.split()
+        seed_first = seed_name.split()[0]
+        text = text.replace(seed_name, name).replace(seed_first, first)
+        text = re.sub(r"\b\d{3}-\d{2}-\d{4}\b",
+                      lambda _: f"{rng.randint(100, 899)}-{rng.randint(10, 99)}-{rng.randint(1000, 9999)}", text)
+        text = re.sub(r"\b555-\d{3}-\d{4}\b", lambda _: f"555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}", text)
+        domains = ["email.com", "gmail.com", "yahoo.com", "outlook.com"]
+        return re.sub(r"\b[\w.]+@[\w.]+\.\w+\b",
+                      lambda _: f"{first.lower()}.{last.lower()}{rng.randint(1, 999)}@{rng.choice(domains)}", text)
+
+    def rows(self, table):
+        generators = {
+            "FOOD_TRUCKS": self.food_trucks,
+            "MENU_ITEMS": self.menu_items,
+            "CUSTOMER_REVIEWS": self.customer_reviews,
+            "SUPPORT_TICKETS": self.support_tickets,
+            "SUPPORT_TICKETS_PII": self.support_tickets_pii
+        }
+        return generators[table]()
+
+
+def write_table(scaler, table, out_dir, rows_per_file=ROWS_PER_FILE, compress=True):
+    """Stream one table to numbered CSV files with a header row; return the file paths"""
+    columns = scaler.columns[table]
+    suffix = ".csv.gz" if compress else ".csv"
+    rows, paths = iter(scaler.rows(table)), []
+    # Each part file is opened only once it has a first row, and closed even if a generator fails
+    for first_row in rows:
+        path = os.path.join(out_dir, f"{table}_{len(paths):04d}{suffix}")
+        with (gzip.open(path, "wt", encoding="utf-8", newline="") if compress else
+              open(path, "w", encoding="utf-8", newline="")) as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in itertools.chain([first_row], itertools.islice(rows, rows_per_file - 1)):
+                writer.writerow([row[column] for column in columns])
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate scaled Tasty Bytes data as bulk-loadable CSV files")
+    parser.add_argument("--scale", type=int, default=10,
+                        help=f"Scale factor over the seed data ({MIN_SCALE} to {MAX_SCALE:,})")
+    parser.add_argument("--out", default="scaled_data", help="Output directory")
+    parser.add_argument("--tables", nargs="+", choices=TABLES, default=TABLES)
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (same seed, same data)")
+    parser.add_argument("--rows-per-file", type=int, default=ROWS_PER_FILE)
+    parser.add_argument("--no-compress", action="store_true", help="Write plain .csv instead of .csv.gz")
+    args = parser.parse_args()
+
+    try:
+        scaler = TastyBytesScaler(args.scale, seed=args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    os.makedirs(args.out, exist_ok=True)
+    for table in args.tables:
+        started = time.perf_counter()
+        paths = write_table(scaler, table, args.out, args.rows_per_file, compress=not args.no_compress)
+        size = sum(os.path.getsize(path) for path in paths)
+        print(f"{table:<20} {scaler.row_count(table):>12,} rows  {len(paths):>4} files  "
+              f"{size / (1024 * 1024):>9.1f} MB  {time.perf_counter() - started:6.1f}s")
+
+
+if __name__ == "__main__":
+    main()
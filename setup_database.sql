@@ -141,6 +141,8 @@ CREATE OR REPLACE TABLE SUPPLIER_INVOICE_DETAILS (
     invoice_detail_id INT AUTOINCREMENT,
     file_name VARCHAR(500),
     file_url VARCHAR(2000),
+    file_hash VARCHAR(100),
+    file_last_modified TIMESTAMP_LTZ,
     invoice_number VARCHAR(50),
     invoice_date DATE,
     supplier_name VARCHAR(200),
@@ -159,6 +161,131 @@ CREATE OR REPLACE TABLE SUPPLIER_INVOICE_DETAILS (
     PRIMARY KEY (invoice_detail_id)
 );
 
+-- Invoice Extractions Table (one AI_EXTRACT result per invoice file and content hash)
+CREATE OR REPLACE TABLE INVOICE_EXTRACTIONS (
+    file_name VARCHAR(500),
+    file_hash VARCHAR(100),
+    extracted_json VARIANT,
+    extracted_at TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (file_name, file_hash)
+);
+
+-- Transcripts Table (one AI_TRANSCRIBE result per audio file and content hash)
+CREATE OR REPLACE TABLE TRANSCRIPTS (
+    file_name VARCHAR(500),
+    file_hash VARCHAR(100),
+    transcript_json VARIANT,
+    transcribed_at TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (file_name, file_hash)
+);
+
+-- Call Analytics Table (summary, sentiment and actions per audio file version and model)
+CREATE OR REPLACE TABLE CALL_ANALYTICS (
+    file_name VARCHAR(500),
+    file_hash VARCHAR(100),
+    model VARCHAR(100),
+    call_summary TEXT,
+    sentiment_score FLOAT,
+    sentiment_category VARCHAR(50),
+    recommended_actions VARIANT,
+    analyzed_at TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (file_name, file_hash, model)
+);
+
+-- Ticket Embeddings Table (AI_EMBED vectors for SUPPORT_TICKETS, re-embedded only when the text changes)
+CREATE OR REPLACE TABLE TICKET_EMBEDDINGS (
+    ticket_id INT,
+    text_hash VARCHAR(64),
+    embedding VECTOR(FLOAT, 1024),
+    embedded_at TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (ticket_id)
+);
+
+-- Review Embeddings Table (AI_EMBED vectors for CUSTOMER_REVIEWS, re-embedded only when the text changes)
+CREATE OR REPLACE TABLE REVIEW_EMBEDDINGS (
+    review_id INT,
+    text_hash VARCHAR(64),
+    embedding VECTOR(FLOAT, 1024),
+    embedded_at TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (review_id)
+);
+
+-- Image Embeddings Table (AI_EMBED vectors for IMAGE_STAGE files, keyed by path and content hash)
+CREATE OR REPLACE TABLE IMAGE_EMBEDDINGS (
+    file_name VARCHAR(500),
+    file_hash VARCHAR(100),
+    embedding VECTOR(FLOAT, 1024),
+    embedded_at TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (file_name)
+);
+
+-- Image Tags Table (one multi-label AI_CLASSIFY pass per distinct image content)
+CREATE OR REPLACE TABLE IMAGE_TAGS (
+    file_hash VARCHAR(100),
+    file_name VARCHAR(500),
+    cuisine VARCHAR(100),
+    dish_types ARRAY,
+    visual_traits ARRAY,
+    labels ARRAY,
+    tagged_at TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (file_hash)
+);
+
+-- Menu Item Marketing Table (bulk AI_COMPLETE marketing copy, one row per menu item and model)
+CREATE OR REPLACE TABLE MENU_ITEM_MARKETING (
+    menu_id INT,
+    model VARCHAR(100),
+    item_name VARCHAR(100),
+    category VARCHAR(50),
+    price DECIMAL(10,2),
+    original_description TEXT,
+    ai_marketing_copy TEXT,
+    generated_at TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (menu_id, model)
+);
+
+-- Ticket Categories Table (bulk AI_COMPLETE ticket triage, one row per ticket and model)
+CREATE OR REPLACE TABLE TICKET_CATEGORIES (
+    ticket_id INT,
+    model VARCHAR(100),
+    customer_name VARCHAR(100),
+    issue_description TEXT,
+    urgency VARCHAR(20),
+    category VARCHAR(50),
+    priority VARCHAR(20),
+    suggested_action TEXT,
+    generated_at TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (ticket_id, model)
+);
+
+-- Enrichment Batches Table (checkpoints of bulk enrichment jobs: one row per key range)
+CREATE OR REPLACE TABLE ENRICHMENT_BATCHES (
+    job_id VARCHAR(200),
+    batch_start NUMBER,
+    batch_end NUMBER,
+    row_count INT,
+    status VARCHAR(20),
+    rows_written INT,
+    error TEXT,
+    planned_at TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
+    claimed_at TIMESTAMP_LTZ,
+    finished_at TIMESTAMP_LTZ,
+    PRIMARY KEY (job_id, batch_start)
+);
+
+-- AI Result Cache Table (persistent tier of the app's AI query result cache)
+CREATE OR REPLACE TABLE AI_RESULT_CACHE (
+    cache_key VARCHAR(64),
+    function_names VARCHAR(500),
+    model_names VARCHAR(500),
+    options VARCHAR(1000),
+    input_hash VARCHAR(64),
+    result_json TEXT,
+    created_at TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
+    expires_at TIMESTAMP_LTZ,
+    PRIMARY KEY (cache_key)
+);
+
 -- ============================================================================
 -- INSERT SAMPLE DATA - FOOD TRUCKS
 -- ============================================================================
@@ -341,6 +468,47 @@ GRANT READ, WRITE ON STAGE AI_FUNCTIONS_PLAYGROUND.DEMO.IMAGE_STAGE TO ROLE SYSA
 -- Grant privileges on views
 GRANT SELECT ON ALL VIEWS IN SCHEMA AI_FUNCTIONS_PLAYGROUND.DEMO TO ROLE SYSADMIN;
 
+-- ============================================================================
+-- OPTIONAL: EXTERNAL ACCESS FOR TOKEN STREAMING
+-- ============================================================================
+-- Streamlit in Snowflake blocks outbound HTTPS, so the AI_COMPLETE "Stream tokens"
+-- toggle stays hidden until the app can reach this account's Cortex REST API.
+-- Creating the integration needs ACCOUNTADMIN and account-specific values, so this
+-- section is commented out: replace <account_host> with the host returned by
+--     SELECT LOWER(REPLACE(CURRENT_ORGANIZATION_NAME() || '-' || CURRENT_ACCOUNT_NAME(), '_', '-'))
+--            || '.snowflakecomputing.com';
+-- and <programmatic_access_token> with a PAT for a role that has SNOWFLAKE.CORTEX_USER,
+-- then run it after the app has been created.
+
+-- USE ROLE ACCOUNTADMIN;
+-- CREATE OR REPLACE NETWORK RULE AI_FUNCTIONS_PLAYGROUND.DEMO.CORTEX_REST_NETWORK_RULE
+--     MODE = EGRESS
+--     TYPE = HOST_PORT
+--     VALUE_LIST = ('<account_host>:443');
+-- CREATE OR REPLACE SECRET AI_FUNCTIONS_PLAYGROUND.DEMO.CORTEX_STREAM_TOKEN
+--     TYPE = GENERIC_STRING
+--     SECRET_STRING = '<programmatic_access_token>';
+-- CREATE OR REPLACE EXTERNAL ACCESS INTEGRATION CORTEX_REST_ACCESS_INTEGRATION
+--     ALLOWED_NETWORK_RULES = (AI_FUNCTIONS_PLAYGROUND.DEMO.CORTEX_REST_NETWORK_RULE)
+--     ALLOWED_AUTHENTICATION_SECRETS = (AI_FUNCTIONS_PLAYGROUND.DEMO.CORTEX_STREAM_TOKEN)
+--     ENABLED = TRUE;
+-- GRANT USAGE ON INTEGRATION CORTEX_REST_ACCESS_INTEGRATION TO ROLE SYSADMIN;
+-- GRANT READ ON SECRET AI_FUNCTIONS_PLAYGROUND.DEMO.CORTEX_STREAM_TOKEN TO ROLE SYSADMIN;
+-- USE ROLE SYSADMIN;
+-- ALTER STREAMLIT AI_FUNCTIONS_PLAYGROUND.DEMO.AI_FUNCTIONS_PLAYGROUND_APP SET
+--     EXTERNAL_ACCESS_INTEGRATIONS = (CORTEX_REST_ACCESS_INTEGRATION)
+--     SECRETS = ('cortex_stream_token' = AI_FUNCTIONS_PLAYGROUND.DEMO.CORTEX_STREAM_TOKEN);
+
+-- ============================================================================
+-- UPGRADE EXISTING DEPLOYMENTS
+-- ============================================================================
+-- No-ops on a fresh install; run this section alone to bring tables created by
+-- an older version of this script up to date without dropping their data.
+-- (The app also applies these on first use.)
+
+ALTER TABLE SUPPLIER_INVOICE_DETAILS ADD COLUMN IF NOT EXISTS file_hash VARCHAR(100);
+ALTER TABLE SUPPLIER_INVOICE_DETAILS ADD COLUMN IF NOT EXISTS file_last_modified TIMESTAMP_LTZ;
+
 -- ============================================================================
 -- VERIFICATION QUERIES
 -- ============================================================================
@@ -365,6 +533,39 @@ SELECT COUNT(*) as chunked_docs_count FROM PARSE_DOC_CHUNKED_TEXT;
 -- Verify supplier invoice details table
 SELECT COUNT(*) as invoice_count FROM SUPPLIER_INVOICE_DETAILS;
 
+-- Verify invoice extractions table
+SELECT COUNT(*) as invoice_extraction_count FROM INVOICE_EXTRACTIONS;
+
+-- Verify transcripts table
+SELECT COUNT(*) as transcript_count FROM TRANSCRIPTS;
+
+-- Verify call analytics table
+SELECT COUNT(*) as call_analytics_count FROM CALL_ANALYTICS;
+
+-- Verify ticket embeddings table
+SELECT COUNT(*) as ticket_embedding_count FROM TICKET_EMBEDDINGS;
+
+-- Verify review embeddings table
+SELECT COUNT(*) as review_embedding_count FROM REVIEW_EMBEDDINGS;
+
+-- Verify image embeddings table
+SELECT COUNT(*) as image_embedding_count FROM IMAGE_EMBEDDINGS;
+
+-- Verify image tags table
+SELECT COUNT(*) as image_tag_count FROM IMAGE_TAGS;
+
+-- Verify menu item marketing table
+SELECT COUNT(*) as menu_item_marketing_count FROM MENU_ITEM_MARKETING;
+
+-- Verify ticket categories table
+SELECT COUNT(*) as ticket_category_count FROM TICKET_CATEGORIES;
+
+-- Verify enrichment batches table
+SELECT COUNT(*) as enrichment_batch_count FROM ENRICHMENT_BATCHES;
+
+-- Verify AI result cache table
+SELECT COUNT(*) as cached_result_count FROM AI_RESULT_CACHE;
+
 -- List all stages
 SHOW STAGES;
 
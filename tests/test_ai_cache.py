@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+
+from ai_cache import AIResultCache, SizedLRUCache
+
+SIGNATURE = {'functions': ['AI_COMPLETE'], 'models': ['claude-4-sonnet'], 'options': [], 'input_hash': 'h',
+             'tables': [], 'stages': [], 'expires': False}
+
+
+def make_cache(table_rows=None):
+    """Cache whose table tier records statements and answers lookups with table_rows"""
+    statements = []
+
+    def run_sql(query, params):
+        statements.append(query)
+        return table_rows if "SELECT result_json" in query else []
+
+    cache = AIResultCache(1024 * 1024, "AI_RESULT_CACHE", run_sql, json.dumps, json.loads)
+    return cache, statements
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def test_lru_evicts_least_recently_used_beyond_budget():
+    evicted = []
+    lru = SizedLRUCache(10, on_evict=lambda key, value: evicted.append(key))
+    lru.put('a', 'A', 4)
+    lru.put('b', 'B', 4)
+    assert lru.get('a') == 'A'  # 'b' is now least recently used
+    lru.put('c', 'C', 4)
+
+    assert lru.keys() == ['a', 'c']
+    assert evicted == ['b']
+    assert lru.total_bytes == 8 and lru.evictions == 1
+
+
+def test_lru_skips_oversized_values_and_replaces_existing_keys():
+    lru = SizedLRUCache(10)
+    assert not lru.put('big', 'X', 11)
+    lru.put('a', 'A', 4)
+    lru.put('a', 'AA', 6)
+
+    assert len(lru) == 1 and lru.get('a') == 'AA' and lru.total_bytes == 6
+    assert lru.pop('a') == 'AA' and lru.total_bytes == 0
+    assert lru.get('a') is None
+
+
+def test_fetch_stores_result_and_serves_memory_hits():
+    cache, statements = make_cache()
+    calls = []
+
+    def run():
+        calls.append(1)
+        return [{'ANSWER': 42}], None
+
+    assert cache.fetch('k', SIGNATURE, run) == ([{'ANSWER': 42}], None, None)
+    assert cache.fetch('k', SIGNATURE, run) == ([{'ANSWER': 42}], None, 'ai_cache')
+    assert len(calls) == 1
+    assert any(statement.strip().startswith("MERGE INTO AI_RESULT_CACHE") for statement in statements)
+    assert cache.stats['misses'] == 1 and cache.stats['memory_hits'] == 1 and cache.stats['stores'] == 1
+
+
+def test_fetch_serves_table_hits_into_memory():
+    payload = json.dumps([{'ANSWER': 7}])
+    cache, _ = make_cache(table_rows=[{'RESULT_JSON': payload, 'EXPIRES_EPOCH': time.time() + 60}])
+
+    assert cache.fetch('k', SIGNATURE, lambda: (None, "must not run")) == ([{'ANSWER': 7}], None, 'ai_cache')
+    assert cache.stats['table_hits'] == 1 and len(cache.memory) == 1
+
+
+def run_concurrently(cache, run, waiters):
+    """Start one leader fetch, then `waiters` more once it is in flight; release the leader when all wait"""
+    release = threading.Event()
+    outcomes = []
+
+    def leader_run():
+        release.wait(5)
+        return run()
+
+    def call(run_fn):
+        outcomes.append(cache.fetch('k', SIGNATURE, run_fn))
+
+    threads = [threading.Thread(target=call, args=(leader_run,))]
+    threads[0].start()
+    wait_for(lambda: cache.snapshot()['in_flight'] == 1)
+    for _ in range(waiters):
+        threads.append(threading.Thread(target=call, args=(lambda: (None, "waiter must not run"),)))
+        threads[-1].start()
+    wait_for(lambda: cache.stats['coalesced'] == waiters)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+
+def test_fetch_coalesces_concurrent_callers_onto_one_run():
+    cache, _ = make_cache()
+    calls = []
+
+    def run():
+        calls.append(1)
+        return [{'ANSWER': 42}], None
+
+    outcomes = run_concurrently(cache, run, waiters=5)
+
+    assert len(calls) == 1
+    assert sorted(source or 'leader' for _, _, source in outcomes) == ['coalesced'] * 5 + ['leader']
+    assert all(result == [{'ANSWER': 42}] and error is None for result, error, _ in outcomes)
+    assert cache.stats['misses'] == 1 and cache.snapshot()['in_flight'] == 0
+
+
+def test_fetch_propagates_errors_to_waiters_without_caching_them():
+    cache, _ = make_cache()
+    outcomes = run_concurrently(cache, lambda: (None, "quota exceeded"), waiters=3)
+
+    assert [(result, error) for result, error, _ in outcomes] == [(None, "quota exceeded")] * 4
+    assert cache.stats['stores'] == 0 and len(cache.memory) == 0
+
+
+def test_fetch_propagates_exceptions_to_waiters():
+    cache, _ = make_cache()
+
+    def run():
+        raise RuntimeError("warehouse suspended")
+
+    outcomes = run_concurrently(cache, run, waiters=2)
+
+    assert [error for _, error, _ in outcomes] == ["warehouse suspended"] * 3
+    assert cache.snapshot()['in_flight'] == 0
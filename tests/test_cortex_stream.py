@@ -0,0 +1,45 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from cortex_stream import completion_request, sse_events, stream_complete
+from cortex_stream_stub import make_handler, tokenize
+
+COMPLETION = "Roll With It, Wasabi Wheels and Nori Nomad."
+
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(("localhost", 0), make_handler(COMPLETION, first_token_delay=0.2, token_delay=0.01))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{server.server_address[1]}/api/v2/cortex/inference:complete"
+    server.shutdown()
+    server.server_close()
+
+
+def test_sse_events_joins_multiline_data_and_stops_at_done():
+    lines = [b'data: {"a":\n', b'data: 1}\n', b'\n', b': comment\n', b'data: {"b": 2}\r\n', b'\r\n',
+             b'data: [DONE]\n', b'\n', b'data: {"c": 3}\n', b'\n']
+    assert list(sse_events(lines)) == [{"a": 1}, {"b": 2}]
+
+
+def test_sse_events_yields_unterminated_last_event():
+    assert list(sse_events([b'data: {"a": 1}\n'])) == [{"a": 1}]
+
+
+def test_stream_complete_against_stub(stub_url):
+    stats = {}
+    chunks = list(stream_complete(completion_request(stub_url, "stub-model", "Name three trucks", 0.7), stats))
+
+    assert "".join(chunks) == COMPLETION
+    assert len(chunks) == len(tokenize(COMPLETION))
+    assert stats['tokens'] == len(tokenize(COMPLETION))  # From the final event's usage block
+    assert 0.2 <= stats['ttft'] <= stats['elapsed']
+
+
+def test_completion_request_merges_auth_headers():
+    request = completion_request("http://localhost/complete", "m", "p", 0.1, {"Authorization": "Bearer t"})
+    assert request.get_header("Authorization") == "Bearer t"
+    assert request.get_header("Accept") == "text/event-stream"
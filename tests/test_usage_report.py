@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from usage_report import aggregate_usage, percentile
+
+
+def tag(page, example=None, model=None):
+    return json.dumps({'app': 'ai_functions_playground', 'page': page, 'example': example, 'model': model})
+
+
+def row(query_id, query_tag, elapsed_ms, function=None, tokens=None, credits=None):
+    return {'QUERY_ID': query_id, 'QUERY_TAG': query_tag, 'TOTAL_ELAPSED_TIME': elapsed_ms,
+            'FUNCTION_NAME': function, 'MODEL_NAME': None, 'TOKENS': tokens, 'TOKEN_CREDITS': credits}
+
+
+# Ten AI_COMPLETE queries from one example (100 ms ... 1000 ms), one of which also calls AI_SENTIMENT,
+# plus a query without Cortex usage and one with an unparseable tag
+FIXTURE = [row(f"c{i}", tag('ai_complete', 1, 'claude-4-sonnet'), 100 * i, 'AI_COMPLETE', 10 * i, 0.001 * i)
+           for i in range(1, 11)] + [
+    row("c10", tag('ai_complete', 1, 'claude-4-sonnet'), 1000, 'AI_SENTIMENT', 5, 0.0005),
+    row("s1", tag('ai_sentiment', 2), 40),
+    row("x1", "not json", 7, 'AI_CLASSIFY', 3, 0.002),
+]
+
+
+def test_percentile_nearest_rank():
+    values = [100 * i for i in range(1, 11)]
+    assert percentile(values, 50) == 500
+    assert percentile(values, 95) == 1000
+    assert percentile([7], 95) == 7
+    assert percentile([], 50) is None
+
+
+def test_by_tag_groups_queries_once_with_latency_percentiles():
+    by_tag, _ = aggregate_usage(FIXTURE)
+    groups = {(summary['Page'], summary['Example'], summary['Model']): summary for summary in by_tag}
+
+    complete = groups[('ai_complete', 1, 'claude-4-sonnet')]
+    assert complete['Queries'] == 10  # c10 has two function rows but is one query
+    assert complete['p50 (ms)'] == 500
+    assert complete['p95 (ms)'] == 1000
+    assert complete['Credits'] == pytest.approx(0.0555)
+    assert complete['Tokens'] == 555
+
+    sentiment = groups[('ai_sentiment', 2, None)]
+    assert (sentiment['Queries'], sentiment['Credits'], sentiment['Tokens']) == (1, 0, 0)
+    assert groups[(None, None, None)]['Queries'] == 1
+    assert by_tag[0] is complete  # Most credits first
+
+
+def test_by_function_credits_and_latency():
+    _, by_function = aggregate_usage(FIXTURE)
+    functions = {summary['AI Function']: summary for summary in by_function}
+
+    assert set(functions) == {'AI_COMPLETE', 'AI_SENTIMENT', 'AI_CLASSIFY'}
+    complete = functions['AI_COMPLETE']
+    assert complete['Queries'] == 10
+    assert complete['p50 (ms)'] == 500
+    assert complete['p95 (ms)'] == 1000
+    assert complete['Credits'] == pytest.approx(0.055)
+    assert complete['Credits / Query'] == pytest.approx(0.0055)
+    assert complete['Tokens'] == 550
+
+    sentiment = functions['AI_SENTIMENT']
+    assert (sentiment['Queries'], sentiment['p50 (ms)'], sentiment['Tokens']) == (1, 1000, 5)
+    assert sentiment['Credits'] == pytest.approx(0.0005)
+    assert [summary['AI Function'] for summary in by_function] == ['AI_COMPLETE', 'AI_CLASSIFY', 'AI_SENTIMENT']
@@ -0,0 +1,83 @@
+"""
+Usage report aggregation for the playground (stdlib only).
+
+The app tags every statement with a JSON QUERY_TAG (app, page, example, model).
+aggregate_usage groups SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY rows joined with
+CORTEX_FUNCTIONS_QUERY_USAGE_HISTORY (one row per query and Cortex function, as
+returned by the app's usage_history_query) by those tags and by AI function,
+with nearest-rank p50/p95 latency, credits and tokens:
+
+    by_tag, by_function = aggregate_usage([row.as_dict() for row in rows])
+"""
+
+import json
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None for an empty list)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def aggregate_usage(rows):
+    """Group usage rows (dicts with QUERY_ID, QUERY_TAG, TOTAL_ELAPSED_TIME, FUNCTION_NAME, MODEL_NAME,
+    TOKENS, TOKEN_CREDITS; one row per query and Cortex function) into (by tag, by AI function) summaries"""
+    queries = {}
+    functions = {}
+    for row in rows:
+        query = queries.get(row['QUERY_ID'])
+        if query is None:
+            try:
+                tag = json.loads(row['QUERY_TAG'] or '{}')
+            except ValueError:
+                tag = {}
+            query = queries[row['QUERY_ID']] = {
+                'page': tag.get('page') or tag.get('component'),
+                'example': tag.get('example'),
+                'model': tag.get('model'),
+                'elapsed_ms': float(row['TOTAL_ELAPSED_TIME'] or 0),
+                'credits': 0.0,
+                'tokens': 0
+            }
+        if row.get('FUNCTION_NAME'):
+            credits = float(row.get('TOKEN_CREDITS') or 0)
+            tokens = int(row.get('TOKENS') or 0)
+            query['credits'] += credits
+            query['tokens'] += tokens
+            function = functions.setdefault(row['FUNCTION_NAME'], {'queries': set(), 'credits': 0.0, 'tokens': 0})
+            function['queries'].add(row['QUERY_ID'])
+            function['credits'] += credits
+            function['tokens'] += tokens
+
+    groups = {}
+    for query in queries.values():
+        groups.setdefault((query['page'], query['example'], query['model']), []).append(query)
+    by_tag = [{
+        'Page': page,
+        'Example': example,
+        'Model': model,
+        'Queries': len(group),
+        'p50 (ms)': percentile([q['elapsed_ms'] for q in group], 50),
+        'p95 (ms)': percentile([q['elapsed_ms'] for q in group], 95),
+        'Credits': round(sum(q['credits'] for q in group), 6),
+        'Tokens': sum(q['tokens'] for q in group)
+    } for (page, example, model), group in groups.items()]
+    by_tag.sort(key=lambda summary: (-summary['Credits'], -summary['Queries']))
+
+    by_function = []
+    for name, function in functions.items():
+        latencies = [queries[query_id]['elapsed_ms'] for query_id in function['queries']]
+        by_function.append({
+            'AI Function': name,
+            'Queries': len(latencies),
+            'p50 (ms)': percentile(latencies, 50),
+            'p95 (ms)': percentile(latencies, 95),
+            'Credits': round(function['credits'], 6),
+            'Credits / Query': round(function['credits'] / len(latencies), 6),
+            'Tokens': function['tokens']
+        })
+    by_function.sort(key=lambda summary: -summary['Credits'])
+    return by_tag, by_function